@@ -0,0 +1,111 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Benchmark for the protocol message codecs.
+
+Encodes and decodes typical messages (a service list of a big installation,
+status events, and logfile events) with every codec, and reports the encoded
+size and the encode/decode throughput.
+
+Usage: python bench/codec_bench.py [seconds per measurement]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from marche.codec import CODECS
+from marche.jobs import RUNNING
+from marche.protocol import Event, ServiceListEvent, StatusEvent, \
+    LogfileEvent
+
+
+def service_list(n):
+    services = {}
+    for i in range(n):
+        services['service%d' % i] = {
+            'jobtype': 'nicos',
+            'permissions': [10, 20],
+            'instances': {
+                inst: {'desc': 'NICOS %s of instrument %d' % (inst, i),
+                       'state': RUNNING, 'ext_status': ''}
+                for inst in ('cache', 'poller', 'daemon', 'watchdog')}}
+    return ServiceListEvent(services)
+
+
+def logfiles(nlines):
+    lines = ''.join('12:00:%02d,%03d : INFO    : nicos.%-12s: message %d '
+                    '"quoted"\n' % (i % 60, i % 1000, 'daemon', i)
+                    for i in range(nlines))
+    return LogfileEvent('nicos', 'daemon', {
+        '/var/log/nicos/daemon/daemon-2016-01-31.log': lines},
+        {'/var/log/nicos/daemon/daemon-2016-01-31.log': '1234:%d' %
+         len(lines)})
+
+
+MESSAGES = [
+    ('status event', StatusEvent('nicos', 'daemon', RUNNING, '')),
+    ('service list (200 services)', service_list(200)),
+    ('logfile event (20 lines)', logfiles(20)),
+    ('logfile event (5000 lines)', logfiles(5000)),
+]
+
+
+def measure(func, arg, duration):
+    """Return the number of calls per second."""
+    n = 0
+    start = time.time()
+    while True:
+        for _ in range(10):
+            func(arg)
+        n += 10
+        elapsed = time.time() - start
+        if elapsed > duration:
+            return n / elapsed
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    print('%-30s %-7s %10s %12s %12s %10s %10s' %
+          ('message', 'codec', 'bytes', 'encode/s', 'decode/s',
+           'enc MB/s', 'dec MB/s'))
+    for title, msg in MESSAGES:
+        for name in sorted(CODECS):
+            codec = CODECS[name]
+            data = codec.encode(msg)
+            assert codec.decode(data, Event) == msg
+            enc = measure(codec.encode, msg, duration)
+            dec = measure(lambda d: codec.decode(d, Event), data, duration)
+            print('%-30s %-7s %10d %12.0f %12.0f %10.1f %10.1f' %
+                  (title, name, len(data), enc, dec,
+                   enc * len(data) / 1e6, dec * len(data) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Benchmark for the transfer of large XMLRPC responses.
+
+Runs the XMLRPC interface with a fake job handler that returns big logfiles,
+and connects to it through a proxy that throttles the loopback connection to
+a given bandwidth and latency.  For each kind of request, the bytes on the
+wire and the end-to-end latency are reported, with and without transport
+compression.
+
+Usage: python bench/xmlrpc_transfer.py [kbit/s] [latency in ms] [repeats]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import socket
+import logging
+import threading
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from marche.six.moves import xmlrpc_client
+from marche.config import Config
+from marche.protocol import LogfileEvent
+from marche.permission import ClientInfo, ADMIN
+from marche.iface.xmlrpc import Interface
+
+
+class FakeJobHandler(object):
+    unauth_level = ADMIN
+
+    def request_logfiles(self, client, service, instance):
+        lines = ''.join('12:00:%02d,%03d : INFO    : nicos.%-20s: message %d\n'
+                        % (i % 60, i % 1000, service, i) for i in range(500))
+        return LogfileEvent(service=service, instance=instance, files={
+            '/var/log/nicos/%s/%s-2016-01-31.log' % (name, name): lines
+            for name in ('daemon', 'poller', 'cache')})
+
+
+class FakeAuthHandler(object):
+    def needs_authentication(self):
+        return True
+
+    def authenticate(self, user, passwd):
+        return ClientInfo(ADMIN)
+
+
+class ThrottledProxy(object):
+    """Forwards TCP connections, limiting bandwidth and adding latency in
+    both directions, and counts the transferred bytes."""
+
+    def __init__(self, target, bandwidth, latency):
+        self.target = target
+        self.bandwidth = bandwidth  # bytes per second
+        self.latency = latency      # seconds
+        self.transferred = 0
+        self._lock = threading.Lock()
+        self._listener = socket.socket()
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(5)
+        self.address = self._listener.getsockname()
+        thread = threading.Thread(target=self._accept)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _accept(self):
+        while True:
+            client, _ = self._listener.accept()
+            server = socket.create_connection(self.target)
+            for src, dst in ((client, server), (server, client)):
+                thread = threading.Thread(target=self._forward,
+                                          args=(src, dst))
+                thread.setDaemon(True)
+                thread.start()
+
+    def _forward(self, src, dst):
+        first = True
+        while True:
+            try:
+                data = src.recv(4096)
+            except socket.error:
+                data = b''
+            if not data:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except socket.error:
+                    pass
+                return
+            if first:
+                time.sleep(self.latency)
+                first = False
+            time.sleep(len(data) / float(self.bandwidth))
+            with self._lock:
+                self.transferred += len(data)
+            try:
+                dst.sendall(data)
+            except socket.error:
+                return
+
+
+def make_transport(compress):
+    transport = xmlrpc_client.Transport()
+    transport.accept_gzip_encoding = compress
+    transport.encode_threshold = 1400 if compress else None
+    return transport
+
+
+def main():
+    bandwidth = float(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    config = Config()
+    config.iface_config['xmlrpc'] = {'host': '127.0.0.1', 'port': '0'}
+    log = logging.getLogger('bench')
+    log.addHandler(logging.NullHandler())
+    iface = Interface(config, FakeJobHandler(), FakeAuthHandler(), log)
+    iface.run()
+    proxy = ThrottledProxy(iface.server.server_address,
+                           bandwidth * 1000 / 8., latency / 1000.)
+
+    print('link: %.0f kbit/s, %.0f ms latency' % (bandwidth, latency))
+    print('%-26s %12s %12s' % ('request', 'bytes', 'latency/ms'))
+    for method, args in [('GetLogs', ('svc',)),
+                         ('GetLogs2', ('svc',)),
+                         ('GetLogs2', ('svc', True))]:
+        for compress in (False, True):
+            before = proxy.transferred
+            started = time.time()
+            for _ in range(repeats):
+                # a new connection for every request, like the GUI
+                server = xmlrpc_client.ServerProxy(
+                    'http://bench:bench@%s:%s/xmlrpc' % proxy.address,
+                    transport=make_transport(compress))
+                getattr(server, method)(*args)
+            elapsed = (time.time() - started) / repeats
+            name = '%s(%s)%s' % (method, ', '.join(map(str, args[1:])),
+                                 ' +gzip' if compress else '')
+            print('%-26s %12d %12.1f' % (
+                name, (proxy.transferred - before) / repeats, elapsed * 1000))
+    iface.shutdown()
+
+
+if __name__ == '__main__':
+    main()
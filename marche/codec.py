@@ -0,0 +1,330 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Encodings of protocol messages.
+
+Messages of the Marche protocol can be sent in different encodings, called
+codecs here.  JSON is always supported; others can be negotiated by a client
+when authenticating (see :class:`~marche.protocol.AuthenticateCommand`).
+
+The ``binary`` codec is a compact alternative to JSON.  A message is encoded
+as its type tag (a small integer, see `COMMAND_TYPES` and `EVENT_TYPES`), its
+sequence number, the number of fields, and the values of the fields in the
+order of the message class's constructor arguments.  Each value starts with a
+one-byte type marker; strings and byte strings are sent as their length
+followed by the raw bytes, so that large logfiles and config files need no
+escaping.  Unsigned integers (type tags, lengths and counts) are sent as
+base-128 varints.
+
+Encoding big nested structures value by value in Python is slower than the
+JSON module, so the fields of bulk replies (`JSON_FIELD_TYPES`, e.g. the
+service list and the status of all services) are sent as embedded JSON
+documents instead.  Use ``bench/codec_bench.py`` to compare the codecs.
+"""
+
+import json
+import struct
+import inspect
+
+from marche.six import integer_types, text_type, binary_type, iteritems
+from marche.protocol import PROTO_VERSION, Commands, Events, Command, \
+    Event
+
+# The type tag of a message is its index in these lists.  Never reorder them,
+# only append new types.
+COMMAND_TYPES = [
+    Commands.AUTHENTICATE,
+    Commands.TRIGGER_RELOAD,
+    Commands.SCAN_NETWORK,
+    Commands.START_SERVICE,
+    Commands.STOP_SERVICE,
+    Commands.RESTART_SERVICE,
+    Commands.REQUEST_SERVICE_LIST,
+    Commands.REQUEST_SERVICE_STATUS,
+    Commands.REQUEST_CONTROL_OUTPUT,
+    Commands.REQUEST_LOG_FILES,
+    Commands.REQUEST_CONF_FILES,
+    Commands.SEND_CONF_FILE,
+    Commands.REQUEST_LOG_CATALOGUE,
+    Commands.REQUEST_LOG_FILE,
+    Commands.REQUEST_LOGS_SINCE,
+    Commands.FOLLOW_LOGS,
+    Commands.UNFOLLOW_LOGS,
+    Commands.SEARCH_LOGS,
+    Commands.REQUEST_LOG_RANGE,
+    Commands.REQUEST_ALL_STATUS,
+    Commands.REQUEST_EVENTS_SINCE,
+]
+
+EVENT_TYPES = [
+    Events.CONNECTED,
+    Events.AUTH_RESULT,
+    Events.SERVICE_LIST,
+    Events.ERROR,
+    Events.STATUS,
+    Events.CONTROL_OUTPUT,
+    Events.CONF_FILES,
+    Events.LOG_FILES,
+    Events.FOUND_HOST,
+    Events.LOG_CATALOGUE,
+    Events.ALL_STATUS,
+    Events.EVENTS,
+]
+
+# Messages whose nested fields are sent as JSON by the binary codec.
+JSON_FIELD_TYPES = frozenset([
+    Events.SERVICE_LIST,
+    Events.LOG_CATALOGUE,
+    Events.ALL_STATUS,
+    Events.EVENTS,
+])
+
+
+class JsonCodec(object):
+    """The default encoding, see `SerializableMessage.serialize`."""
+
+    name = 'json'
+
+    def encode(self, message, proto_version=PROTO_VERSION):
+        return message.serialize(proto_version)
+
+    def decode(self, data, base):
+        """Decode a message of the class *base* (`Command` or `Event`).
+
+        Returns None for unknown message types.
+        """
+        return base.unserialize(data)
+
+
+# value type markers of the binary codec
+NONE, TRUE, FALSE, INT, FLOAT, STR, BYTES, LIST, DICT, JSON_DOC = range(10)
+
+double = struct.Struct('>d')
+
+
+def write_uint(buf, n):
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def read_uint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def write_value(buf, value):
+    if value.__class__ is text_type:
+        value = value.encode('utf-8')
+        n = len(value)
+        if n < 0x80:
+            buf.append(STR)
+            buf.append(n)
+        else:
+            buf.append(STR)
+            write_uint(buf, n)
+        buf += value
+    elif value is None:
+        buf.append(NONE)
+    elif value is True:
+        buf.append(TRUE)
+    elif value is False:
+        buf.append(FALSE)
+    elif isinstance(value, integer_types):
+        buf.append(INT)
+        # zigzag encoding for negative numbers
+        write_uint(buf, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif isinstance(value, dict):
+        buf.append(DICT)
+        write_uint(buf, len(value))
+        for key, item in iteritems(value):
+            write_value(buf, key)
+            write_value(buf, item)
+    elif isinstance(value, (list, tuple)):
+        buf.append(LIST)
+        write_uint(buf, len(value))
+        for item in value:
+            write_value(buf, item)
+    elif isinstance(value, float):
+        buf.append(FLOAT)
+        buf += double.pack(value)
+    elif isinstance(value, text_type):
+        write_value(buf, text_type(value))
+    elif isinstance(value, binary_type):
+        buf.append(BYTES)
+        write_uint(buf, len(value))
+        buf += value
+    else:
+        raise TypeError('cannot encode value of type %s' %
+                        type(value).__name__)
+
+
+def write_json(buf, value):
+    if not isinstance(value, (dict, list)):
+        write_value(buf, value)
+        return
+    value = json.dumps(value).encode('utf-8')
+    buf.append(JSON_DOC)
+    write_uint(buf, len(value))
+    buf += value
+
+
+def read_value(data, pos):
+    marker = data[pos]
+    if marker == STR:
+        n = data[pos + 1]
+        if n < 0x80:
+            pos += 2
+        else:
+            n, pos = read_uint(data, pos + 1)
+        return data[pos:pos + n].decode('utf-8'), pos + n
+    pos += 1
+    if marker == INT:
+        n, pos = read_uint(data, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    elif marker == DICT:
+        n, pos = read_uint(data, pos)
+        result = {}
+        for _ in range(n):
+            key, pos = read_value(data, pos)
+            result[key], pos = read_value(data, pos)
+        return result, pos
+    elif marker == LIST:
+        n, pos = read_uint(data, pos)
+        result = []
+        for _ in range(n):
+            item, pos = read_value(data, pos)
+            result.append(item)
+        return result, pos
+    elif marker == NONE:
+        return None, pos
+    elif marker == TRUE:
+        return True, pos
+    elif marker == FALSE:
+        return False, pos
+    elif marker == FLOAT:
+        return double.unpack_from(data, pos)[0], pos + 8
+    elif marker == BYTES:
+        n, pos = read_uint(data, pos)
+        return bytes(data[pos:pos + n]), pos + n
+    elif marker == JSON_DOC:
+        n, pos = read_uint(data, pos)
+        return json.loads(data[pos:pos + n].decode('utf-8')), pos + n
+    raise ValueError('invalid value marker %d' % marker)
+
+
+class BinaryCodec(object):
+    """Compact binary encoding, see the module documentation."""
+
+    name = 'binary'
+
+    def __init__(self):
+        self._tags = {}
+        for types in (COMMAND_TYPES, EVENT_TYPES):
+            for tag, msgtype in enumerate(types):
+                self._tags[msgtype] = tag
+        self._types = {Command: COMMAND_TYPES, Event: EVENT_TYPES}
+        self._fields = {}
+
+    def fields(self, cls):
+        """Return the names of the message class's fields, in order."""
+        try:
+            return self._fields[cls]
+        except KeyError:
+            pass
+        try:
+            getargspec = inspect.getfullargspec
+        except AttributeError:  # Python 2
+            getargspec = inspect.getargspec
+        try:
+            names = getargspec(cls.__init__).args[1:]
+        except TypeError:  # no constructor (Python 2)
+            names = []
+        self._fields[cls] = names
+        return names
+
+    def encode(self, message, proto_version=PROTO_VERSION):
+        # only clients of the current version negotiate this codec
+        buf = bytearray()
+        fields = self.fields(message.__class__)
+        write_uint(buf, self._tags[message.type])
+        write_value(buf, message.seq)
+        write_uint(buf, len(fields))
+        if message.type in JSON_FIELD_TYPES:
+            for name in fields:
+                write_json(buf, getattr(message, name))
+        else:
+            for name in fields:
+                write_value(buf, getattr(message, name))
+        return bytes(buf)
+
+    def decode(self, data, base):
+        """Decode a message of the class *base* (`Command` or `Event`).
+
+        Returns None for unknown message types.
+        """
+        data = bytearray(data)
+        tag, pos = read_uint(data, 0)
+        types = self._types[base]
+        if tag >= len(types) or types[tag] not in base.registry:
+            return None
+        cls = base.registry[types[tag]]
+        seq, pos = read_value(data, pos)
+        n, pos = read_uint(data, pos)
+        values = []
+        for _ in range(n):
+            value, pos = read_value(data, pos)
+            values.append(value)
+        # ignore fields added in newer versions
+        msg = cls(*values[:len(self.fields(cls))])
+        if seq is not None:
+            msg.seq = seq
+        return msg
+
+
+JSON = JsonCodec()
+
+#: All supported codecs by name.
+CODECS = {
+    'json': JSON,
+    'binary': BinaryCodec(),
+}
+
+
+def negotiate(names):
+    """Return the first codec from *names* that is supported.
+
+    Falls back to JSON if there is none.
+    """
+    for name in names or ():
+        if name in CODECS:
+            return CODECS[name]
+    return JSON
@@ -51,6 +51,7 @@ class Config(object):
     iface_config = {}
     interfaces = ['xmlrpc', 'udp']
     unauth_level = DISPLAY
+    pollworkers = 0
 
     def __init__(self, confdir=None):
         self.confdir = confdir
@@ -92,6 +93,8 @@ class Config(object):
                     perm = parser.get('general', 'unauth_level')
                     self.unauth_level = STRING_LEVELS.get(perm.lower().strip(),
                                                           DISPLAY)
+                if parser.has_option('general', 'pollworkers'):
+                    self.pollworkers = parser.getint('general', 'pollworkers')
             elif section.startswith('job.'):
                 self.job_config[section[4:]] = dict(parser.items(section))
             elif section.startswith('auth.'):
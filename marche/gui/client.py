@@ -24,6 +24,7 @@
 # *****************************************************************************
 
 import time
+import zlib
 import socket
 import threading
 from collections import OrderedDict
@@ -49,19 +50,47 @@ class PollThread(QThread):
         self.running = True
 
     def run(self):
+        services = None
         while self.running:
             try:
-                services = self._client.getServices()
+                states = self._client.getAllStatus()
             except Exception:
-                services = OrderedDict()
                 self.newData.emit(None, None, NOT_AVAILABLE, '')
+                time.sleep(self._loopDelay)
+                continue
 
-            for service, instances in iteritems(services):
-                for instance in instances:
-                    self.poll(service, instance)
+            if states is None:
+                # older daemon: query services one by one
+                self.pollEach()
+            else:
+                for (service, instance), (state, _) in iteritems(states):
+                    self.newData.emit(service, instance, state, None)
+                # services without a polled status (not polled yet, or
+                # polling disabled) are queried one by one
+                if services is None:
+                    services = self.getServices()
+                for service, instances in iteritems(services):
+                    for instance in instances:
+                        if (service, instance) not in states:
+                            self.poll(service, instance)
+                if not services:
+                    services = None  # try again next time
 
             time.sleep(self._loopDelay)
 
+    def getServices(self):
+        try:
+            return self._client.getServices()
+        except Exception:
+            self.newData.emit(None, None, NOT_AVAILABLE, '')
+            return OrderedDict()
+
+    def pollEach(self):
+        services = self.getServices()
+        for service, instances in iteritems(services):
+            for instance in instances:
+                self.poll(service, instance)
+
     def poll(self, service, instance):
         try:
             status = self._client.getServiceStatus(service, instance)
@@ -78,6 +107,12 @@ class ClientError(Exception):
 
 
 class HttpTransport(xmlrpc.Transport):
+    # Compress large requests (responses are decompressed automatically).
+    encode_threshold = 1400
+
+    # The connection is kept alive between requests.  The base class already
+    # reconnects once if the server has closed a reused connection, and only
+    # if the request cannot have been handled, so calls are not repeated.
     def make_connection(self, host):
         retval = xmlrpc.Transport.make_connection(self, host)
         self._connection[1].timeout = 2.0
@@ -101,6 +136,8 @@ class Client(object):
                                              transport=HttpTransport())
         self._lock = threading.Lock()
         self._pollThread = None
+        self._hasLogs2 = True
+        self._hasAllStatus = True
         self.version = self.getVersion()
 
     def stopPoller(self, join=False):
@@ -212,6 +249,31 @@ class Client(object):
         except xmlrpc.Fault as f:
             raise ClientError(f.faultCode, f.faultString)
 
+    def getAllStatus(self):
+        """Return a dict mapping (service, instance) to (state, ext_status).
+
+        Returns None if the daemon does not support querying all states
+        at once.
+        """
+        if not self._hasAllStatus:
+            return None
+        try:
+            with self._lock:
+                states = self._proxy.GetAllStatus()
+        except socket.error as e:
+            raise ClientError(99, 'marched: %s' % e)
+        except xmlrpc.Fault as f:
+            if 'not supported' not in f.faultString:
+                raise ClientError(f.faultCode, f.faultString)
+            # older daemon
+            self._hasAllStatus = False
+            return None
+        result = {}
+        for path, (state, ext_status) in iteritems(states):
+            service, _, instance = path.partition('.')
+            result[service, instance] = (state, ext_status)
+        return result
+
     def getServiceOutput(self, service, instance=''):
         servicePath = self.getServicePath(service, instance)
         try:
@@ -223,14 +285,40 @@ class Client(object):
             raise ClientError(f.faultCode, f.faultString)
 
     def getServiceLogs(self, service, instance=''):
+        """Return a list of (filename, content) tuples."""
         servicePath = self.getServicePath(service, instance)
         try:
+            if self._hasLogs2:
+                try:
+                    with self._lock:
+                        entries = self._proxy.GetLogs2(servicePath, True)
+                except xmlrpc.Fault as f:
+                    if 'not supported' not in f.faultString:
+                        raise
+                    # older daemon
+                    self._hasLogs2 = False
+                else:
+                    result = []
+                    for entry in entries:
+                        content = entry['content'].data
+                        if entry['compressed']:
+                            content = zlib.decompress(content)
+                        result.append((entry['name'],
+                                       content.decode('utf-8')))
+                    return result
             with self._lock:
-                return self._proxy.GetLogs(servicePath)
+                loglines = self._proxy.GetLogs(servicePath)
         except socket.error as e:
             raise ClientError(99, 'marched: %s' % e)
         except xmlrpc.Fault as f:
             raise ClientError(f.faultCode, f.faultString)
+        logs = []
+        for logline in loglines:
+            filename, content = logline.split(':', 1)
+            if not logs or filename != logs[-1][0]:
+                logs.append((filename, []))
+            logs[-1][1].append(content)
+        return [(filename, ''.join(content)) for (filename, content) in logs]
 
     def getVersion(self):
         with self._lock:
@@ -294,29 +294,22 @@ class JobButtons(QWidget):
     def on_actionShow_logfiles_triggered(self):
         self._item.setText(3, '')
         try:
-            loglines = self._client.getServiceLogs(self._service,
-                                                   self._instance)
+            logs = self._client.getServiceLogs(self._service, self._instance)
         except ClientError as err:
             self._item.setText(3, str(err))
             return
-        if not loglines:
+        if not logs:
             self._item.setText(3, 'Service does not return logs')
             return
         dlg = QDialog(self)
         loadUi(dlg, 'details.ui')
         dlg.tabber.clear()
-        logs = []
-        for logline in loglines:
-            filename, content = logline.split(':', 1)
-            if not logs or filename != logs[-1][0]:
-                logs.append((filename, []))
-            logs[-1][1].append(content)
         for filename, content in logs:
             widget = QPlainTextEdit(dlg)
             font = widget.font()
             font.setFamily('Monospace')
             widget.setFont(font)
-            widget.setPlainText(''.join(content))
+            widget.setPlainText(content)
             widget.moveCursor(QTextCursor.End)
             widget.ensureCursorVisible()
             dlg.tabber.addTab(widget, filename)
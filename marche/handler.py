@@ -26,12 +26,17 @@
 """Job control dispatcher."""
 
 import uuid
+import threading
+from collections import deque
 
 from marche.six import iteritems
 
 from marche.protocol import ServiceListEvent, ControlOutputEvent, \
-    ConffileEvent, LogfileEvent, StatusEvent, FoundHostEvent
+    ConffileEvent, LogfileEvent, LogCatalogueEvent, StatusEvent, \
+    FoundHostEvent, AllStatusEvent, EventsEvent, ServiceEvent
 from marche.jobs import Busy, Fault
+from marche.logs import LogFollower
+from marche.polling import scheduler
 from marche.scan import scan_async
 from marche.permission import ClientInfo, DISPLAY, CONTROL, ADMIN
 
@@ -65,6 +70,9 @@ def command(silent=False):
 
 class JobHandler(object):
 
+    #: Number of recent events kept for `request_events_since`.
+    journal_size = 1000
+
     def __init__(self, config, log):
         self.config = config
         self.log = log
@@ -73,9 +81,18 @@ class JobHandler(object):
         self.service2job = {}
         self.interfaces = []
         self.unauth_level = config.unauth_level
+        # (service, instance) -> [follower, {client: refcount}]
+        self._followers = {}
+        self._followers_lock = threading.Lock()
+        self._seq = 0
+        self._journal = deque()
+        self._journal_dropped = 0  # last sequence number no longer journaled
+        self._journal_lock = threading.Lock()
+        scheduler.max_workers = config.pollworkers
         self._add_jobs()
 
     def shutdown(self):
+        self._stop_followers()
         for job in list(self.jobs.values()):
             job.shutdown()
         self.jobs = {}
@@ -126,16 +143,36 @@ class JobHandler(object):
             raise Fault('no such service: %s' % service)
 
     def emit_event(self, event):
-        """Emit an event to all connected clients."""
-        for iface in self.interfaces:
-            iface.emit_event(event)
+        """Emit an event to all connected clients.
+
+        Every event is stamped with a sequence number.  Except for new data in
+        followed logfiles, events are also kept in the journal.
+        """
+        with self._journal_lock:
+            self._seq += 1
+            event.seq = self._seq
+            if not isinstance(event, LogfileEvent):
+                while len(self._journal) >= self.journal_size:
+                    self._journal_dropped = self._journal.popleft().seq
+                self._journal.append(event)
+            # keep interfaces from seeing events out of order
+            for iface in self.interfaces:
+                iface.emit_event(event)
+
+    def _stop_followers(self):
+        with self._followers_lock:
+            for follower, _ in self._followers.values():
+                follower.stop()
+            self._followers.clear()
 
     @command()
     def trigger_reload(self):
         """Trigger a reload of the jobs and list of their services."""
+        self._stop_followers()
         for job in list(self.jobs.values()):
             job.shutdown()
         self.config.reload()
+        scheduler.max_workers = self.config.pollworkers
         self.jobs = {}
         self.service2job = {}
         self._add_jobs()
@@ -157,24 +194,76 @@ class JobHandler(object):
         The service list is sent back as a single ServiceListEvent."""
         svcs = {}
         for job in self.jobs.values():
-            with job.lock:
-                for service, instance in job.get_services():
-                    if not job.has_permission(DISPLAY, client):
-                        continue
-                    if service not in svcs:
-                        svcs[service] = {
-                            'instances': {},
-                            'permissions': job.determine_permissions(client),
-                            'jobtype': job.jobtype,
-                        }
-                    state, ext = job.polled_service_status(service, instance)
-                    svcs[service]['instances'][instance] = {
-                        'desc': job.service_description(service, instance),
-                        'state': state,
-                        'ext_status': ext,
+            for service, instance in job.get_services():
+                if not job.has_permission(DISPLAY, client):
+                    continue
+                if service not in svcs:
+                    svcs[service] = {
+                        'instances': {},
+                        'permissions': job.determine_permissions(client),
+                        'jobtype': job.jobtype,
                     }
+                state, ext = job.polled_service_status(service, instance)
+                svcs[service]['instances'][instance] = {
+                    'desc': job.service_description(service, instance),
+                    'state': state,
+                    'ext_status': ext,
+                }
         return ServiceListEvent(services=svcs)
 
+    @command(silent=True)
+    def request_all_status(self, client):
+        """Return the polled status of all services the client can see.
+
+        The states are sent back as a single AllStatusEvent.  They are taken
+        only from the poller cache; services without a polled status (not
+        polled yet, polling disabled, or the last probe failed) are left out
+        instead of being queried here, and clients should query them one by
+        one."""
+        svcs = {}
+        for job in self.jobs.values():
+            if not job.has_permission(DISPLAY, client):
+                continue
+            for service, instance in job.get_services():
+                result = job.poller.cached(service, instance)
+                if result is not None:
+                    svcs.setdefault(service, {})[instance] = result
+        return AllStatusEvent(services=svcs)
+
+    @command(silent=True)
+    def request_events_since(self, client, since):
+        """Return the journaled events after sequence number *since* that the
+        client can see, and the last sequence number.
+
+        If some of these events are no longer in the journal, or the sequence
+        number is newer than the last event, no events are returned and the
+        ``resync`` flag is set: the client must then request the full state
+        again.  Clients must also do that if the returned ``uid`` differs from
+        the one they saw before, since the daemon has been restarted then.
+        """
+        with self._journal_lock:
+            last = self._seq
+            if since < self._journal_dropped or since > last:
+                return EventsEvent(events=[], last=last, resync=True,
+                                   uid=self.uid)
+            journal = [event for event in self._journal if event.seq > since]
+        events = []
+        for event in journal:
+            try:
+                if isinstance(event, ServiceListEvent):
+                    filtered = self.filter_services(client, event)
+                    filtered.seq = event.seq
+                    event = filtered
+                elif isinstance(event, ServiceEvent):
+                    if not self.can_see_status(client, event):
+                        continue
+            except Fault:
+                # service vanished in a reload
+                continue
+            events.append(event.to_dict())
+        return EventsEvent(events=events, last=last, resync=False,
+                           uid=self.uid)
+
     def filter_services(self, client, event):
         """Filter a service list event to only jobs that the client can see."""
         if client.level == ADMIN:
@@ -193,15 +282,14 @@ class JobHandler(object):
     def get_service_description(self, client, service, instance):
         job = self._get_job(service)
         job.check_permission(DISPLAY, client)
-        with job.lock:
-            return job.service_description(service, instance)
+        return job.service_description(service, instance)
 
     @command()
     def start_service(self, client, service, instance):
         """Start a single service."""
         job = self._get_job(service)
         job.check_permission(CONTROL, client)
-        with job.lock:
+        with job.service_lock(service, instance):
             job.invalidate(service, instance)
             job.start_service(service, instance)
             job.poll_now()
@@ -211,7 +299,7 @@ class JobHandler(object):
         """Stop a single service."""
         job = self._get_job(service)
         job.check_permission(CONTROL, client)
-        with job.lock:
+        with job.service_lock(service, instance):
             job.invalidate(service, instance)
             job.stop_service(service, instance)
             job.poll_now()
@@ -221,7 +309,7 @@ class JobHandler(object):
         """Restart a single service."""
         job = self._get_job(service)
         job.check_permission(CONTROL, client)
-        with job.lock:
+        with job.service_lock(service, instance):
             job.invalidate(service, instance)
             job.restart_service(service, instance)
             job.poll_now()
@@ -231,8 +319,7 @@ class JobHandler(object):
         """Return the status of a single service."""
         job = self._get_job(service)
         job.check_permission(DISPLAY, client)
-        with job.lock:
-            state, ext = job.polled_service_status(service, instance)
+        state, ext = job.polled_service_status(service, instance)
         return StatusEvent(service=service, instance=instance,
                            state=state, ext_status=ext)
 
@@ -241,8 +328,7 @@ class JobHandler(object):
         """Return the last lines of output from starting/stopping."""
         job = self._get_job(service)
         job.check_permission(DISPLAY, client)
-        with job.lock:
-            output = job.service_output(service, instance)
+        output = job.service_output(service, instance)
         return ControlOutputEvent(service=service, instance=instance,
                                   content=output)
 
@@ -251,8 +337,120 @@ class JobHandler(object):
         """Return the most recent lines of the service's logfile."""
         job = self._get_job(service)
         job.check_permission(DISPLAY, client)
-        with job.lock:
-            logfiles = job.service_logs(service, instance)
+        logfiles = job.service_logs(service, instance)
+        return LogfileEvent(service=service, instance=instance, files=logfiles)
+
+    @command(silent=True)
+    def request_logs_since(self, client, service, instance, cursors):
+        """Return the data appended to the service's logfiles since the
+        given cursors, together with new cursors."""
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        logfiles, cursors = job.service_logs_since(service, instance, cursors)
+        return LogfileEvent(service=service, instance=instance, files=logfiles,
+                            cursors=cursors)
+
+    @command()
+    def follow_logfiles(self, client, service, instance):
+        """Start following the service's logfiles.
+
+        Returns the most recent lines of the logfiles, with cursors.  After
+        that, LogfileEvents with the newly appended data and cursors are
+        emitted while the logfiles are followed.  Interfaces should only pass
+        them on to clients that follow the service's logfiles.
+
+        Every call must be balanced by a call to `unfollow_logfiles` with the
+        same *client* object, which identifies the subscription.
+        """
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        key = (service, instance)
+        with self._followers_lock:
+            entry = self._followers.get(key)
+            if entry is not None:
+                entry[1][client] = entry[1].get(client, 0) + 1
+        if entry is None:
+            logfiles, cursors = job.service_logs_since(service, instance, {})
+            with self._followers_lock:
+                entry = self._followers.get(key)
+                if entry is None:
+                    def callback(files, cursors):
+                        self.emit_event(LogfileEvent(
+                            service=service, instance=instance, files=files,
+                            cursors=cursors))
+                    follower = LogFollower(
+                        job.service_logfiles(service, instance), callback,
+                        cursors, job.dated_logs)
+                    follower.start()
+                    self._followers[key] = [follower, {client: 1}]
+                    return LogfileEvent(service=service, instance=instance,
+                                        files=logfiles, cursors=cursors)
+                entry[1][client] = entry[1].get(client, 0) + 1
+        # join the existing follower where it has got to, so that its next
+        # events continue the returned data without repeating any of it
+        if entry[0].logfiles:
+            logfiles, cursors = entry[0].snapshot()
+        else:
+            logfiles, cursors = job.service_logs_since(service, instance, {})
+        return LogfileEvent(service=service, instance=instance, files=logfiles,
+                            cursors=cursors)
+
+    @command()
+    def unfollow_logfiles(self, client, service, instance):
+        """Stop following the service's logfiles.
+
+        Only releases a subscription made by the same *client*.
+        """
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        with self._followers_lock:
+            entry = self._followers.get((service, instance))
+            if entry is None or client not in entry[1]:
+                return
+            entry[1][client] -= 1
+            if not entry[1][client]:
+                del entry[1][client]
+            if not entry[1]:
+                entry[0].stop()
+                del self._followers[service, instance]
+
+    @command()
+    def search_logfiles(self, client, service, instance, regex, since=None,
+                        limit=None):
+        """Return the lines of the service's logfiles, including rotated
+        ones, that match the regular expression."""
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        logfiles = job.service_search_logs(service, instance, regex, since,
+                                           limit)
+        return LogfileEvent(service=service, instance=instance, files=logfiles)
+
+    @command()
+    def request_log_range(self, client, service, instance, t_start, t_end):
+        """Return the lines of the service's logfiles, including rotated
+        ones, that were logged in the given time range."""
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        logfiles = job.service_log_range(service, instance, t_start, t_end)
+        return LogfileEvent(service=service, instance=instance, files=logfiles)
+
+    @command(silent=True)
+    def request_log_catalogue(self, client, service, instance):
+        """Return a list of the service's logfiles, including rotated ones,
+        with their sizes and modification times."""
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        catalogue = job.service_log_catalogue(service, instance)
+        return LogCatalogueEvent(service=service, instance=instance,
+                                 files=catalogue)
+
+    @command()
+    def request_logfile(self, client, service, instance, filename):
+        """Return the most recent lines of a single logfile from the
+        service's log catalogue."""
+        job = self._get_job(service)
+        job.check_permission(DISPLAY, client)
+        logfiles = job.service_logfile(service, instance, filename)
         return LogfileEvent(service=service, instance=instance, files=logfiles)
 
     @command()
@@ -263,7 +461,7 @@ class JobHandler(object):
         """
         job = self._get_job(service)
         job.check_permission(ADMIN, client)
-        with job.lock:
+        with job.service_lock(service, instance):
             confs = job.receive_config(service, instance)
         return ConffileEvent(service=service, instance=instance, files=confs)
 
@@ -279,5 +477,5 @@ class JobHandler(object):
         """
         job = self._get_job(service)
         job.check_permission(ADMIN, client)
-        with job.lock:
+        with job.service_lock(service, instance):
             job.send_config(service, instance, filename, contents)
@@ -0,0 +1,267 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+""".. index:: sse; interface
+
+.. _sse-iface:
+
+Server-Sent Events interface
+----------------------------
+
+This interface streams the daemon's events over HTTP, using the `Server-Sent
+Events <https://html.spec.whatwg.org/multipage/server-sent-events.html>`_
+format, for dashboards and other tools that can only use HTTP.  It does not
+allow controlling services.
+
+Clients request ``GET /events`` (with HTTP basic authentication, if
+authentication is configured).  The response is a stream that starts with a
+``services`` event containing the current service list, followed by every
+status change and service list update the client may see.  The event name is
+the protocol's event type, and the data is the JSON serialization of the event
+as described in :mod:`marche.protocol`::
+
+   event: status
+   id: 0a36b4e1f7f04a3fa0d8bcfb6c2b1f3c:1234
+   data: {"type": "status", "service": "...", "instance": "...", ...}
+
+When a client reconnects with the last event ID it received (in the
+``Last-Event-ID`` header, which browsers send automatically), only the events
+it missed are sent instead of the service list, if the daemon still has them.
+
+All connections are served from a single thread using :mod:`asyncio`, so the
+interface requires Python 3.5 or newer.
+
+.. describe:: [interfaces.sse]
+
+   The configuration settings that can be set within the **interfaces.sse**
+   section are:
+
+   .. describe:: port
+
+      **Default:** 8126
+
+      The port to listen for HTTP requests.
+
+   .. describe:: host
+
+      **Default:** 0.0.0.0
+
+      The host to bind to.
+
+   .. describe:: keepalive
+
+      **Default:** 15
+
+      The interval in seconds at which a comment is sent on idle streams, to
+      keep proxies from closing them and to detect vanished clients.
+"""
+
+import base64
+import asyncio
+
+from marche.auth import AuthFailed
+from marche.iface.stream import StreamInterface, \
+    Connection as BaseConnection
+from marche.protocol import Event, LogfileEvent
+from marche.permission import ClientInfo
+
+SSE_PORT = 8126
+
+RESPONSES = {
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+}
+
+
+class Connection(BaseConnection):
+
+    def __init__(self, writer, client):
+        BaseConnection.__init__(self, writer, client)
+        # (seq, data) of events emitted before the initial snapshot was sent
+        self.pending = []
+
+
+class Interface(StreamInterface):
+
+    iface_name = 'sse'
+    default_port = SSE_PORT
+    #: Time in seconds to wait for the request headers.
+    request_timeout = 10
+
+    def init(self):
+        StreamInterface.init(self)
+        # sequence number of the event being broadcast
+        self._sending_seq = None
+
+    def _filter(self, conn, event):
+        if isinstance(event, LogfileEvent):
+            # logfiles cannot be followed over this interface
+            return None
+        return StreamInterface._filter(self, conn, event)
+
+    def _encode(self, conn, event):
+        data = b'event: ' + event.type.encode() + b'\n'
+        if event.seq is not None:
+            data += ('id: %s:%d\n' % (self.jobhandler.uid, event.seq)).encode()
+        return data + b'data: ' + event.serialize() + b'\n\n'
+
+    def _broadcast(self, event):
+        # remember the sequence number for events held back by _send
+        self._sending_seq = event.seq
+        try:
+            StreamInterface._broadcast(self, event)
+        finally:
+            self._sending_seq = None
+
+    def _send(self, conn, data):
+        if conn.pending is not None:
+            conn.pending.append((self._sending_seq, data))
+        else:
+            StreamInterface._send(self, conn, data)
+
+    def _error(self, writer, code, headers=''):
+        reason = RESPONSES[code]
+        writer.write(('HTTP/1.1 %d %s\r\n%sContent-Type: text/plain\r\n'
+                      'Content-Length: %d\r\nConnection: close\r\n\r\n%s\n' %
+                      (code, reason, headers, len(reason) + 1,
+                       reason)).encode())
+
+    async def _read_request(self, reader):
+        """Read the request headers and return (method, path, headers)."""
+        data = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                      self.request_timeout)
+        lines = data.decode('latin-1').split('\r\n')
+        method, path, _ = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        return method, path.split('?')[0], headers
+
+    async def _authenticate(self, headers):
+        """Return the client info for the request, or None."""
+        if not self.authhandler.needs_authentication():
+            return ClientInfo(self.jobhandler.unauth_level)
+        try:
+            scheme, creds = headers['authorization'].split()
+            if scheme.lower() != 'basic':
+                return None
+            decoded = base64.b64decode(creds.encode()).decode('utf-8')
+            user, passwd = decoded.split(':', 1)
+            return await self._call(self.authhandler.authenticate,
+                                    user, passwd)
+        except (KeyError, ValueError, AuthFailed):
+            return None
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, path, headers = await self._read_request(reader)
+            except ValueError:
+                self._error(writer, 400)
+                return
+            if path != '/events':
+                self._error(writer, 404)
+                return
+            if method != 'GET':
+                self._error(writer, 405, 'Allow: GET\r\n')
+                return
+            client = await self._authenticate(headers)
+            if client is None:
+                self._error(writer, 401,
+                            'WWW-Authenticate: Basic realm="marche"\r\n')
+                return
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\n\r\n')
+            await self._stream(reader, Connection(writer, client),
+                               headers.get('last-event-id'))
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.log.exception('error while serving events')
+        finally:
+            writer.close()
+
+    async def _replay(self, conn, last_id):
+        """Return the events missed since the given event ID, or None if
+        they are not available."""
+        try:
+            uid, since = last_id.rsplit(':', 1)
+            since = int(since)
+        except ValueError:
+            return None
+        if uid != self.jobhandler.uid:
+            return None
+        journal = await self._call(self.jobhandler.request_events_since,
+                                   conn.client, since)
+        if journal.resync:
+            return None
+        return [Event.from_dict(event) for event in journal.events]
+
+    async def _stream(self, reader, conn, last_id):
+        self.log.debug('%s:%s: subscribed' % conn.peer[:2])
+        # register before taking the snapshot so that no change is missed;
+        # events are held back until the snapshot is sent
+        seen = self._last_seq
+        self._connections.add(conn)
+        try:
+            events = None
+            if last_id:
+                events = await self._replay(conn, last_id)
+            if events is None:
+                snapshot = await self._call(
+                    self.jobhandler.request_service_list, conn.client)
+                # the snapshot includes all changes up to this event
+                snapshot.seq = seen
+                events = [snapshot]
+            # events up to this one are sent now; the replayed journal can
+            # overlap with the events held back since registering
+            sent = max([seen] + [event.seq for event in events
+                                 if event.seq is not None])
+            pending, conn.pending = conn.pending, None
+            for event in events:
+                self._send(conn, self._encode(conn, event))
+            for seq, data in pending:
+                if seq is None or seq > sent:
+                    self._send(conn, data)
+            keepalive = float(self.config.get('keepalive', 15))
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(1024),
+                                                  keepalive)
+                except asyncio.TimeoutError:
+                    self._send(conn, b': keepalive\n\n')
+                    continue
+                if not data:
+                    break
+        finally:
+            self._connections.discard(conn)
+            self.log.debug('%s:%s: unsubscribed' % conn.peer[:2])
@@ -0,0 +1,181 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Base class for interfaces that push events over asyncio streams."""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from marche.codec import JSON
+from marche.iface.base import Interface as BaseInterface
+from marche.protocol import ServiceEvent, ServiceListEvent
+
+
+class Connection(object):
+    """State of a single client connection."""
+
+    def __init__(self, writer, client):
+        self.writer = writer
+        self.peer = writer.get_extra_info('peername')
+        # None until the client has authenticated, if that is required
+        self.client = client
+        self.codec = JSON
+        # until the client tells us its version, send messages that
+        # version 2 peers understand
+        self.proto_version = 2
+
+
+class StreamInterface(BaseInterface):
+    """Serves all connections from one thread running an asyncio event loop.
+
+    Subclasses implement `_handle` (the connection handler coroutine) and
+    `_encode` (which must only depend on the connection's codec and
+    protocol version), and add
+    their connections to ``self._connections`` to receive events.  Commands
+    that can block must be run using `_call`.
+    """
+
+    #: Port used if none is configured.
+    default_port = None
+    #: Clients with more unsent event data than this are disconnected.
+    max_buffer = 16 * 1024 * 1024
+
+    def init(self):
+        self._loop = None
+        self._thread = None
+        self._connections = set()
+        # tasks running `_handle` for the open connections
+        self._tasks = set()
+        # sequence number of the last event that was distributed
+        self._last_seq = 0
+
+    def run(self):
+        host = self.config.get('host', '0.0.0.0')
+        port = int(self.config.get('port', self.default_port))
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(
+            ThreadPoolExecutor(int(self.config.get('workers', 8))))
+        self.server = self._loop.run_until_complete(self._start(host, port))
+        self.log.info('listening on %s:%s' % (host, port))
+        self._thread = threading.Thread(target=self._run_loop)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    async def _start(self, host, port):
+        return await asyncio.start_server(self._connected, host, port)
+
+    def _connected(self, reader, writer):
+        task = self._loop.create_task(self._handle(reader, writer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._stop()
+
+    def _stop(self):
+        # runs after the loop has stopped: let the connection handlers run
+        # their cleanup before closing the loop
+        self.server.close()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.run_until_complete(self.server.wait_closed())
+        self._loop.close()
+
+    async def _handle(self, reader, writer):
+        raise NotImplementedError('implement %s._handle()' %
+                                  self.__class__.__name__)
+
+    def _call(self, func, *args):
+        """Run a (possibly slow) function in the thread pool."""
+        return self._loop.run_in_executor(None, func, *args)
+
+    # Event distribution
+
+    def emit_event(self, event):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broadcast, event)
+
+    def _broadcast(self, event):
+        if event.seq is not None:
+            self._last_seq = event.seq
+        encoded = {}
+        for conn in list(self._connections):
+            if conn.client is None:
+                continue
+            try:
+                filtered = self._filter(conn, event)
+            except Exception:
+                self.log.exception('could not filter event %r' % event)
+                continue
+            if filtered is None:
+                continue
+            if filtered is event:
+                # encode only once for all clients that see the same event
+                key = (conn.codec.name, conn.proto_version)
+                data = encoded.get(key)
+                if data is None:
+                    data = encoded[key] = self._encode(conn, event)
+                self._send(conn, data)
+            else:
+                if event.seq is not None:
+                    filtered.seq = event.seq
+                self._send(conn, self._encode(conn, filtered))
+
+    def _filter(self, conn, event):
+        """Return the event as the client should see it, or None."""
+        if isinstance(event, ServiceListEvent):
+            return self.jobhandler.filter_services(conn.client, event)
+        if isinstance(event, ServiceEvent):
+            if not self.jobhandler.can_see_status(conn.client, event):
+                return None
+        return event
+
+    def _encode(self, conn, event):
+        """Return the bytes to send for the event."""
+        raise NotImplementedError('implement %s._encode()' %
+                                  self.__class__.__name__)
+
+    def _send(self, conn, data):
+        transport = conn.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.max_buffer:
+            self.log.warning('%s:%s: client does not read events, '
+                             'disconnecting' % conn.peer[:2])
+            conn.writer.close()
+            return
+        conn.writer.write(data)
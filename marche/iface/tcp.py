@@ -0,0 +1,297 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+""".. index:: tcp; interface
+
+.. _tcp-iface:
+
+TCP interface
+-------------
+
+This interface speaks the Marche protocol (see :mod:`marche.protocol`) over a
+plain TCP connection.  Unlike the XMLRPC interface, it pushes events (status
+changes, service list updates, and new data in followed logfiles) to connected
+clients, so that they do not need to poll.
+
+Every message is sent as a frame consisting of its length as a 4-byte
+big-endian unsigned integer, followed by the encoded command (from the client)
+or event (from the daemon).  Messages are JSON-encoded at first.
+
+On connection, the daemon sends a ``ConnectedEvent``.  If authentication is
+configured, the client must then send an ``AuthenticateCommand``, which is
+answered by an ``AuthEvent``; the credentials apply to the whole connection.
+The client can also list the codecs it supports in the command (see
+:mod:`marche.codec`); the daemon then names the codec used for all further
+messages in both directions in the ``AuthEvent``.
+Commands are processed in order; those that return information are answered by
+the corresponding event, failures by an ``ErrorEvent``.
+
+Pushed events carry a sequence number (``seq``).  After reconnecting, a client
+can get the events it missed with a ``RequestEventsSinceCommand`` instead of
+requesting the whole service list again.
+
+Fields added in protocol version 3, like ``seq`` and the logfile ``cursors``,
+are only sent to clients that give their protocol version in the
+``AuthenticateCommand``.
+
+All connections are served from a single thread using :mod:`asyncio`, so the
+interface requires Python 3.5 or newer.
+
+.. describe:: [interfaces.tcp]
+
+   The configuration settings that can be set within the **interfaces.tcp**
+   section are:
+
+   .. describe:: port
+
+      **Default:** 8125
+
+      The port to listen for connections.
+
+   .. describe:: host
+
+      **Default:** 0.0.0.0
+
+      The host to bind to.
+
+   .. describe:: workers
+
+      **Default:** 8
+
+      The number of threads that execute commands.  Commands of a single
+      connection are always executed one after the other.
+"""
+
+import struct
+import asyncio
+
+from marche import __version__
+from marche.jobs import Busy, Fault, Unauthorized
+from marche.auth import AuthFailed
+from marche.codec import negotiate
+from marche.iface.stream import StreamInterface, \
+    Connection as BaseConnection
+from marche.protocol import PROTO_VERSION, Commands, Errors, Command, \
+    AuthenticateCommand, ServiceCommand, ConnectedEvent, AuthEvent, \
+    ErrorEvent, LogfileEvent
+from marche.permission import ClientInfo
+
+TCP_PORT = 8125
+
+HEADER = struct.Struct('>I')
+
+# command type -> (handler method, command attributes passed as arguments,
+# whether the client info is passed)
+DISPATCH = {
+    Commands.TRIGGER_RELOAD:
+    ('trigger_reload', (), False),
+    Commands.SCAN_NETWORK:
+    ('scan_network', (), False),
+    Commands.REQUEST_SERVICE_LIST:
+    ('request_service_list', (), True),
+    Commands.REQUEST_ALL_STATUS:
+    ('request_all_status', (), True),
+    Commands.REQUEST_EVENTS_SINCE:
+    ('request_events_since', ('since',), True),
+    Commands.START_SERVICE:
+    ('start_service', ('service', 'instance'), True),
+    Commands.STOP_SERVICE:
+    ('stop_service', ('service', 'instance'), True),
+    Commands.RESTART_SERVICE:
+    ('restart_service', ('service', 'instance'), True),
+    Commands.REQUEST_SERVICE_STATUS:
+    ('request_service_status', ('service', 'instance'), True),
+    Commands.REQUEST_CONTROL_OUTPUT:
+    ('request_control_output', ('service', 'instance'), True),
+    Commands.REQUEST_LOG_FILES:
+    ('request_logfiles', ('service', 'instance'), True),
+    Commands.REQUEST_LOG_CATALOGUE:
+    ('request_log_catalogue', ('service', 'instance'), True),
+    Commands.REQUEST_LOG_FILE:
+    ('request_logfile', ('service', 'instance', 'filename'), True),
+    Commands.REQUEST_LOGS_SINCE:
+    ('request_logs_since', ('service', 'instance', 'cursors'), True),
+    Commands.FOLLOW_LOGS:
+    ('follow_logfiles', ('service', 'instance'), True),
+    Commands.UNFOLLOW_LOGS:
+    ('unfollow_logfiles', ('service', 'instance'), True),
+    Commands.SEARCH_LOGS:
+    ('search_logfiles', ('service', 'instance', 'regex', 'since', 'limit'),
+     True),
+    Commands.REQUEST_LOG_RANGE:
+    ('request_log_range', ('service', 'instance', 't_start', 't_end'), True),
+    Commands.REQUEST_CONF_FILES:
+    ('request_conffiles', ('service', 'instance'), True),
+    Commands.SEND_CONF_FILE:
+    ('send_conffile', ('service', 'instance', 'filename', 'contents'), True),
+}
+
+
+def frame(data):
+    """Prefix serialized message data with its length."""
+    return HEADER.pack(len(data)) + data
+
+
+class Connection(BaseConnection):
+
+    def __init__(self, writer, client):
+        BaseConnection.__init__(self, writer, client)
+        # (service, instance) -> clients used for the follow commands, which
+        # must be passed again to unfollow
+        self.following = {}
+
+
+class Interface(StreamInterface):
+
+    iface_name = 'tcp'
+    default_port = TCP_PORT
+    #: Maximum size of a frame sent by a client.
+    max_frame = 16 * 1024 * 1024
+
+    def _filter(self, conn, event):
+        if isinstance(event, LogfileEvent):
+            # only clients following the logfiles want the new data
+            if (event.service, event.instance) not in conn.following:
+                return None
+        return StreamInterface._filter(self, conn, event)
+
+    def _encode(self, conn, event):
+        return frame(conn.codec.encode(event, conn.proto_version))
+
+    # Client handling
+
+    async def _handle(self, reader, writer):
+        if self.authhandler.needs_authentication():
+            client = None
+        else:
+            client = ClientInfo(self.jobhandler.unauth_level)
+        conn = Connection(writer, client)
+        self._connections.add(conn)
+        self.log.debug('%s:%s: connected' % conn.peer[:2])
+        self._send(conn, self._encode(conn, ConnectedEvent(
+            PROTO_VERSION, __version__, self.jobhandler.unauth_level)))
+        try:
+            while True:
+                length = HEADER.unpack((await reader.readexactly(4)))[0]
+                if length > self.max_frame:
+                    self.log.warning('%s:%s: frame too large' % conn.peer[:2])
+                    break
+                data = await reader.readexactly(length)
+                await self._process(conn, data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(conn)
+            writer.close()
+            self.log.debug('%s:%s: disconnected' % conn.peer[:2])
+            for (service, instance), clients in conn.following.items():
+                for client in clients:
+                    await self._call(self.jobhandler.unfollow_logfiles,
+                                     client, service, instance)
+
+    async def _process(self, conn, data):
+        try:
+            cmd = conn.codec.decode(data, Command)
+        except Exception as err:
+            self._reply(conn, ErrorEvent('', '', Errors.EXCEPTION,
+                                         'invalid command: %s' % err))
+            return
+        if cmd is None:
+            # unknown command type: ignore for compatibility
+            return
+
+        if isinstance(cmd, AuthenticateCommand):
+            if cmd.proto_version is not None:
+                conn.proto_version = cmd.proto_version
+            codec = None
+            if cmd.codecs is not None:
+                codec = negotiate(cmd.codecs)
+            try:
+                conn.client = await self._call(
+                    self.authhandler.authenticate, cmd.user, cmd.passwd)
+            except AuthFailed:
+                if self.authhandler.needs_authentication():
+                    conn.client = None
+                success = False
+            else:
+                success = True
+            self._reply(conn, AuthEvent(success, codec and codec.name))
+            if codec is not None:
+                conn.codec = codec
+            return
+
+        service = instance = ''
+        if isinstance(cmd, ServiceCommand):
+            service, instance = cmd.service, cmd.instance
+        if conn.client is None:
+            self._reply(conn, ErrorEvent(service, instance, Errors.UNAUTH,
+                                         'authentication required'))
+            return
+        if cmd.type not in DISPATCH:
+            return
+        method, attrs, pass_client = DISPATCH[cmd.type]
+        args = [getattr(cmd, attr) for attr in attrs]
+        if pass_client:
+            args.insert(0, conn.client)
+
+        key = (service, instance)
+        if cmd.type == Commands.FOLLOW_LOGS:
+            # register first, so that no new data is missed
+            conn.following.setdefault(key, []).append(conn.client)
+        elif cmd.type == Commands.UNFOLLOW_LOGS:
+            if key not in conn.following:
+                return
+            # the client may have authenticated again since following
+            args[0] = conn.following[key].pop()
+            if not conn.following[key]:
+                del conn.following[key]
+
+        try:
+            result = await self._call(
+                getattr(self.jobhandler, method), *args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            if cmd.type == Commands.FOLLOW_LOGS:
+                conn.following[key].pop()
+                if not conn.following[key]:
+                    del conn.following[key]
+            self._reply(conn, ErrorEvent(service, instance,
+                                         self._error_code(err), str(err)))
+            return
+        if result is not None:
+            self._reply(conn, result)
+
+    def _error_code(self, err):
+        if isinstance(err, Busy):
+            return Errors.BUSY
+        elif isinstance(err, Unauthorized):
+            return Errors.UNAUTH
+        elif isinstance(err, Fault):
+            return Errors.FAULT
+        return Errors.EXCEPTION
+
+    def _reply(self, conn, event):
+        if not conn.writer.transport.is_closing():
+            conn.writer.write(self._encode(conn, event))
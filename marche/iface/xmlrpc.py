@@ -32,6 +32,14 @@ This interface allows controlling services via remote procedure calls (RPC)
 over HTTP in the XML format.  This is the main interface of Marche and should
 always be enabled.
 
+Instead of polling the status of services, clients can ask for the events
+emitted by the daemon: ``GetEventsSince(seq)`` returns the events after the
+given sequence number, and ``WaitForEvents(seq, timeout, services)`` waits up
+to *timeout* seconds for such events, optionally only for the given services.
+Both return a struct with the ``events``, the sequence number of the ``last``
+event, a ``resync`` flag that tells the client to query the full status again,
+and the daemon's ``uid`` which changes when the daemon restarts.
+
 .. describe:: [interfaces.xmlrpc]
 
    The configuration settings that can be set within the **interfaces.xmlrpc**
@@ -48,29 +56,113 @@ always be enabled.
       **Default:** 0.0.0.0
 
       The host to bind to.
+
+   .. describe:: compress_threshold
+
+      **Default:** 1400
+
+      Responses larger than this number of bytes are gzip-compressed if the
+      client accepts it (using the ``Accept-Encoding`` header).  A value of 0
+      disables compression.  Compressed requests are always accepted.
+
+   .. describe:: workers
+
+      **Default:** 8
+
+      The number of threads that handle requests concurrently.  A value of 0
+      handles one request after the other in a single thread.
+
+      A ``WaitForEvents`` call occupies a thread while it waits, but returns
+      early when other connections are waiting for a thread.
+
+   .. describe:: backlog
+
+      **Default:** 16
+
+      The number of accepted connections that can wait for a free worker.
+      If all workers are busy and this many connections are waiting, new
+      connections are rejected with "503 Service Unavailable".
+
+   .. describe:: keepalive_timeout
+
+      **Default:** 10
+
+      The number of seconds an idle HTTP/1.1 connection is kept open for the
+      next request.  Clients are authenticated only once per connection.
+      Idle connections are closed early if other connections wait for a
+      worker.  A value of 0 closes every connection after one request, which
+      is also the behavior when ``workers`` is 0.
+
+   .. describe:: max_requests
+
+      **Default:** 100
+
+      The number of requests served on one connection before it is closed.
 """
 
+import os
+import re
+import time
+import zlib
 import base64
+import socket
+import select
 import threading
 
 from marche.six import iteritems
-from marche.six.moves import xmlrpc_client, xmlrpc_server
+from marche.six.moves import queue, xmlrpc_client, xmlrpc_server
 
 from marche.jobs import Busy, Fault
 from marche.iface.base import Interface as BaseInterface
 from marche.auth import AuthFailed
 from marche.protocol import PROTO_VERSION, Errors
 from marche.permission import ClientInfo, DISPLAY
+from marche.utils import tail_truncated
 
 
 class AuthRequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
     rpc_paths = ('/xmlrpc',)
     needs_auth = False
     unauth_level = DISPLAY
+    protocol_version = 'HTTP/1.1'
+    keepalive_timeout = 10
+    max_requests = 100
 
     def log_message(self, fmt, *args):
         self.log.debug('[%s] %s' % (self.client_address[0], fmt % args))
 
+    def setup(self):
+        xmlrpc_server.SimpleXMLRPCRequestHandler.setup(self)
+        self._requests_left = self.max_requests
+        self._auth = (None, None)
+
+    def handle(self):
+        self.handle_one_request()
+        while not self.close_connection and self._wait_for_request():
+            self.handle_one_request()
+
+    def _wait_for_request(self):
+        """Wait until the client sends another request on the connection.
+
+        Gives up after the idle timeout, or when other connections are waiting
+        for a worker thread.
+        """
+        deadline = time.time() + self.keepalive_timeout
+        while time.time() < deadline:
+            if select.select([self.connection], [], [], 0.2)[0]:
+                return True
+            if self.server.busy():
+                return False
+        return False
+
+    def end_headers(self):
+        self._requests_left -= 1
+        if not self.close_connection and (
+                self._requests_left <= 0 or self.keepalive_timeout <= 0 or
+                not hasattr(self.server, 'busy') or self.server.busy()):
+            self.send_header('Connection', 'close')
+        xmlrpc_server.SimpleXMLRPCRequestHandler.end_headers(self)
+
     def do_POST(self):
         self.client_info = ClientInfo(self.unauth_level)
 
@@ -80,6 +172,10 @@ class AuthRequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
             return
 
         header = self.headers['Authorization'].split()[-1].strip()
+        if header == self._auth[0]:
+            # same credentials as before on this connection
+            self.client_info = self._auth[1]
+            return xmlrpc_server.SimpleXMLRPCRequestHandler.do_POST(self)
         decoded = base64.b64decode(header.encode()).decode('utf-8')
         try:
             user, passwd = decoded.split(':', 1)
@@ -87,6 +183,7 @@ class AuthRequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
         except (ValueError, AuthFailed):
             self.send_error(401)
             return
+        self._auth = (header, self.client_info)
 
         return xmlrpc_server.SimpleXMLRPCRequestHandler.do_POST(self)
 
@@ -98,6 +195,101 @@ class AuthRequestHandler(xmlrpc_server.SimpleXMLRPCRequestHandler):
         return func(self.client_info, *params)
 
 
+class PooledXMLRPCServer(xmlrpc_server.SimpleXMLRPCServer):
+    """An XMLRPC server that handles requests in a fixed number of worker
+    threads.
+
+    Accepted connections wait in a queue of at most *backlog* entries for a
+    free worker; if the queue is full, they are answered with "503 Service
+    Unavailable" right away.
+    """
+
+    busy_response = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                     b'Content-Type: text/plain\r\n'
+                     b'Content-Length: 12\r\n'
+                     b'Retry-After: 1\r\n'
+                     b'Connection: close\r\n\r\n'
+                     b'server busy\n')
+    reject_timeout = 0.2
+
+    def __init__(self, addr, requestHandler, workers, backlog):
+        self.request_queue_size = backlog
+        # the backlog is enforced by process_request, so that the stop
+        # sentinels can always be put without blocking
+        self._backlog = backlog
+        self._queue = queue.Queue()
+        xmlrpc_server.SimpleXMLRPCServer.__init__(
+            self, addr, requestHandler=requestHandler)
+        self._workers = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker,
+                                      name='xmlrpc worker %d' % i)
+            thread.setDaemon(True)
+            thread.start()
+            self._workers.append(thread)
+
+    def busy(self):
+        """Return true if connections are waiting for a worker."""
+        return not self._queue.empty()
+
+    def process_request(self, request, client_address):
+        # only the accepting thread puts requests, so the size can't grow
+        # between the check and the put
+        if self._queue.qsize() >= self._backlog:
+            self._reject(request)
+        else:
+            self._queue.put((request, client_address))
+
+    def _reject(self, request):
+        try:
+            # read the request first (within limits), so that the client
+            # sees the response instead of a reset connection; this runs on
+            # the accepting thread, so the whole read gets one deadline
+            deadline = time.time() + self.reject_timeout
+            data = b''
+            while len(data) < 65536:
+                head, sep, body = data.partition(b'\r\n\r\n')
+                if sep:
+                    match = re.search(br'(?im)^content-length:\s*(\d+)',
+                                      head)
+                    if len(body) >= int(match.group(1) if match else 0):
+                        break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                request.settimeout(remaining)
+                try:
+                    chunk = request.recv(65536)
+                except socket.timeout:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+            request.settimeout(self.reject_timeout)
+            request.sendall(self.busy_response)
+        except socket.error:
+            pass
+        self.shutdown_request(request)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        xmlrpc_server.SimpleXMLRPCServer.server_close(self)
+        for _ in self._workers:
+            self._queue.put(None)
+
+
 def command(method):
     def new_method(self, *args):
         try:
@@ -116,9 +308,39 @@ def command(method):
 
 class RPCFunctions(object):
 
-    def __init__(self, jobhandler, log):
+    #: Maximum time in seconds that WaitForEvents blocks.
+    max_wait = 60
+
+    def __init__(self, jobhandler, log, busy=None):
         self.jobhandler = jobhandler
         self.log = log
+        # returns true if waiting calls should give up their thread
+        self._busy = busy or (lambda: False)
+        self._last_seq = 0
+        self._event_cond = threading.Condition()
+
+    def notify(self, event):
+        """Wake up WaitForEvents calls."""
+        with self._event_cond:
+            if event.seq is not None:
+                self._last_seq = max(self._last_seq, event.seq)
+            self._event_cond.notify_all()
+
+    def _events_result(self, journal, events):
+        # XMLRPC cannot transport None
+        events = [dict((key, value) for (key, value) in iteritems(event)
+                       if value is not None) for event in events]
+        return {'events': events, 'last': journal.last,
+                'resync': journal.resync, 'uid': journal.uid}
+
+    def _matches(self, event, wanted):
+        if not wanted or 'service' not in event:
+            return True
+        for service, instance in wanted:
+            if service == event['service'] and \
+               instance in ('', event['instance']):
+                return True
+        return False
 
     def _split_name(self, name):
         if '.' in name:
@@ -157,6 +379,45 @@ class RPCFunctions(object):
             client_info, *self._split_name(name))
         return status_event.state
 
+    @command
+    def GetAllStatus(self, client_info):
+        status_event = self.jobhandler.request_all_status(client_info)
+        result = {}
+        for svcname, instances in iteritems(status_event.services):
+            for instance, (state, ext_status) in iteritems(instances):
+                path = svcname + '.' + instance if instance else svcname
+                result[path] = (state, ext_status)
+        return result
+
+    @command
+    def GetEventsSince(self, client_info, since):
+        journal = self.jobhandler.request_events_since(client_info, since)
+        return self._events_result(journal, journal.events)
+
+    @command
+    def WaitForEvents(self, client_info, since, timeout, services=()):
+        # Like GetEventsSince, but if there are no events for the given
+        # services (names or paths, all if empty), wait for them until the
+        # timeout.  Other events (e.g. service lists) are always returned.
+        deadline = time.time() + min(timeout, self.max_wait)
+        wanted = [self._split_name(name) for name in services]
+        while True:
+            journal = self.jobhandler.request_events_since(client_info, since)
+            if journal.resync:
+                return self._events_result(journal, [])
+            events = [event for event in journal.events
+                      if self._matches(event, wanted)]
+            if events:
+                return self._events_result(journal, events)
+            since = journal.last
+            with self._event_cond:
+                while self._last_seq <= since:
+                    remaining = deadline - time.time()
+                    # don't block a worker others are waiting for
+                    if remaining <= 0 or self._busy():
+                        return self._events_result(journal, [])
+                    self._event_cond.wait(min(remaining, 0.5))
+
     @command
     def GetOutput(self, client_info, name):
         out_event = self.jobhandler.request_control_output(
@@ -173,6 +434,77 @@ class RPCFunctions(object):
                 ret.append(name + ':' + line)
         return ret
 
+    @command
+    def GetLogs2(self, client_info, name, compress=False):
+        """Return the logfiles as a list of one dictionary per file, with
+        the content as a single binary string (zlib-compressed if requested)
+        instead of one string per line."""
+        log_event = self.jobhandler.request_logfiles(
+            client_info, *self._split_name(name))
+        ret = []
+        for filename, contents in iteritems(log_event.files):
+            contents = contents.encode('utf-8')
+            filesize, truncated = len(contents), False
+            if filename != 'journal':  # the systemd journal is no file
+                try:
+                    filesize = os.stat(filename).st_size
+                    truncated = tail_truncated(filename)
+                except (IOError, OSError):
+                    pass
+            entry = {
+                'name': filename,
+                'size': float(len(contents)),
+                'filesize': float(filesize),
+                'truncated': truncated,
+                'compressed': bool(compress),
+            }
+            if compress:
+                contents = zlib.compress(contents)
+            entry['content'] = xmlrpc_client.Binary(contents)
+            ret.append(entry)
+        return ret
+
+    @command
+    def GetLogsSince(self, client_info, name, cursors):
+        service, instance = self._split_name(name)
+        log_event = self.jobhandler.request_logs_since(
+            client_info, service, instance, cursors)
+        return {'files': log_event.files, 'cursors': log_event.cursors}
+
+    @command
+    def SearchLogs(self, client_info, name, regex, since=0, limit=0):
+        service, instance = self._split_name(name)
+        log_event = self.jobhandler.search_logfiles(
+            client_info, service, instance, regex, since or None,
+            limit or None)
+        return log_event.files
+
+    @command
+    def GetLogRange(self, client_info, name, t_start, t_end):
+        service, instance = self._split_name(name)
+        log_event = self.jobhandler.request_log_range(
+            client_info, service, instance, t_start, t_end)
+        return log_event.files
+
+    @command
+    def GetLogCatalogue(self, client_info, name):
+        catalogue_event = self.jobhandler.request_log_catalogue(
+            client_info, *self._split_name(name))
+        ret = []
+        for entry in catalogue_event.files:
+            entry = dict(entry)
+            # XMLRPC integers are limited to 32 bits
+            entry['size'] = float(entry['size'])
+            ret.append(entry)
+        return ret
+
+    @command
+    def GetLogFile(self, client_info, name, filename):
+        service, instance = self._split_name(name)
+        log_event = self.jobhandler.request_logfile(
+            client_info, service, instance, filename)
+        return log_event.files[filename]
+
     @command
     def ReceiveConfig(self, client_info, name):
         config_event = self.jobhandler.request_conffiles(
@@ -205,13 +537,16 @@ class RPCFunctions(object):
 class Interface(BaseInterface):
 
     iface_name = 'xmlrpc'
-    needs_events = False
     poll_interval = 0.5
 
     def init(self):
-        self._events = []
+        self._functions = None
         AuthRequestHandler.log = self.log
 
+    def emit_event(self, event):
+        if self._functions is not None:
+            self._functions.notify(event)
+
     def run(self):
         port = int(self.config.get('port', 8124))
         host = self.config.get('host', '0.0.0.0')
@@ -219,10 +554,26 @@ class Interface(BaseInterface):
         AuthRequestHandler.authhandler = self.authhandler
         AuthRequestHandler.unauth_level = self.jobhandler.unauth_level
         AuthRequestHandler.needs_auth = self.authhandler.needs_authentication()
-
-        self.server = xmlrpc_server.SimpleXMLRPCServer(
-            (host, port), requestHandler=AuthRequestHandler)
-        self.server.register_instance(RPCFunctions(self.jobhandler, self.log))
+        AuthRequestHandler.encode_threshold = \
+            int(self.config.get('compress_threshold', 1400)) or None
+        AuthRequestHandler.keepalive_timeout = \
+            float(self.config.get('keepalive_timeout', 10))
+        AuthRequestHandler.max_requests = \
+            int(self.config.get('max_requests', 100))
+
+        workers = int(self.config.get('workers', 8))
+        backlog = int(self.config.get('backlog', 16))
+        if workers > 0:
+            self.server = PooledXMLRPCServer(
+                (host, port), AuthRequestHandler, workers, backlog)
+            busy = self.server.busy
+        else:
+            self.server = xmlrpc_server.SimpleXMLRPCServer(
+                (host, port), requestHandler=AuthRequestHandler)
+            # a waiting call would block the only thread
+            busy = lambda: True  # noqa
+        self._functions = RPCFunctions(self.jobhandler, self.log, busy)
+        self.server.register_instance(self._functions)
 
         thd = threading.Thread(target=self._thread)
         thd.setDaemon(True)
@@ -231,6 +582,7 @@ class Interface(BaseInterface):
 
     def shutdown(self):
         self.server.shutdown()
+        self.server.server_close()
 
     def _thread(self):
         self.server.serve_forever(poll_interval=self.poll_interval)
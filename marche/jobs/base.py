@@ -23,15 +23,22 @@
 #
 # *****************************************************************************
 
-import collections
+import re
+import shlex
 import threading
 from os import path
 
 from marche.jobs import Busy, Fault, Unauthorized, STARTING, STOPPING, \
-    RUNNING, DEAD
+    RUNNING, WARNING, DEAD
 from marche.permission import DISPLAY, CONTROL, ADMIN, parse_permissions
+from marche.logs import list_logfiles, read_logfile, read_since, \
+    read_logrange, search_logfiles, iso_timestamp
 from marche.polling import Poller
-from marche.utils import AsyncProcess, read_file, write_file, extract_loglines
+from marche.utils import AsyncProcess, OutputBuffer, read_file, write_file, \
+    extract_loglines, read_pidfile, decode_loglines
+
+# Finds the PID in typical output of init script "status" actions.
+pid_re = re.compile(r'\bpid\b\D{0,3}(\d+)', re.I)
 
 
 class Job(object):
@@ -49,6 +56,22 @@ class Job(object):
     .. automethod:: __init__
     """
 
+    # Size, in bytes, of the output kept from start/stop commands per service.
+    output_size = 16384
+
+    # Size, in bytes, of the output kept from each synchronous command (status
+    # queries etc.), which is parsed by the job.
+    sync_output_size = 1024 * 1024
+
+    # Whether logs are rotated by switching to a new (dated) file, instead of
+    # renaming the old file to file.1 etc.  See `marche.logs.list_logfiles`.
+    dated_logs = False
+
+    # Parses the timestamps of log lines, used for searching and time ranges.
+    # Jobs whose logs use a different format should set another parser; see
+    # `marche.logs`.
+    log_timestamp = staticmethod(iso_timestamp)
+
     def __init__(self, jobtype, name, config, log, event_callback):
         """The constructor should not be overridden, rather implement the
         configure() method.
@@ -61,14 +84,21 @@ class Job(object):
            The job config dictionary (the *config* argument).
         ``log``
            A logger for the job (a child of the *log* argument).
+        ``lock``
+           A job-wide lock.  Actions are no longer serialized by it, but by
+           the per-service locks returned by `service_lock`; it is kept for
+           jobs that protect their own state with it.
         """
         self.jobtype = jobtype
         self.name = name
         self.config = config
         self.log = log.getChild(name)
         self.lock = threading.Lock()
+        self._locks = {}
+        self._locks_lock = threading.Lock()
         self._processes = {}
         self._output = {}
+        self._pids = {}
 
         self._permissions = {DISPLAY: DISPLAY,
                              CONTROL: CONTROL,
@@ -80,28 +110,68 @@ class Job(object):
             except ValueError:
                 self.log.error('could not parse permission string: %r' %
                                config['permissions'])
-        self.pollinterval = 3.0
-        if 'pollinterval' in config:
-            try:
-                self.pollinterval = float(config['pollinterval'])
-            except ValueError:
-                self.log.error('could not parse pollinterval: %r' %
-                               config['pollinterval'])
-        self.poller = Poller(self, self.pollinterval, event_callback)
+        self.pollinterval = self._number_option(config, 'pollinterval', 3.0)
+        self.pollconcurrency = max(1, self._number_option(
+            config, 'pollconcurrency', 1, int))
+        self.pollinterval_min = self._number_option(
+            config, 'pollinterval_min', self.pollinterval)
+        self.pollinterval_max = self._number_option(
+            config, 'pollinterval_max', self.pollinterval)
+        self.status_timeout = self._number_option(config, 'status_timeout',
+                                                  30.0)
+        self.control_timeout = self._number_option(config, 'control_timeout',
+                                                   300.0)
+        self.poller = Poller(self, self.pollinterval, event_callback,
+                             self.pollconcurrency, self.pollinterval_min,
+                             self.pollinterval_max)
 
         self.configure(config)
 
     # Utilities
 
-    def _async_call(self, status, cmd, sh=True, output=None):
+    def _number_option(self, config, key, default, conv=float):
+        if key not in config:
+            return default
+        try:
+            return conv(config[key])
+        except ValueError:
+            self.log.error('could not parse %s: %r' % (key, config[key]))
+            return default
+
+    def _argv(self, cmd, *args):
+        """Return an argument list for *cmd* (a string that is split like the
+        shell does) with further *args* appended, leaving out empty ones.
+        """
+        return shlex.split(cmd) + [arg for arg in args if arg]
+
+    # Commands can be given as strings, which are executed by the shell
+    # (unless *sh* is false), or as argument lists, which are executed
+    # directly without starting a shell.
+    #
+    # Asynchronous calls (to start/stop) time out after control_timeout,
+    # synchronous calls (to query something) after status_timeout seconds.
+
+    def _async_call(self, status, cmd, sh=None, output=None, timeout=None):
+        if sh is None:
+            sh = not isinstance(cmd, list)
+        if timeout is None:
+            timeout = self.control_timeout
         if output is not None:
-            output.append('$ %s\n' % cmd)
-        proc = AsyncProcess(status, self.log, cmd, sh, output, output)
+            output.append('$ %s\n' % (' '.join(cmd) if isinstance(cmd, list)
+                                      else cmd))
+        proc = AsyncProcess(status, self.log, cmd, sh, output, output, timeout)
         proc.start()
         return proc
 
-    def _sync_call(self, cmd, sh=True):
-        proc = AsyncProcess(0, self.log, cmd, sh)
+    def _sync_call(self, cmd, sh=None, timeout=None):
+        if sh is None:
+            sh = not isinstance(cmd, list)
+        if timeout is None:
+            timeout = self.status_timeout
+        proc = AsyncProcess(0, self.log, cmd, sh,
+                            OutputBuffer(self.sync_output_size),
+                            OutputBuffer(self.sync_output_size),
+                            timeout=timeout)
         proc.start()
         proc.join()
         return proc
@@ -109,13 +179,13 @@ class Job(object):
     def _async_start(self, sub, cmd):
         if sub in self._processes and not self._processes[sub].done:
             raise Busy
-        output = self._output.setdefault(sub, collections.deque(maxlen=50))
+        output = self._output.setdefault(sub, OutputBuffer(self.output_size))
         self._processes[sub] = self._async_call(STARTING, cmd, output=output)
 
     def _async_stop(self, sub, cmd):
         if sub in self._processes and not self._processes[sub].done:
             raise Busy
-        output = self._output.setdefault(sub, collections.deque(maxlen=50))
+        output = self._output.setdefault(sub, OutputBuffer(self.output_size))
         self._processes[sub] = self._async_call(STOPPING, cmd, output=output)
 
     def _async_status_only(self, sub):
@@ -123,11 +193,23 @@ class Job(object):
             return self._processes[sub].status
 
     def _async_status(self, sub, cmd):
+        return self._async_status_ext(sub, cmd)[0]
+
+    def _async_status_ext(self, sub, cmd):
         if sub in self._processes and not self._processes[sub].done:
-            return self._processes[sub].status
-        if self._sync_call(cmd).retcode == 0:
-            return RUNNING
-        return DEAD
+            self._pids.pop(sub, None)
+            return self._processes[sub].status, ''
+        proc = self._sync_call(cmd)
+        if proc.timed_out:
+            self._pids.pop(sub, None)
+            return WARNING, 'status check timed out'
+        if proc.retcode == 0:
+            # remember the PID, if the command tells us
+            match = pid_re.search(''.join(proc.stdout))
+            self._pids[sub] = int(match.group(1)) if match else None
+            return RUNNING, ''
+        self._pids.pop(sub, None)
+        return DEAD, ''
 
     # Public interface
 
@@ -150,20 +232,33 @@ class Job(object):
         return [perm for perm in (DISPLAY, CONTROL, ADMIN)
                 if self.has_permission(perm, client)]
 
+    def service_lock(self, service, instance):
+        """Return the lock that serializes actions on a single service.
+
+        Jobs whose services can act on other services as well must return a
+        lock that also excludes actions on those.
+        """
+        with self._locks_lock:
+            lock = self._locks.get((service, instance))
+            if lock is None:
+                lock = self._locks[service, instance] = threading.Lock()
+            return lock
+
     def invalidate(self, service, instance):
         """Invalidate polled and cached status."""
         self.poller.invalidate(service, instance)
 
     def poll_now(self):
         """Let the poller poll now, if possible."""
-        self.poller.queue.put(True)
+        self.poller.poll_now()
 
     def polled_service_status(self, service, instance):
         """Return the service status, if possible from the poller cache."""
         result = self.poller.get(service, instance)
         if result is not None:
             return result
-        return self.service_status(service, instance)
+        with self.service_lock(service, instance):
+            return self.service_status(service, instance)
 
     # Public interface to be implemented by subclasses
 
@@ -191,8 +286,9 @@ class Job(object):
 
         This can further configure the job after the feasibility check has run.
 
-        The default is to start the poller, so the base class method should be
-        normally called by subclasses.
+        The default is to register the job's services with the daemon-wide poll
+        scheduler, so the base class method should be normally called by
+        subclasses.
         """
         if self.pollinterval > 0:
             self.poller.start()
@@ -200,8 +296,8 @@ class Job(object):
     def shutdown(self):
         """Shut the job down.
 
-        The default is to stop the poller, so the base class method should be
-        normally called by subclasses.
+        The default is to unregister the job from the poll scheduler, so the
+        base class method should be normally called by subclasses.
         """
         self.poller.stop()
 
@@ -282,6 +378,32 @@ class Job(object):
         """Return a string description of the service with the given name."""
         return ''
 
+    def service_pidfile(self, service, instance):
+        """Return the name of the pidfile of the service with the given name,
+        or None if there is none.
+
+        The poller watches the pidfile and polls the service status as soon as
+        it changes.
+
+        The default is to return None.
+        """
+        return None
+
+    def service_pid(self, service, instance):
+        """Return the PID of the main process of the service with the given
+        name, if it is running and the PID can be determined, else None.
+
+        The poller watches the process and polls the service status as soon as
+        it exits, while the regular polling is reduced to an occasional sanity
+        check.
+
+        The default is to read the PID from the `service_pidfile`, if any.
+        """
+        pidfile = self.service_pidfile(service, instance)
+        if pidfile:
+            return read_pidfile(pidfile)
+        return None
+
     def service_output(self, service, instance):
         """Return the console output of the last attempt to start/stop/restart
         the service, as a list of strings (lines).
@@ -290,14 +412,111 @@ class Job(object):
         """
         return []
 
+    def service_logfiles(self, service, instance):
+        """Return a list of the paths of the service's current logfiles.
+
+        The default is to return no logfiles.
+        """
+        return []
+
     def service_logs(self, service, instance):
         """Return the contents of the logfile(s) of the service, if possible.
 
         The return value must be a dictionary of file names and contents.
 
-        The default is to return no logfiles.
+        The default is to return the last lines of the current files from
+        `service_logfiles`.
         """
-        return {}
+        ret = {}
+        for logfile in self.service_logfiles(service, instance):
+            ret.update(extract_loglines(logfile))
+        return ret
+
+    def service_logs_since(self, service, instance, cursors):
+        """Return the data appended to the logfile(s) of the service since
+        the given *cursors* (a dictionary mapping file names to cursors, see
+        `marche.logs`), as a tuple of a dictionary like `service_logs` and a
+        dictionary of new cursors.
+
+        The default is to read the current files from `service_logfiles`,
+        keyed by their configured names (so that a switched symlink is
+        noticed as a rotation).  If there are none, all of `service_logs` is
+        returned, without cursors.
+        """
+        logfiles = self.service_logfiles(service, instance)
+        if not logfiles:
+            return self.service_logs(service, instance), {}
+        files, new_cursors = {}, {}
+        for logfile in logfiles:
+            if not path.exists(logfile):
+                continue
+            files[logfile], new_cursors[logfile] = \
+                read_since(logfile, cursors.get(logfile),
+                           dated=self.dated_logs)
+        return files, new_cursors
+
+    def service_log_catalogue(self, service, instance):
+        """Return a list of the service's logfiles, including rotated ones,
+        without reading them.
+
+        Each entry is a dictionary as returned by
+        `marche.logs.list_logfiles`.
+
+        The default is to list the files from `service_logfiles` and their
+        rotated predecessors.
+        """
+        ret = []
+        for logfile in self.service_logfiles(service, instance):
+            ret.extend(list_logfiles(logfile, self.dated_logs))
+        return ret
+
+    def service_search_logs(self, service, instance, regex, since=None,
+                            limit=None):
+        """Search the service's logfiles, including rotated ones, for lines
+        matching *regex*, oldest files first.
+
+        If *since* is given, only lines logged after this Unix timestamp are
+        returned.  If *limit* is given, at most that many lines are returned.
+
+        The return value is a dictionary like `service_logs`, with the
+        matching lines as contents.
+        """
+        try:
+            regex = re.compile(regex.encode('utf-8'), re.M)
+        except re.error as err:
+            raise Fault('invalid regular expression: %s' % err)
+        catalogue = self.service_log_catalogue(service, instance)
+        ret = {}
+        for filename, line in search_logfiles(
+                [entry['name'] for entry in reversed(catalogue)],
+                regex, since, limit, self.log_timestamp):
+            ret.setdefault(filename, []).append(line)
+        for filename, lines in ret.items():
+            ret[filename] = decode_loglines(b''.join(lines))
+        return ret
+
+    def service_log_range(self, service, instance, t_start, t_end):
+        """Return the lines of the service's logfiles, including rotated
+        ones, that were logged between the Unix timestamps *t_start* and
+        *t_end*, as a dictionary like `service_logs`.
+        """
+        ret = {}
+        for entry in reversed(self.service_log_catalogue(service, instance)):
+            data = read_logrange(entry['name'], t_start, t_end,
+                                 self.log_timestamp)
+            if data is not None:
+                ret[entry['name']] = decode_loglines(data)
+        return ret
+
+    def service_logfile(self, service, instance, filename, n=500):
+        """Return the last *n* lines of a single (possibly rotated) logfile
+        from the `service_log_catalogue`, as a dictionary like
+        `service_logs`.
+        """
+        for entry in self.service_log_catalogue(service, instance):
+            if entry['name'] == filename:
+                return {filename: read_logfile(filename, n)}
+        raise Fault('no such logfile: %s' % filename)
 
     def receive_config(self, service, instance):
         """Return the contents of the config file(s) of the service, if
@@ -338,11 +557,8 @@ class LogfileMixin(object):
             if logpath:
                 self.log_files.append(logpath)
 
-    def service_logs(self, service, instance):
-        ret = {}
-        for log_file in self.log_files:
-            ret.update(extract_loglines(log_file))
-        return ret
+    def service_logfiles(self, service, instance):
+        return self.log_files
 
 
 class ConfigMixin(object):
@@ -42,6 +42,11 @@ This job has the following configuration parameters:
 
    .. describe:: permissions
                  pollinterval
+                 pollinterval_min
+                 pollinterval_max
+                 pollconcurrency
+                 status_timeout
+                 control_timeout
 
       The :ref:`standard parameters <standard-params>` present for all jobs.
 
@@ -57,11 +62,15 @@ from marche.six.moves import configparser
 
 from marche.jobs import Fault
 from marche.jobs.base import Job as BaseJob
-from marche.utils import extract_loglines, read_file, write_file
+from marche.logs import daily_timestamp
+from marche.utils import read_file, write_file
 
 
 class Job(BaseJob):
 
+    dated_logs = True
+    log_timestamp = staticmethod(daily_timestamp)
+
     CONFIG = '/etc/entangle/entangle.conf'
     INITSCR = '/etc/init.d/entangle'
 
@@ -94,25 +103,30 @@ class Job(BaseJob):
         return self._services
 
     def start_service(self, service, instance):
-        self._async_start(instance, '%s start %s' % (self.INITSCR, instance))
+        self._async_start(instance,
+                          self._argv(self.INITSCR, 'start', instance))
 
     def stop_service(self, service, instance):
-        self._async_stop(instance, '%s stop %s' % (self.INITSCR, instance))
+        self._async_stop(instance,
+                         self._argv(self.INITSCR, 'stop', instance))
 
     def restart_service(self, service, instance):
-        self._async_start(instance, '%s restart %s' % (self.INITSCR, instance))
+        self._async_start(instance,
+                          self._argv(self.INITSCR, 'restart', instance))
 
     def service_status(self, service, instance):
         # XXX check devices with Tango clients
-        return self._async_status(instance, '%s status %s' %
-                                  (self.INITSCR, instance)), ''
+        return self._async_status_ext(
+            instance, self._argv(self.INITSCR, 'status', instance))
+
+    def service_pid(self, service, instance):
+        return self._pids.get(instance)
 
     def service_output(self, service, instance):
         return list(self._output.get(instance, []))
 
-    def service_logs(self, service, instance):
-        logname = path.join(self._logdir, instance, 'current')
-        return extract_loglines(logname)
+    def service_logfiles(self, service, instance):
+        return [path.join(self._logdir, instance, 'current')]
 
     def receive_config(self, service, instance):
         cfgname = path.join(self._resdir, instance + '.res')
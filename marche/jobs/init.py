@@ -67,8 +67,20 @@ This job has the following configuration parameters:
       A nicer description for the job, to be displayed in the GUI.  Default is
       no description, and the job name will be displayed.
 
+   .. describe:: pidfile
+
+      Full path of the pidfile written by the service.  If given, Marche
+      watches the pidfile and the process, and notices immediately when the
+      service stops.  Otherwise, the PID is taken from the output of the init
+      script's ``status`` action, if it contains one.
+
    .. describe:: permissions
                  pollinterval
+                 pollinterval_min
+                 pollinterval_max
+                 pollconcurrency
+                 status_timeout
+                 control_timeout
 
       The :ref:`standard parameters <standard-params>` present for all jobs.
 
@@ -93,6 +105,7 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         self.init_name = config.get('script', self.name)
         self.description = config.get('description', self.name)
         self.script = self.INIT_BASE + self.init_name
+        self.pidfile = config.get('pidfile')
         self.configure_logfile_mixin(config)
         self.configure_config_mixin(config)
 
@@ -108,17 +121,25 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
     def service_description(self, service, instance):
         return self.description
 
+    def service_pidfile(self, service, instance):
+        return self.pidfile
+
+    def service_pid(self, service, instance):
+        return BaseJob.service_pid(self, service, instance) or \
+            self._pids.get(service)
+
     def start_service(self, service, instance):
-        self._async_start(service, self.script + ' start')
+        self._async_start(service, self._argv(self.script, 'start'))
 
     def stop_service(self, service, instance):
-        self._async_stop(service, self.script + ' stop')
+        self._async_stop(service, self._argv(self.script, 'stop'))
 
     def restart_service(self, service, instance):
-        self._async_start(service, self.script + ' restart')
+        self._async_start(service, self._argv(self.script, 'restart'))
 
     def service_status(self, service, instance):
-        return self._async_status(service, self.script + ' status'), ''
+        return self._async_status_ext(service,
+                                      self._argv(self.script, 'status'))
 
     def service_output(self, service, instance):
         return list(self._output.get(service, []))
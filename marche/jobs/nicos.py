@@ -48,6 +48,11 @@ This job has the following configuration parameters:
 
    .. describe:: permissions
                  pollinterval
+                 pollinterval_min
+                 pollinterval_max
+                 pollconcurrency
+                 status_timeout
+                 control_timeout
 
       The :ref:`standard parameters <standard-params>` present for all jobs.
 
@@ -63,11 +68,15 @@ from marche.six.moves import configparser
 
 from marche.jobs import DEAD, RUNNING, WARNING
 from marche.jobs.base import Job as BaseJob
-from marche.utils import extract_loglines
+from marche.logs import daily_timestamp
+from marche.utils import MultiLock
 
 
 class Job(BaseJob):
 
+    dated_logs = True
+    log_timestamp = staticmethod(daily_timestamp)
+
     DEFAULT_INIT = '/etc/init.d/nicos-system'
 
     def configure(self, config):
@@ -92,7 +101,7 @@ class Job(BaseJob):
 
     def init(self):
         self._services = [('nicos', '')]
-        lines = self._sync_call('%s 2>&1' % self._script).stdout
+        lines = list(self._sync_call('%s 2>&1' % self._script).stdout)
         prefix = 'Possible services are '
         if len(lines) >= 2 and lines[-1].startswith(prefix):
             self._services.extend(('nicos', entry.strip()) for entry in
@@ -102,21 +111,34 @@ class Job(BaseJob):
     def get_services(self):
         return self._services
 
+    def service_lock(self, service, instance):
+        if instance:
+            return BaseJob.service_lock(self, service, instance)
+        # the empty instance controls all NICOS services
+        return MultiLock([BaseJob.service_lock(self, service, inst)
+                          for (_, inst) in self._services])
+
     def start_service(self, service, instance):
-        return self._async_start(instance, self._script + ' start %s' % instance)
+        return self._async_start(
+            instance, self._argv(self._script, 'start', instance))
 
     def stop_service(self, service, instance):
-        return self._async_stop(instance, self._script + ' stop %s' % instance)
+        return self._async_stop(
+            instance, self._argv(self._script, 'stop', instance))
 
     def restart_service(self, service, instance):
-        return self._async_start(instance, self._script + ' restart %s' % instance)
+        return self._async_start(
+            instance, self._argv(self._script, 'restart', instance))
 
     def service_status(self, service, instance):
         async_st = self._async_status_only(instance)
         if async_st is not None:
             return async_st, ''
         if not instance:
-            output = self._sync_call('%s status' % self._script).stdout
+            proc = self._sync_call(self._argv(self._script, 'status'))
+            if proc.timed_out:
+                return WARNING, 'status check timed out'
+            output = proc.stdout
             something_dead = something_running = False
             for line in output:
                 if 'dead' in line:
@@ -129,13 +151,13 @@ class Job(BaseJob):
                 return RUNNING, ''
             return DEAD, ''
         else:
-            proc = self._sync_call(self._script + ' status %s' % instance)
-            return RUNNING if proc.retcode == 0 else DEAD, ''
+            return self._async_status_ext(
+                instance, self._argv(self._script, 'status', instance))
 
     def service_output(self, service, instance):
         return list(self._output.get(instance, []))
 
-    def service_logs(self, service, instance):
+    def service_logfiles(self, service, instance):
         if self._logpath is None:
             # extract nicos log directory
             cfg = configparser.RawConfigParser()
@@ -145,10 +167,10 @@ class Job(BaseJob):
             else:
                 self._logpath = path.join(self._root, 'log')
         if not instance:
-            result = {}
+            result = []
             for subdir in os.listdir(self._logpath):
                 logfile = path.join(self._logpath, subdir, 'current')
                 if path.islink(logfile):
-                    result.update(extract_loglines(logfile))
+                    result.append(logfile)
             return result
-        return extract_loglines(path.join(self._logpath, instance, 'current'))
+        return [path.join(self._logpath, instance, 'current')]
@@ -94,6 +94,11 @@ This job has the following configuration parameters:
 
    .. describe:: permissions
                  pollinterval
+                 pollinterval_min
+                 pollinterval_max
+                 pollconcurrency
+                 status_timeout
+                 control_timeout
 
       The :ref:`standard parameters <standard-params>` present for all jobs.
 
@@ -122,6 +127,7 @@ class ProcessMonitor(Thread):
 
     def __init__(self, cmd, wd, outfile, oneshot, output, log):
         Thread.__init__(self)
+        self.pid = None
         self.returncode = None
         self.stopflag = False
         self.log = log
@@ -142,6 +148,7 @@ class ProcessMonitor(Thread):
             if hasattr(outfile, 'buffer'):
                 outfile = outfile.buffer  # pylint: disable=no-member
         process = Popen(self._cmd, stdout=outfile, stderr=STDOUT, cwd=self._wd)
+        self.pid = process.pid
         while process.poll() is None:
             sleep(self.DELAY)
             if self.stopflag:
@@ -187,6 +194,7 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
 
     def shutdown(self):
         self.stop_service(self.name, '')
+        BaseJob.shutdown(self)
 
     def get_services(self):
         return [(self.name, '')]
@@ -195,7 +203,7 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         return self.description
 
     def start_service(self, service, instance):
-        if self._thread and self._thread.isAlive():
+        if self._thread and self._thread.is_alive():
             return
         self._output[service] = []
         self._thread = ProcessMonitor([self.binary] + self.args,
@@ -206,7 +214,7 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         self._thread.start()
 
     def stop_service(self, service, instance):
-        if not (self._thread and self._thread.isAlive()):
+        if not (self._thread and self._thread.is_alive()):
             return
         self._thread.stopflag = True
         self._thread.join()
@@ -216,11 +224,16 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         self.start_service(service, instance)
 
     def service_status(self, service, instance):
-        if self._thread and self._thread.isAlive():
+        if self._thread and self._thread.is_alive():
             return RUNNING, ''
         if self.one_shot:
             return NOT_RUNNING, ''
         return DEAD, ''
 
+    def service_pid(self, service, instance):
+        if self._thread and self._thread.is_alive():
+            return self._thread.pid
+        return None
+
     def service_output(self, service, instance):
         return list(self._output.get(service, []))
@@ -67,6 +67,11 @@ This job has the following configuration parameters:
 
    .. describe:: permissions
                  pollinterval
+                 pollinterval_min
+                 pollinterval_max
+                 pollconcurrency
+                 status_timeout
+                 control_timeout
 
       The :ref:`standard parameters <standard-params>` present for all jobs.
 
@@ -92,7 +97,8 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         self.configure_config_mixin(config)
 
     def check(self):
-        proc = self._sync_call(self.SYSTEMCTL + ' is-enabled %s' % self.unit)
+        proc = self._sync_call(self._argv(self.SYSTEMCTL, 'is-enabled',
+                                          self.unit))
         if not proc.stdout and proc.stderr:
             self.log.warning('unit file for %s does not exist' % self.unit)
             return False
@@ -105,23 +111,27 @@ class Job(LogfileMixin, ConfigMixin, BaseJob):
         return self.description
 
     def start_service(self, service, instance):
-        self._async_start(service, self.SYSTEMCTL + ' start %s' % self.unit)
+        self._async_start(service,
+                          self._argv(self.SYSTEMCTL, 'start', self.unit))
 
     def stop_service(self, service, instance):
-        self._async_stop(service, self.SYSTEMCTL + ' stop %s' % self.unit)
+        self._async_stop(service,
+                         self._argv(self.SYSTEMCTL, 'stop', self.unit))
 
     def restart_service(self, service, instance):
-        self._async_start(service, self.SYSTEMCTL + ' restart %s' % self.unit)
+        self._async_start(service,
+                          self._argv(self.SYSTEMCTL, 'restart', self.unit))
 
     def service_status(self, service, instance):
-        return self._async_status(service, self.SYSTEMCTL + ' is-active %s'
-                                  % self.unit), ''
+        return self._async_status_ext(
+            service, self._argv(self.SYSTEMCTL, 'is-active', self.unit))
 
     def service_output(self, service, instance):
         return list(self._output.get(service, []))
 
     def service_logs(self, service, instance):
         if not self.log_files:
-            proc = self._sync_call(self.JOURNALCTL + ' -n 500 -u %s')
+            proc = self._sync_call(self._argv(self.JOURNALCTL, '-n', '500',
+                                              '-u', self.unit))
             return {'journal': ''.join(proc.stdout)}
-        return LogfileMixin.service_logs(self, service, instance)
+        return BaseJob.service_logs(self, service, instance)
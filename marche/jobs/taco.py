@@ -54,6 +54,11 @@ This job has the following configuration parameters:
 
    .. describe:: permissions
                  pollinterval
+                 pollinterval_min
+                 pollinterval_max
+                 pollconcurrency
+                 status_timeout
+                 control_timeout
 
       The :ref:`standard parameters <standard-params>` present for all jobs.
 
@@ -67,7 +72,6 @@ from os import path
 from marche.six import iteritems
 
 from marche.jobs.base import Job as BaseJob
-from marche.utils import extract_loglines
 
 
 class Job(BaseJob):
@@ -133,33 +137,33 @@ class Job(BaseJob):
     def start_service(self, service, instance):
         key = service, instance
         initscript = self._initscripts[service]
-        self._async_start(key, initscript + ' start ' + instance)
+        self._async_start(key, self._argv(initscript, 'start', instance))
 
     def stop_service(self, service, instance):
         key = service, instance
         initscript = self._initscripts[service]
-        self._async_stop(key, initscript + ' stop ' + instance)
+        self._async_stop(key, self._argv(initscript, 'stop', instance))
 
     def restart_service(self, service, instance):
         key = service, instance
         initscript = self._initscripts[service]
-        self._async_start(key, initscript + ' restart ' + instance)
+        self._async_start(key, self._argv(initscript, 'restart', instance))
 
     def service_status(self, service, instance):
         key = service, instance
         initscript = self._initscripts[service]
-        command = initscript + ' status ' + instance
-        return self._async_status(key, command), ''
+        command = self._argv(initscript, 'status', instance)
+        return self._async_status_ext(key, command)
 
     def service_output(self, service, instance):
         key = service, instance
         return list(self._output.get(key, []))
 
-    def service_logs(self, service, instance):
+    def service_logfiles(self, service, instance):
         srvname = service[5:]  # strip "taco-"
         if srvname in self._logfiles and instance in self._logfiles[srvname]:
-            return extract_loglines(self._logfiles[srvname][instance])
-        return {}
+            return [self._logfiles[srvname][instance]]
+        return []
 
     # -- internal APIs --
 
@@ -0,0 +1,739 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Access to log files and their rotated predecessors.
+
+Rotated log files are found next to the current log file, either numbered
+in the style of logrotate (``file.1``, ``file.2.gz``, ``file.3.xz``, ...) or,
+for logs that are switched to a new file every day (like those written by
+NICOS, Entangle and Marche itself), as all other files in the same directory
+with the same extension.
+
+Listing the rotated files only looks at their size and modification time;
+their contents are only read (and decompressed, if necessary) on request.
+
+Clients that follow a log can read only the data appended since their last
+request, using *cursors*.  A cursor is an opaque string that records the
+inode and offset up to which the file was read; if the inode changes, the
+file has been rotated and the rest of the old file is read (if it can still
+be found) before the new one.
+
+A `LogFollower` watches the logfiles of a service for changes (using inotify
+if possible) and reports the newly appended data.
+
+Logfiles can be searched for lines matching a regular expression with
+`search_logfiles`.  Uncompressed files are searched through ``mmap``; to skip
+the parts of a file that are older than the requested start time, a sparse
+`LogIndex` with the offset and timestamp of every `LogIndex.step`-th line is
+kept for each file and updated as the file grows.  The timestamps of lines are
+determined by a *parser*, a function that takes the line (as bytes) and the
+name of the file and returns a Unix timestamp or None, like `iso_timestamp`
+or `daily_timestamp`.  Lines without a timestamp (such as tracebacks) belong
+to the preceding line.
+
+Since logs are ordered by time, `read_logrange` finds the lines logged within
+a time range by binary search on the line timestamps, reading only a few lines
+apart from the requested range.  It uses the `LogIndex` of a file only to
+narrow the search if one already exists, but never builds one.
+"""
+
+import os
+import re
+import gzip
+import mmap
+import time
+import bisect
+import threading
+import collections
+from os import path
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+from marche.jobs import Fault
+from marche.utils import read_tail, decode_loglines
+from marche.watch import watcher
+
+# Matches the suffix of a numbered rotated log file.
+rotated_re = re.compile(r'\.(\d+)(\.gz|\.xz)?$')
+
+# Size of chunks read from compressed log files.
+CHUNKSIZE = 65536
+
+# Maximum amount of new data returned for a cursor.
+CURSOR_LIMIT = 1048576
+
+# Maximum amount of data returned for a time range, per file.
+RANGE_LIMIT = 4194304
+
+
+def list_logfiles(filename, dated=False):
+    """Return a list of the log file *filename* and its rotated predecessors,
+    newest first.
+
+    Each entry is a dictionary with the keys ``name`` (the full path),
+    ``rotation`` (0 for the current file, increasing for older files),
+    ``size`` and ``mtime``.  If the current file does not exist, an empty
+    list is returned.
+
+    If *dated* is true, the log is rotated by switching to a new file (which
+    *filename*, usually a symlink, points to), and all older files in the
+    same directory with the same extension are returned.
+    """
+    if not path.exists(filename):
+        return []
+    filename = path.realpath(filename)
+    dirname, basename = path.split(filename)
+    rotations = []
+    if dated:
+        ext = path.splitext(basename)[1]
+        for name in os.listdir(dirname):
+            fullname = path.join(dirname, name)
+            if fullname != filename and path.splitext(name)[1] == ext and \
+               path.isfile(fullname) and not path.islink(fullname):
+                rotations.append((-os.stat(fullname).st_mtime, fullname))
+    else:
+        for name in os.listdir(dirname):
+            if name.startswith(basename + '.'):
+                match = rotated_re.match(name[len(basename):])
+                if match:
+                    rotations.append((int(match.group(1)),
+                                      path.join(dirname, name)))
+    rotations.sort()
+    result = []
+    for i, fullname in enumerate([filename] + [r[1] for r in rotations]):
+        try:
+            st = os.stat(fullname)
+        except OSError:  # pragma: no cover
+            continue  # rotated away in the meantime
+        result.append({'name': fullname, 'rotation': i,
+                       'size': st.st_size, 'mtime': st.st_mtime})
+    return result
+
+
+def open_logfile(filename):
+    """Open a (possibly compressed) log file for reading bytes."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    elif filename.endswith('.xz'):
+        if lzma is None:  # pragma: no cover
+            raise Fault('cannot decompress %s: lzma not available' % filename)
+        return lzma.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def read_logfile(filename, n=500):
+    """Return the last *n* lines of a (possibly compressed) log file, decoded
+    and cleaned up like `marche.utils.extract_loglines` does.
+
+    Uncompressed files are read backwards from the end; compressed files are
+    decompressed in chunks, keeping only the last lines in memory.
+    """
+    if not filename.endswith(('.gz', '.xz')):
+        return decode_loglines(read_tail(filename, n))
+    lines = collections.deque(maxlen=n)
+    partial = b''
+    with open_logfile(filename) as fp:
+        while True:
+            chunk = fp.read(CHUNKSIZE)
+            if not chunk:
+                break
+            chunk = (partial + chunk).split(b'\n')
+            partial = chunk.pop()
+            lines.extend(chunk)
+    if partial:
+        # unterminated last line
+        lines.append(partial)
+        return decode_loglines(b'\n'.join(lines))
+    return decode_loglines(b''.join(line + b'\n' for line in lines))
+
+
+def make_cursor(inode, offset):
+    return '%d:%d' % (inode, offset)
+
+
+def parse_cursor(cursor):
+    """Return the (inode, offset) tuple from a cursor string, or
+    (None, None) for an empty or invalid cursor.
+    """
+    try:
+        inode, offset = cursor.split(':')
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def _read_rotated_rest(filename, inode, offset, dated=False):
+    """Read the rest of the rotated file with the given inode."""
+    for entry in list_logfiles(filename, dated)[1:]:
+        if entry['name'].endswith(('.gz', '.xz')):
+            continue
+        try:
+            with open(entry['name'], 'rb') as fp:
+                st = os.fstat(fp.fileno())
+                if st.st_ino != inode:
+                    continue
+                if st.st_size - offset > CURSOR_LIMIT:
+                    offset = st.st_size - CURSOR_LIMIT
+                fp.seek(offset)
+                return fp.read(CURSOR_LIMIT)
+        except OSError:  # pragma: no cover
+            pass
+    return b''
+
+
+def read_since(filename, cursor=None, n=500, dated=False):
+    """Return the data appended to a log file since *cursor*, as a tuple of
+    the decoded data and the new cursor.
+
+    Without a valid cursor, or if more than `CURSOR_LIMIT` bytes have been
+    appended, the last *n* lines are returned.  Only complete lines are
+    returned, unless the file has been rotated.
+
+    *filename* should be the configured name of the log, not the file it
+    points to: if it is a symlink that has been switched to a new file (see
+    *dated* in `list_logfiles`), the rest of the old file is read first.
+    """
+    inode, offset = parse_cursor(cursor)
+    with open(path.realpath(filename), 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        data = b''
+        if inode is not None and inode != st.st_ino:
+            data = _read_rotated_rest(filename, inode, offset, dated)
+            offset = 0
+        elif offset is not None and offset > st.st_size:
+            # truncated, start again at the beginning
+            offset = 0
+        if offset is None or st.st_size - offset > CURSOR_LIMIT:
+            new = read_tail(fp, n, end=st.st_size)
+            offset = st.st_size
+        else:
+            fp.seek(offset)
+            new = fp.read(st.st_size - offset)
+            offset += len(new)
+        # leave incomplete last lines for the next time
+        partial = len(new) - new.rfind(b'\n') - 1
+        if partial:
+            new = new[:-partial]
+            offset -= partial
+    return decode_loglines(data + new), make_cursor(st.st_ino, offset)
+
+
+def read_before(filename, cursor, n=500):
+    """Return the last *n* lines of a log file before *cursor*, decoded.
+
+    Nothing is returned if the cursor belongs to a file that has been rotated
+    away in the meantime.
+    """
+    inode, offset = parse_cursor(cursor)
+    with open(path.realpath(filename), 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        if inode != st.st_ino or offset > st.st_size:
+            return ''
+        return decode_loglines(read_tail(fp, n, end=offset))
+
+
+class Flusher(object):
+    """A single thread that runs the delayed flushes of all `LogFollower`
+    instances.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._due = {}  # follower -> time of flush
+        self._thread = None
+
+    def schedule(self, follower, delay):
+        """Flush *follower* after *delay* seconds, unless a flush is already
+        pending."""
+        with self._cond:
+            if follower in self._due:
+                return
+            self._due[follower] = time.time() + delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._entry,
+                                                name='log flusher')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self, follower):
+        with self._cond:
+            self._due.pop(follower, None)
+
+    def _entry(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                ready = [f for (f, due) in self._due.items() if due <= now]
+                if not ready:
+                    self._cond.wait(min(self._due.values()) - now
+                                    if self._due else None)
+                    continue
+                for follower in ready:
+                    del self._due[follower]
+            for follower in ready:
+                try:
+                    follower._flush()
+                except Exception:  # pragma: no cover
+                    # followers must handle their errors
+                    pass
+
+
+flusher = Flusher()
+
+
+class LogFollower(object):
+    """Follows a list of logfiles, calling *callback* with a dictionary of
+    new data and a dictionary of cursors (like
+    `marche.jobs.base.Job.service_logs_since` returns) whenever data has
+    been appended.
+
+    Changes are collected for `delay` seconds before the files are read, so
+    that a burst of writes results in a single callback.  Files that cannot
+    be watched are checked every `poll_interval` seconds.  The files are read
+    by the `flusher` thread, not the thread that reports the changes.
+    """
+
+    delay = 0.2
+    poll_interval = 2.0
+
+    def __init__(self, logfiles, callback, cursors=None, dated=False):
+        self.logfiles = logfiles
+        self.callback = callback
+        self.dated = dated
+        self._cursors = dict(cursors or {})
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # keeps callbacks in order
+        self._handles = {}  # watched name -> handle
+        self._polling = False
+        self._stopped = False
+
+    def start(self):
+        with self._lock:
+            self._watch()
+            if self._polling:
+                flusher.schedule(self, self.poll_interval)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            flusher.cancel(self)
+            for handle in self._handles.values():
+                watcher.unwatch(handle)
+            self._handles.clear()
+
+    def snapshot(self, n=500):
+        """Return the last *n* lines of the logfiles up to the point that
+        has been reported, with their cursors, for a new subscriber.
+        """
+        with self._flush_lock:
+            with self._lock:
+                cursors = dict(self._cursors)
+            files = {}
+            for logfile, cursor in cursors.items():
+                try:
+                    files[logfile] = read_before(logfile, cursor, n)
+                except (IOError, OSError):  # pragma: no cover
+                    pass
+        return files, cursors
+
+    def _watch(self):
+        # Must be called with the lock held.  Watches both the configured
+        # names (which can be symlinks switched to new files) and the files
+        # they point to.
+        wanted = set()
+        for logfile in self.logfiles:
+            wanted.update((logfile, path.realpath(logfile)))
+        for name in set(self._handles) - wanted:
+            watcher.unwatch(self._handles.pop(name))
+        for name in wanted - set(self._handles):
+            handle = watcher.watch_file(name, self._changed)
+            if handle is None:
+                self._polling = True
+            else:
+                self._handles[name] = handle
+
+    def _changed(self):
+        # Called from the watcher thread: must not wait for file I/O.
+        if not self._stopped:
+            flusher.schedule(self, self.delay)
+
+    def _flush(self):
+        with self._flush_lock:
+            self._do_flush()
+
+    def _do_flush(self):
+        with self._lock:
+            if self._stopped:
+                return
+            cursors = dict(self._cursors)
+        # read without holding the lock
+        files, new_cursors = {}, {}
+        for logfile in self.logfiles:
+            if not path.exists(logfile):
+                continue
+            cursor = cursors.get(logfile)
+            try:
+                if cursor is None:
+                    # a new file: read it from the start
+                    cursor = make_cursor(os.stat(logfile).st_ino, 0)
+                data, new_cursors[logfile] = read_since(
+                    logfile, cursor, dated=self.dated)
+            except (IOError, OSError):  # pragma: no cover
+                continue
+            if data:
+                files[logfile] = data
+        with self._lock:
+            if self._stopped:
+                return
+            self._cursors.update(new_cursors)
+            self._watch()
+            cursors = dict(self._cursors)
+            if self._polling:
+                flusher.schedule(self, self.poll_interval)
+        if files:
+            self.callback(files, cursors)
+
+
+iso_timestamp_re = re.compile(
+    br'(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)(?:[,.](\d{1,6}))?')
+
+
+def iso_timestamp(line, filename):
+    """Parse a timestamp like ``2016-01-31 12:34:56,789`` at the start of the
+    line, in local time.
+    """
+    match = iso_timestamp_re.match(line)
+    if match is None:
+        return None
+    fields = match.groups()
+    tstamp = time.mktime(tuple(int(f) for f in fields[:6]) + (0, 0, -1))
+    if fields[6]:
+        tstamp += float(b'0.' + fields[6])
+    return tstamp
+
+
+daily_timestamp_re = re.compile(br'(\d\d):(\d\d):(\d\d)(?:,(\d{3}))? ')
+filename_date_re = re.compile(r'(\d{4})-(\d\d)-(\d\d)')
+_filename_dates = {}
+
+
+def daily_timestamp(line, filename):
+    """Parse a timestamp like ``12:34:56,789`` at the start of the line,
+    as written to daily logfiles by Marche, NICOS and Entangle.
+
+    The date is taken from the filename, which must contain it in the form
+    ``2016-01-31``, or else from the modification time of the file.
+    """
+    match = daily_timestamp_re.match(line)
+    if match is None:
+        return None
+    date = _filename_dates.get(filename)
+    if date is None:
+        dmatch = filename_date_re.search(path.basename(filename))
+        if dmatch:
+            date = _filename_dates[filename] = \
+                tuple(int(f) for f in dmatch.groups())
+        else:
+            date = time.localtime(os.stat(filename).st_mtime)[:3]
+    fields = match.groups()
+    tstamp = time.mktime(date + tuple(int(f) for f in fields[:3]) +
+                         (0, 0, -1))
+    if fields[3]:
+        tstamp += int(fields[3]) / 1000.
+    return tstamp
+
+
+class LogIndex(object):
+    """A sparse index of an uncompressed logfile.
+
+    It records the offset of every `step`-th line, together with its
+    timestamp (or the timestamp of one of the next few lines, if the line
+    has none), and the timestamps of the first and last lines of the file.
+    """
+
+    step = 1000
+
+    def __init__(self, filename, parser):
+        self.filename = filename
+        self.parser = parser
+        self.lock = threading.Lock()
+        self.inode = None
+        self.size = 0
+        self.offsets = []
+        self.timestamps = []
+        self.first = self.last = None
+
+    def _timestamp(self, mm, pos, lines=10):
+        for _ in range(lines):
+            end = mm.find(b'\n', pos)
+            tstamp = self.parser(mm[pos:end if end != -1 else len(mm)],
+                                 self.filename)
+            if tstamp is not None or end == -1:
+                return tstamp
+            pos = end + 1
+
+    def update(self, mm, st):
+        """Update the index from the mapped file *mm* with stat result
+        *st*.  Only the part of the file added since the last update is
+        read, unless the file has been replaced or truncated.
+        """
+        if st.st_ino != self.inode or st.st_size < self.size:
+            self.inode = st.st_ino
+            self.size = 0
+            self.offsets = [0]
+            self.timestamps = [self._timestamp(mm, 0)]
+            self.first = self.timestamps[0]
+        if st.st_size == self.size:
+            return
+        block_re = re.compile(
+            ('(?:[^\\n]*\\n){%d}' % self.step).encode('ascii'))
+        pos = self.offsets[-1]
+        while True:
+            match = block_re.match(mm, pos)
+            if match is None or match.end() >= st.st_size:
+                break
+            pos = match.end()
+            self.offsets.append(pos)
+            self.timestamps.append(self._timestamp(mm, pos))
+        if self.first is None:
+            self.first = self._timestamp(mm, 0, self.step)
+        self.last = None
+        for line in reversed(read_tail(mm, 100, end=st.st_size).splitlines()):
+            self.last = self.parser(line, self.filename)
+            if self.last is not None:
+                break
+        self.size = st.st_size
+
+    def start_offset(self, since):
+        """Return an offset at which all lines with timestamps at or after
+        *since* start.
+        """
+        known = [(t, o) for (t, o) in zip(self.timestamps, self.offsets)
+                 if t is not None]
+        i = bisect.bisect_left([t for (t, _) in known], since)
+        return known[i - 1][1] if i > 0 else 0
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(filename, mm, st, parser):
+    """Return the up-to-date `LogIndex` for the file.
+
+    Only the lookup holds the global lock; the index itself is updated under
+    its own lock, so that indexing one file does not block the others.
+    """
+    with _indexes_lock:
+        index = _indexes.get(filename)
+        if index is None or index.parser is not parser:
+            index = _indexes[filename] = LogIndex(filename, parser)
+    with index.lock:
+        index.update(mm, st)
+    return index
+
+
+def known_offset(filename, st, parser, since):
+    """Return an offset before the first line of the file logged at or after
+    *since*, using the `LogIndex` of the file if one has already been built,
+    or 0 otherwise.  The index is not built or updated.
+    """
+    with _indexes_lock:
+        index = _indexes.get(filename)
+    if index is None or index.parser is not parser:
+        return 0
+    with index.lock:
+        if index.inode != st.st_ino or index.size > st.st_size:
+            return 0
+        return index.start_offset(since)
+
+
+def _map(filename):
+    """Return an mmap of the file and its stat result, or None for an empty
+    file.
+    """
+    with open(filename, 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        if not st.st_size:
+            return None, st
+        return mmap.mmap(fp.fileno(), st.st_size,
+                         access=mmap.ACCESS_READ), st
+
+
+def _search_mapped(filename, regex, since, parser):
+    mm, st = _map(filename)
+    if mm is None:
+        return
+    try:
+        pos = 0
+        if since is not None:
+            index = get_index(filename, mm, st, parser)
+            if index.last is not None and index.last < since:
+                return
+            pos = index.start_offset(since)
+        while True:
+            match = regex.search(mm, pos)
+            if match is None:
+                return
+            start = mm.rfind(b'\n', 0, match.start()) + 1
+            end = mm.find(b'\n', match.start())
+            pos = end + 1 if end != -1 else st.st_size
+            if end != -1 and match.end() > end and \
+               not regex.search(mm, start, end):
+                continue  # match spans lines, but the line alone doesn't
+            line = mm[start:pos]
+            if since is not None:
+                tstamp = parser(line, filename)
+                if tstamp is not None and tstamp < since:
+                    continue
+            yield line
+            if end == -1:
+                return
+    finally:
+        mm.close()
+
+
+def _search_compressed(filename, regex, since, parser):
+    with open_logfile(filename) as fp:
+        for line in fp:
+            if regex.search(line, 0, len(line.rstrip(b'\n'))):
+                if since is not None:
+                    tstamp = parser(line, filename)
+                    if tstamp is not None and tstamp < since:
+                        continue
+                yield line
+
+
+def search_logfiles(filenames, regex, since=None, limit=None,
+                    parser=iso_timestamp):
+    """Search the given logfiles, in order, for lines matching *regex* (a
+    compiled bytes pattern) and yield them as ``(filename, line)`` tuples.
+
+    Each line is matched on its own; *regex* should be compiled with
+    `re.MULTILINE` so that ``^`` and ``$`` match at line boundaries.
+
+    If *since* is given, files last modified before it are skipped, as are
+    lines with a timestamp before it.  At most *limit* lines are yielded.
+    """
+    count = 0
+    for filename in filenames:
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            continue  # rotated away in the meantime
+        if since is not None and mtime < since:
+            continue
+        if filename.endswith(('.gz', '.xz')):
+            lines = _search_compressed(filename, regex, since, parser)
+        else:
+            lines = _search_mapped(filename, regex, since, parser)
+        for line in lines:
+            yield filename, line
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+def _next_stamp(mm, pos, parser, filename):
+    """Return the timestamp and offset of the first line with a timestamp
+    that starts at or after *pos*, or (None, size) if there is none.
+    """
+    if pos > 0 and mm[pos - 1:pos] != b'\n':
+        pos = mm.find(b'\n', pos) + 1 or len(mm)
+    while pos < len(mm):
+        end = mm.find(b'\n', pos)
+        end = len(mm) if end == -1 else end + 1
+        tstamp = parser(mm[pos:end], filename)
+        if tstamp is not None:
+            return tstamp, pos
+        pos = end
+    return None, len(mm)
+
+
+def find_time(mm, tstamp, parser, filename, lo=0, after=False):
+    """Return the offset of the first line in the mapped file *mm* with a
+    timestamp at or after (if *after* is true: strictly after) *tstamp*,
+    starting the search at *lo*.  The lines are bisected by offset.
+    """
+    hi = len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        found = _next_stamp(mm, mid, parser, filename)[0]
+        if found is None or found > tstamp or (found == tstamp and not after):
+            hi = mid
+        else:
+            lo = mid + 1
+    return _next_stamp(mm, lo, parser, filename)[1]
+
+
+def _range_compressed(filename, t_start, t_end, parser):
+    lines = []
+    size = 0
+    inside = False
+    with open_logfile(filename) as fp:
+        for line in fp:
+            tstamp = parser(line, filename)
+            if tstamp is not None:
+                if tstamp > t_end:
+                    break
+                inside = tstamp >= t_start
+            if inside:
+                lines.append(line)
+                size += len(line)
+                if size >= RANGE_LIMIT:
+                    break
+    return b''.join(lines)
+
+
+def read_logrange(filename, t_start, t_end, parser=iso_timestamp):
+    """Return the lines of the logfile with timestamps between *t_start* and
+    *t_end* (inclusive), as bytes, or None if the file does not contain any
+    of the range.
+
+    At most `RANGE_LIMIT` bytes (of complete lines) are returned.
+    """
+    try:
+        if os.stat(filename).st_mtime < t_start:
+            return None
+        if filename.endswith(('.gz', '.xz')):
+            return _range_compressed(filename, t_start, t_end, parser) or None
+        mm, st = _map(filename)
+    except (IOError, OSError):
+        return None  # rotated away in the meantime
+    if mm is None:
+        return None
+    try:
+        start = find_time(mm, t_start, parser, filename,
+                          known_offset(filename, st, parser, t_start))
+        end = find_time(mm, t_end, parser, filename, start, after=True)
+        if end - start > RANGE_LIMIT:
+            end = mm.rfind(b'\n', start, start + RANGE_LIMIT) + 1 or \
+                start + RANGE_LIMIT
+        return mm[start:end] or None
+    finally:
+        mm.close()
@@ -21,72 +21,354 @@
 #   Georg Brandl <g.brandl@fz-juelich.de>
 #
 # *****************************************************************************
+"""Polling loop for jobs.
 
-"""Polling loop for jobs."""
+All jobs share a single :class:`Scheduler`, which keeps a heap of the next
+due ``(job, service, instance)`` status probes and services it with a bounded
+pool of worker threads.  Workers are only started when no idle one is left;
+the pool is limited by the ``pollworkers`` setting, or by default by the
+total poll concurrency of all jobs (but at least `Scheduler.min_workers`), so
+that slow or hanging probes of some jobs don't keep the others from polling.
+"""
 
 import time
+import heapq
+import itertools
 import threading
 
-from marche.six.moves import queue
-
 from marche.protocol import StatusEvent
+from marche.watch import watcher
+
+
+class Scheduler(object):
+    """The daemon-wide poll scheduler."""
+
+    #: Maximum number of worker threads that execute probes.  If zero, the
+    #: limit is the sum of the concurrency of all started pollers.
+    max_workers = 0
+    #: Minimum for the automatic limit.
+    min_workers = 4
+
+    def __init__(self, max_workers=None):
+        if max_workers is not None:
+            self.max_workers = max_workers
+        self._pollers = set()
+        self._concurrency = 0
+        self._heap = []
+        self._cond = threading.Condition()
+        self._workers = []
+        self._idle = 0
+        self._counter = itertools.count()
+
+    def register(self, poller):
+        """Count the poller's concurrency towards the automatic limit."""
+        with self._cond:
+            if poller not in self._pollers:
+                self._pollers.add(poller)
+                self._concurrency += poller.concurrency
+
+    def unregister(self, poller):
+        with self._cond:
+            if poller in self._pollers:
+                self._pollers.discard(poller)
+                self._concurrency -= poller.concurrency
+
+    def worker_limit(self, poller):
+        """Return the number of workers allowed when scheduling a probe for
+        *poller*."""
+        if self.max_workers:
+            return max(self.max_workers, poller.concurrency)
+        return max(self.min_workers, self._concurrency, poller.concurrency)
+
+    def schedule(self, poller, key, delay):
+        """Schedule a probe of *key* for *poller* after *delay* seconds.
+
+        Any previously scheduled probe of the same key is superseded.
+        """
+        with self._cond:
+            self._push(poller, key, delay)
+
+    def reschedule(self, poller, key, delay):
+        """Like `schedule`, but only if *key* is still registered."""
+        with self._cond:
+            if key in poller._tokens:
+                self._push(poller, key, delay)
+
+    def _push(self, poller, key, delay):
+        # Must be called with the condition held.
+        token = next(self._counter)
+        poller._tokens[key] = token
+        heapq.heappush(self._heap, (time.time() + delay, token, poller, key))
+        if not self._idle and len(self._workers) < self.worker_limit(poller):
+            thread = threading.Thread(target=self._worker,
+                                      name='poller-%d' % len(self._workers))
+            thread.setDaemon(True)
+            self._workers.append(thread)
+            thread.start()
+        self._cond.notify()
+
+    def unschedule(self, poller):
+        """Remove all scheduled probes of *poller*, and wait for currently
+        running ones to finish.
+        """
+        with self._cond:
+            poller._tokens.clear()
+            del poller._deferred[:]
+            while poller._inflight:
+                self._cond.wait()
+
+    def _next(self):
+        # Must be called with the condition held.
+        while True:
+            if not self._heap:
+                self._idle += 1
+                self._cond.wait()
+                self._idle -= 1
+                continue
+            due, token, poller, key = self._heap[0]
+            now = time.time()
+            if due > now:
+                self._idle += 1
+                self._cond.wait(due - now)
+                self._idle -= 1
+                continue
+            heapq.heappop(self._heap)
+            if poller._tokens.get(key) != token:
+                # superseded or unscheduled
+                continue
+            poller._tokens[key] = None
+            if poller._inflight >= poller.concurrency:
+                poller._deferred.append(key)
+                continue
+            poller._inflight += 1
+            return poller, key
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                poller, key = self._next()
+            try:
+                poller._probe(key)
+            except Exception:
+                poller.job.log.exception('error while polling %s.%s' % key)
+            finally:
+                with self._cond:
+                    poller._inflight -= 1
+                    if poller._tokens.get(key, 0) is None:
+                        self._push(poller, key, poller.current_interval(key))
+                    while poller._deferred:
+                        deferred = poller._deferred.pop(0)
+                        if poller._tokens.get(deferred, 0) is None:
+                            self._push(poller, deferred, 0)
+                    self._cond.notify_all()
+
+
+#: The scheduler instance used by all pollers.
+scheduler = Scheduler()
 
 
 class Poller(object):
-    """The poller object; each job instantiates a poller and can start it."""
+    """The poller object; each job instantiates a poller and can start it.
+
+    Starting the poller registers all of the job's services with the
+    daemon-wide scheduler.
+
+    If *min_interval* and *max_interval* differ from *interval*, the polling
+    interval adapts per service: after a state change (or a control action)
+    the service is polled every *min_interval* seconds, and every
+    `stable_sweeps` unchanged results the interval is doubled, up to
+    *max_interval*.
 
-    def __init__(self, job, interval, event_callback):
+    If the job can tell the PID of a running service, the process is watched
+    and the service is polled right after it exits; the periodic polling then
+    only serves as a sanity check every `watched_interval` seconds.  Pidfiles
+    given by the job are watched as well.
+    """
+
+    #: Number of unchanged results after which the interval is increased.
+    stable_sweeps = 5
+    #: Polling interval for services whose process is watched.
+    watched_interval = 60.0
+    #: Interval, and number of times, to poll again if the job still reports
+    #: a watched process as running after it exited.
+    exit_recheck_interval = 0.1
+    exit_rechecks = 10
+
+    def __init__(self, job, interval, event_callback, concurrency=1,
+                 min_interval=None, max_interval=None):
         self.job = job
         self.interval = interval
-        self.queue = queue.Queue()
         self.event_callback = event_callback
-        self._thread = None
-        self._stoprequest = False
-        self._cache = {}
+        # number of probes of the same job that may run at the same time
+        self.concurrency = concurrency
+        self.min_interval = interval if min_interval is None else \
+            min(min_interval, interval)
+        self.max_interval = interval if max_interval is None else \
+            max(max_interval, interval)
+        # current interval and number of unchanged results, per service
+        self._intervals = {}
+        self._stable = {}
+        # watched pids and pidfiles, and recently exited pids, per service
+        self._watch_lock = threading.Lock()
+        self._pidwatches = {}
+        self._filewatches = {}
+        self._exited = {}
+        self.scheduler = scheduler
+        self._tokens = {}
+        self._deferred = []
+        self._inflight = 0
+        # Snapshot of the latest results, a dict of (service, instance) ->
+        # (timestamp, result).  It is never mutated, only replaced, so that
+        # readers need no lock.
+        self._snapshot = {}
+        self._publish_lock = threading.Lock()
+
+    @property
+    def adaptive(self):
+        return self.min_interval != self.max_interval
+
+    def current_interval(self, key):
+        """Return the current polling interval for the service *key*."""
+        if key in self._exited:
+            return self.exit_recheck_interval
+        interval = self._intervals.get(key, self.interval)
+        if key in self._pidwatches:
+            return max(interval, self.watched_interval)
+        return interval
+
+    def _adapt(self, key, changed):
+        if not self.adaptive:
+            return
+        if changed:
+            self._intervals[key] = self.min_interval
+            self._stable[key] = 0
+            return
+        stable = self._stable.get(key, 0) + 1
+        if stable >= self.stable_sweeps:
+            self._intervals[key] = min(
+                2 * self._intervals.get(key, self.interval),
+                self.max_interval)
+            stable = 0
+        self._stable[key] = stable
 
     def start(self):
-        self._stoprequest = False
-        self._thread = threading.Thread(target=self._entry)
-        self._thread.setDaemon(True)
-        self._thread.start()
+        self._intervals.clear()
+        self._stable.clear()
+        self.scheduler.register(self)
+        for key in self.job.get_services():
+            self.scheduler.schedule(self, key, 0)
+            pidfile = self.job.service_pidfile(*key)
+            if pidfile:
+                handle = watcher.watch_file(
+                    pidfile, lambda key=key: self.poll_service_now(key))
+                if handle is not None:
+                    self._filewatches[key] = handle
 
     def stop(self):
-        if self._thread and self._thread.isAlive():
-            self._stoprequest = True
-            self.queue.put(None)
-            self._thread.join()
+        self.scheduler.unschedule(self)
+        self.scheduler.unregister(self)
+        with self._watch_lock:
+            for handle in self._filewatches.values():
+                watcher.unwatch(handle)
+            for _pid, handle in self._pidwatches.values():
+                watcher.unwatch(handle)
+            self._filewatches.clear()
+            self._pidwatches.clear()
+            self._exited.clear()
+
+    def poll_now(self):
+        """Schedule all currently registered services to be polled now."""
+        for key in list(self._tokens):
+            self.scheduler.reschedule(self, key, 0)
+
+    def poll_service_now(self, key):
+        """Schedule a single service to be polled now."""
+        self.scheduler.reschedule(self, key, 0)
 
     def get(self, service, instance):
-        cached = self._cache.get((service, instance), [0, None])
-        if time.time() > cached[0] + 1.5 * self.interval:
+        key = (service, instance)
+        cached = self._snapshot.get(key)
+        if cached is None or \
+           time.time() > cached[0] + 1.5 * self.current_interval(key):
             return None
         return cached[1]
 
+    def cached(self, service, instance):
+        """Return the last polled status, however old, or None if the service
+        has not been polled yet.
+        """
+        cached = self._snapshot.get((service, instance))
+        return cached[1] if cached is not None else None
+
     def invalidate(self, service, instance):
-        self._cache.pop((service, instance), None)
+        """Forget the cached status, and poll the service quickly until its
+        state settles again.
+        """
+        self._adapt((service, instance), True)
+        with self._publish_lock:
+            snapshot = dict(self._snapshot)
+            snapshot.pop((service, instance), None)
+            self._snapshot = snapshot
 
-    def _entry(self):
-        while not self._stoprequest:
-            try:
-                # Wait interval or until something arrives in the queue.
-                req = self.queue.get(True, self.interval)
-                if req is None:
-                    continue
-            except queue.Empty:
-                pass
-            with self.job.lock:
-                for key in self.job.get_services():
-                    try:
-                        result = self.job.service_status(*key)
-                    except Exception:
-                        continue
-                    if result != self._cache.get(key, [0, None])[1]:
-                        self._cache[key] = [time.time(), result]
-                        self.event_callback(StatusEvent(
-                            service=key[0],
-                            instance=key[1],
-                            state=result[0],
-                            ext_status=result[1],
-                        ))
-                    else:
-                        self._cache[key][0] = time.time()
+    def _probe(self, key):
+        try:
+            with self.job.service_lock(*key):
+                result = self.job.service_status(*key)
+        except Exception:
+            # don't keep reporting the last state; requests will query the
+            # service themselves and see the error
+            with self._publish_lock:
+                if key in self._snapshot:
+                    snapshot = dict(self._snapshot)
+                    del snapshot[key]
+                    self._snapshot = snapshot
+            return
+        with self._publish_lock:
+            cached = self._snapshot.get(key)
+            snapshot = dict(self._snapshot)
+            snapshot[key] = (time.time(), result)
+            self._snapshot = snapshot
+        changed = cached is None or result != cached[1]
+        self._adapt(key, changed)
+        self._update_pidwatch(key)
+        if changed:
+            self.event_callback(StatusEvent(
+                service=key[0],
+                instance=key[1],
+                state=result[0],
+                ext_status=result[1],
+            ))
+
+    def _process_exited(self, key, pid):
+        with self._watch_lock:
+            watch = self._pidwatches.get(key)
+            if watch is None or watch[0] != pid:
+                return
+            del self._pidwatches[key]
+            self._exited[key] = (pid, 0)
+        self.poll_service_now(key)
+
+    def _update_pidwatch(self, key):
+        try:
+            pid = self.job.service_pid(*key)
+        except Exception:
+            pid = None
+        with self._watch_lock:
+            exited = self._exited.pop(key, None)
+            if exited is not None and pid == exited[0]:
+                # the job did not notice the exit yet; check again soon
+                if exited[1] < self.exit_rechecks:
+                    self._exited[key] = (pid, exited[1] + 1)
+                return
+            watch = self._pidwatches.get(key)
+            if watch is not None:
+                if watch[0] == pid:
+                    return
+                watcher.unwatch(watch[1])
+                del self._pidwatches[key]
+            if pid is None or key not in self._tokens:
+                return
+            handle = watcher.watch_pid(
+                pid, lambda: self._process_exited(key, pid))
+            if handle is not None:
+                self._pidwatches[key] = (pid, handle)
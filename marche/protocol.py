@@ -29,7 +29,7 @@ import json
 from marche.six import add_metaclass
 
 # Increment this when making changes to the protocol.
-PROTO_VERSION = 2
+PROTO_VERSION = 3
 
 
 class Commands(object):
@@ -41,8 +41,17 @@ class Commands(object):
     RESTART_SERVICE = 'restart'
     REQUEST_SERVICE_LIST = 'services?'
     REQUEST_SERVICE_STATUS = 'status?'
+    REQUEST_ALL_STATUS = 'allstatus?'
+    REQUEST_EVENTS_SINCE = 'eventssince?'
     REQUEST_CONTROL_OUTPUT = 'output?'
     REQUEST_LOG_FILES = 'logfiles?'
+    REQUEST_LOG_CATALOGUE = 'logcatalogue?'
+    REQUEST_LOG_FILE = 'logfile?'
+    REQUEST_LOGS_SINCE = 'logssince?'
+    FOLLOW_LOGS = 'followlogs'
+    UNFOLLOW_LOGS = 'unfollowlogs'
+    SEARCH_LOGS = 'searchlogs'
+    REQUEST_LOG_RANGE = 'logrange?'
     REQUEST_CONF_FILES = 'conffiles?'
     SEND_CONF_FILE = 'sendconfig'
 
@@ -53,9 +62,12 @@ class Events(object):
     SERVICE_LIST = 'services'
     ERROR = 'error'
     STATUS = 'status'
+    ALL_STATUS = 'allstatus'
+    EVENTS = 'events'
     CONTROL_OUTPUT = 'output'
     CONF_FILES = 'conffiles'
     LOG_FILES = 'logfiles'
+    LOG_CATALOGUE = 'logcatalogue'
     FOUND_HOST = 'host'
 
 
@@ -81,23 +93,45 @@ class SerializableMessage(object):
     #: Designation of the type of message.
     type = None
 
-    def serialize(self):
+    #: Sequence number of an event emitted by the daemon, None otherwise.
+    seq = None
+
+    #: Attributes added in later protocol versions, with the version.  They
+    #: are left out for peers using an older version, which would not accept
+    #: them.
+    new_fields = {'seq': 3}
+
+    def to_dict(self, proto_version=PROTO_VERSION):
         if not self.type:
             raise RuntimeError('base class cannot be serialized')
         ret = {'type': self.type}
         ret.update(vars(self))
-        return json.dumps(ret).encode('utf-8')
+        for name, version in self.new_fields.items():
+            if version > proto_version:
+                ret.pop(name, None)
+        return ret
+
+    def serialize(self, proto_version=PROTO_VERSION):
+        return json.dumps(self.to_dict(proto_version)).encode('utf-8')
 
     @classmethod
-    def unserialize(cls, data):
-        data = json.loads(data.decode('utf-8'))
+    def from_dict(cls, data):
+        data = dict(data)
         if 'type' not in data:
             raise RuntimeError('type not given in data')
         if data['type'] not in cls.registry:
             # command is not recognized; ignore it for compatibility
             return None
         cls = cls.registry[data.pop('type')]
-        return cls(**data)
+        seq = data.pop('seq', None)
+        msg = cls(**data)
+        if seq is not None:
+            msg.seq = seq
+        return msg
+
+    @classmethod
+    def unserialize(cls, data):
+        return cls.from_dict(json.loads(data.decode('utf-8')))
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and \
@@ -115,10 +149,21 @@ class Command(SerializableMessage):
 
 class AuthenticateCommand(Command):
     type = Commands.AUTHENTICATE
-
-    def __init__(self, user, passwd):
+    #: Names of the codecs (see :mod:`marche.codec`) the client supports for
+    #: the rest of the connection, in order of preference.
+    codecs = None
+    #: Protocol version of the client; messages sent to clients that don't
+    #: give it are compatible with version 2.
+    proto_version = None
+
+    def __init__(self, user, passwd, codecs=None, proto_version=None):
         self.user = user
         self.passwd = passwd
+        # only sent if given, for compatibility with older daemons
+        if codecs is not None:
+            self.codecs = codecs
+        if proto_version is not None:
+            self.proto_version = proto_version
 
 
 class ScanNetworkCommand(Command):
@@ -133,6 +178,17 @@ class RequestServiceListCommand(Command):
     type = Commands.REQUEST_SERVICE_LIST
 
 
+class RequestAllStatusCommand(Command):
+    type = Commands.REQUEST_ALL_STATUS
+
+
+class RequestEventsSinceCommand(Command):
+    type = Commands.REQUEST_EVENTS_SINCE
+
+    def __init__(self, since):
+        self.since = since
+
+
 class ServiceCommand(Command):
     def __init__(self, service, instance):
         self.service = service
@@ -163,6 +219,53 @@ class RequestLogFilesCommand(ServiceCommand):
     type = Commands.REQUEST_LOG_FILES
 
 
+class RequestLogCatalogueCommand(ServiceCommand):
+    type = Commands.REQUEST_LOG_CATALOGUE
+
+
+class RequestLogFileCommand(ServiceCommand):
+    type = Commands.REQUEST_LOG_FILE
+
+    def __init__(self, service, instance, filename):
+        ServiceCommand.__init__(self, service, instance)
+        self.filename = filename
+
+
+class RequestLogsSinceCommand(ServiceCommand):
+    type = Commands.REQUEST_LOGS_SINCE
+
+    def __init__(self, service, instance, cursors):
+        ServiceCommand.__init__(self, service, instance)
+        self.cursors = cursors
+
+
+class FollowLogsCommand(ServiceCommand):
+    type = Commands.FOLLOW_LOGS
+
+
+class UnfollowLogsCommand(ServiceCommand):
+    type = Commands.UNFOLLOW_LOGS
+
+
+class SearchLogsCommand(ServiceCommand):
+    type = Commands.SEARCH_LOGS
+
+    def __init__(self, service, instance, regex, since, limit):
+        ServiceCommand.__init__(self, service, instance)
+        self.regex = regex
+        self.since = since
+        self.limit = limit
+
+
+class RequestLogRangeCommand(ServiceCommand):
+    type = Commands.REQUEST_LOG_RANGE
+
+    def __init__(self, service, instance, t_start, t_end):
+        ServiceCommand.__init__(self, service, instance)
+        self.t_start = t_start
+        self.t_end = t_end
+
+
 class RequestConfFilesCommand(ServiceCommand):
     type = Commands.REQUEST_CONF_FILES
 
@@ -200,9 +303,15 @@ class ServiceListEvent(Event):
 
 class AuthEvent(Event):
     type = Events.AUTH_RESULT
+    #: Name of the codec used for all following messages, if the client
+    #: asked for codecs.
+    codec = None
 
-    def __init__(self, success):
+    def __init__(self, success, codec=None):
         self.success = success
+        # only sent if the client asked for it
+        if codec is not None:
+            self.codec = codec
 
 
 class ServiceEvent(Event):
@@ -220,6 +329,27 @@ class StatusEvent(ServiceEvent):
         self.ext_status = ext_status
 
 
+class AllStatusEvent(Event):
+    type = Events.ALL_STATUS
+
+    def __init__(self, services):
+        # {service: {instance: (state, ext_status)}}
+        self.services = services
+
+
+class EventsEvent(Event):
+    type = Events.EVENTS
+
+    def __init__(self, events, last, resync, uid):
+        # list of events, as returned by to_dict()
+        self.events = events
+        # sequence number of the last emitted event
+        self.last = last
+        self.resync = resync
+        # sequence numbers restart with every run of the daemon
+        self.uid = uid
+
+
 class ErrorEvent(ServiceEvent):
     type = Events.ERROR
 
@@ -249,6 +379,15 @@ class ConffileEvent(FileEvent):
 
 class LogfileEvent(FileEvent):
     type = Events.LOG_FILES
+    new_fields = dict(FileEvent.new_fields, cursors=3)
+
+    def __init__(self, service, instance, files, cursors=None):
+        FileEvent.__init__(self, service, instance, files)
+        self.cursors = cursors
+
+
+class LogCatalogueEvent(FileEvent):
+    type = Events.LOG_CATALOGUE
 
 
 class FoundHostEvent(Event):
@@ -30,18 +30,23 @@ from __future__ import print_function
 import os
 import re
 import sys
+import time
+import errno
+import signal
 import socket
 import select
-import collections
+import threading
 from os import path
+from logging import DEBUG
 from threading import Thread
 from subprocess import Popen, PIPE
 
 try:
     import pwd
     import grp
+    import fcntl
 except ImportError:  # pragma: no cover
-    pwd = grp = None
+    pwd = grp = fcntl = None
 
 
 def ensure_directory(dirname):
@@ -131,6 +136,15 @@ def remove_pidfile(pid_dir):
     os.unlink(path.join(pid_dir, 'marched.pid'))
 
 
+def read_pidfile(fname):
+    """Read the PID from a pidfile, return None if not possible."""
+    try:
+        with open(fname) as fp:
+            return int(fp.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
 class lazy_property(object):
     """A property that calculates its value only once."""
     def __init__(self, func):
@@ -145,112 +159,453 @@ class lazy_property(object):
         return obj.__dict__[self.__name__]
 
 
-if os.name == 'nt':  # pragma: no cover
-    class Poller(object):
-        """A poor imitation of polling for Windows."""
+class MultiLock(object):
+    """Holds several locks at once, acquiring them in the given order."""
 
-        def __init__(self):
-            self.fds = []
+    def __init__(self, locks):
+        self.locks = locks
 
-        def register(self, fp, opt):
-            self.fds.append(fp.fileno())
+    def acquire(self):
+        for lock in self.locks:
+            lock.acquire()
 
-        def poll(self):
-            return [(fd, None) for fd in self.fds]
-    POLLIN = None
+    def release(self):
+        for lock in reversed(self.locks):
+            lock.release()
 
-else:
-    Poller = select.poll
-    POLLIN = select.POLLIN
+    def locked(self):
+        return any(lock.locked() for lock in self.locks)
 
+    def __enter__(self):
+        self.acquire()
 
-class AsyncProcess(Thread):
-    def __init__(self, status, log, cmd, sh=True, stdout=None, stderr=None):
-        Thread.__init__(self)
-        self.setDaemon(True)
+    def __exit__(self, *args):
+        self.release()
 
-        self.status = status
-        self.log = log
-        self.cmd = cmd
-        self.use_sh = sh
 
-        self.done = False
-        self.retcode = None
-        self.stdout = stdout if stdout is not None else []
-        self.stderr = stderr if stderr is not None else []
+class ProcessReactor(object):
+    """A single thread that reads the output of all child processes started
+    by `AsyncProcess`, and notices when they exit.
 
-    def run(self):
-        self.log.debug('call [sh:%s]: %s' % (self.use_sh, self.cmd))
-        proc = None
-        poller = None
-
-        def poll_output():
-            """
-            Read, log and store output (if any) from processes pipes.
-            """
-            # collect fds with new output
-            fds = [entry[0] for entry in poller.poll()]
-
-            if proc.stdout.fileno() in fds:
-                for line in iter(proc.stdout.readline, b''):
-                    line = line.translate(None, b'\r')
-                    line = line.decode('utf-8', 'replace')
-                    self.log.debug(line.rstrip())
-                    self.stdout.append(line)
-            if proc.stderr.fileno() in fds:
-                for line in iter(proc.stderr.readline, b''):
-                    line = line.translate(None, b'\r')
-                    line = line.decode('utf-8', 'replace')
-                    self.log.warning(line.rstrip())
-                    self.stderr.append(line)
+    Exits are noticed through a pidfd where available, otherwise every
+    `tick` seconds.
 
+    Processes that run longer than their timeout get their process group
+    terminated, and killed `kill_grace` seconds later if still running.
+    """
+
+    tick = 0.1
+    kill_grace = 2.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._poller = None
+        self._wakeup = None
+        self._fds = {}     # pipe fd -> (process, stream)
+        self._pidfds = {}  # pidfd -> process
+        self._procs = set()
+
+    def _ensure_thread(self):
+        # Must be called with the lock held.
+        if self._thread is not None:
+            return
+        self._poller = select.poll()
+        self._wakeup = os.pipe()
+        self._poller.register(self._wakeup[0], select.POLLIN)
+        self._thread = Thread(target=self._entry, name='reactor')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def add(self, aproc):
+        """Start handling the output and exit of *aproc*."""
+        with self._lock:
+            self._ensure_thread()
+            for stream in ('stdout', 'stderr'):
+                fd = getattr(aproc.proc, stream).fileno()
+                fcntl.fcntl(fd, fcntl.F_SETFL,
+                            fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                self._fds[fd] = (aproc, stream)
+                self._poller.register(fd, select.POLLIN)
+            if hasattr(os, 'pidfd_open'):
+                try:
+                    pidfd = os.pidfd_open(  # pylint: disable=no-member
+                        aproc.proc.pid)
+                except OSError:
+                    pass
+                else:
+                    aproc._pidfd = pidfd
+                    self._pidfds[pidfd] = aproc
+                    self._poller.register(pidfd, select.POLLIN)
+            self._procs.add(aproc)
+            os.write(self._wakeup[1], b'x')
+
+    def _read(self, fd):
+        # Must be called with the lock held.  Returns False on EOF.
+        aproc, stream = self._fds[fd]
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except (IOError, OSError) as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    return True
+                chunk = b''
+            if not chunk:
+                self._close(fd)
+                return False
+            aproc._feed(stream, chunk)
+
+    def _close(self, fd):
+        # Must be called with the lock held.
+        self._poller.unregister(fd)
+        del self._fds[fd]
+
+    def _entry(self):
         while True:
-            if proc is None:
-                # create and start process
-                proc = Popen(self.cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
-                             shell=self.use_sh)
+            with self._lock:
+                timeout = None
+                if any(aproc._pidfd is None for aproc in self._procs):
+                    timeout = self.tick
+                deadlines = [aproc._deadline for aproc in self._procs
+                             if aproc._deadline is not None]
+                if deadlines:
+                    wait = max(0, min(deadlines) - time.time())
+                    timeout = wait if timeout is None else min(timeout, wait)
+                if timeout is not None:
+                    timeout *= 1000
+            try:
+                ready = self._poller.poll(timeout)
+            except (IOError, OSError) as err:  # pragma: no cover
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            finished = []
+            with self._lock:
+                for fd, _ in ready:
+                    if fd == self._wakeup[0]:
+                        os.read(fd, 4096)
+                    elif fd in self._fds:
+                        self._read(fd)
+                    elif fd in self._pidfds:
+                        self._poller.unregister(fd)
+                        del self._pidfds[fd]
+                now = time.time()
+                for aproc in self._procs:
+                    if aproc._deadline is not None and now >= aproc._deadline:
+                        self._timeout(aproc, now)
+                for aproc in list(self._procs):
+                    if aproc._pidfd is not None and \
+                       aproc._pidfd in self._pidfds:
+                        continue
+                    if aproc.proc.poll() is None:
+                        continue
+                    # collect the remaining output; don't wait for EOF since
+                    # children of the process might still hold the pipes
+                    for fd, (other, _) in list(self._fds.items()):
+                        if other is aproc and self._read(fd):
+                            self._close(fd)
+                    self._procs.discard(aproc)
+                    finished.append(aproc)
+            for aproc in finished:
+                aproc._finish()
+
+    def _timeout(self, aproc, now):
+        # Must be called with the lock held.
+        if not aproc.timed_out:
+            aproc.timed_out = True
+            aproc._deadline = now + self.kill_grace
+            sig = signal.SIGTERM
+        else:
+            aproc._deadline = None
+            sig = signal.SIGKILL
+        aproc.log.warning('command timed out, sending signal %d: %s' %
+                          (sig, aproc.cmd))
+        try:
+            os.killpg(aproc.proc.pid, sig)
+        except OSError:
+            pass
+
 
-                # create poller
-                poller = Poller()
+reactor = ProcessReactor()
 
-                # register pipes to polling
-                poller.register(proc.stdout, POLLIN)
-                poller.register(proc.stderr, POLLIN)
 
-            poll_output()
+class SpawnedProcess(object):
+    """A child process started by ``posix_spawn`` without an intermediate
+    shell, with just the parts of the `Popen` interface that `AsyncProcess`
+    needs.
+    """
+
+    def __init__(self, argv):
+        self.returncode = None
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            # pylint: disable=no-member
+            self.pid = os.posix_spawnp(argv[0], argv, os.environ,
+                                       setsid=True, file_actions=[
+                (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+                (os.POSIX_SPAWN_DUP2, out_w, 1),
+                (os.POSIX_SPAWN_DUP2, err_w, 2),
+            ])
+        except Exception:
+            os.close(out_r)
+            os.close(err_r)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        self.stdout = os.fdopen(out_r, 'rb')
+        self.stderr = os.fdopen(err_r, 'rb')
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                if os.WIFSIGNALED(status):
+                    self.returncode = -os.WTERMSIG(status)
+                else:
+                    self.returncode = os.WEXITSTATUS(status)
+        return self.returncode
+
+
+class OutputBuffer(object):
+    """A thread-safe buffer collecting raw output from child processes.
+
+    If *size* is given, only (about) the last *size* bytes are kept; the
+    partial first line that remains after discarding old data is dropped.
+    Data is decoded only when it is read: iterating over the buffer yields
+    the lines of output as strings.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self._data = bytearray()
+        self._truncated = False
+        self._lock = threading.Lock()
+
+    def append(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        with self._lock:
+            self._data += data
+            # discard old data only every once in a while
+            if self.size and len(self._data) > 2 * self.size:
+                del self._data[:-self.size]
+                self._truncated = True
+
+    def getvalue(self):
+        """Return the buffered output as bytes."""
+        with self._lock:
+            data = bytes(self._data)
+            truncated = self._truncated
+        if self.size and len(data) > self.size:
+            data = data[-self.size:]
+            truncated = True
+        if truncated:
+            data = data[data.find(b'\n') + 1:]
+        return data
+
+    def lines(self):
+        """Return the buffered output as a list of decoded lines."""
+        data = self.getvalue().translate(None, b'\r')
+        return data.decode('utf-8', 'replace').splitlines(True)
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class AsyncProcess(object):
+    """A child process whose output is collected in the background.
+
+    *cmd* is either a string, to be run by the shell if *sh* is true, or an
+    argument list.  Argument lists are spawned directly using ``posix_spawn``
+    if possible.
+
+    On POSIX systems, all processes are handled by the single `reactor`
+    thread; elsewhere, every process gets its own thread.  The process is
+    started in its own session and process group, which is terminated if the
+    process is still running after *timeout* seconds (POSIX only).
+
+    Output is collected into *stdout* and *stderr*, which are `OutputBuffer`
+    instances keeping the last `output_size` bytes unless given (they can
+    also be the same buffer).  Lines written to stderr are logged as
+    warnings.
+    """
 
-            if proc.poll() is not None:  # proc finished
-                break
+    #: Size of the output buffers created by default.
+    output_size = 1024 * 1024
 
-        # poll once after the process ended to collect all the missing output
-        poll_output()
+    def __init__(self, status, log, cmd, sh=True, stdout=None, stderr=None,
+                 timeout=None):
+        self.status = status
+        self.log = log
+        self.cmd = cmd
+        self.use_sh = sh
+        self.timeout = timeout
 
-        # check return code
-        self.retcode = proc.returncode
+        self.done = False
+        self.retcode = None
+        self.timed_out = False
+        if stdout is None:
+            stdout = OutputBuffer(self.output_size)
+        if stderr is None:
+            stderr = OutputBuffer(self.output_size)
+        self.stdout = stdout
+        self.stderr = stderr
+        # incomplete last line written to stderr, not logged yet
+        self._errline = b''
+
+        self.proc = None
+        self._pidfd = None
+        self._deadline = None
+        self._finished = threading.Event()
+
+    def start(self):
+        self.log.debug('call [sh:%s]: %s' % (self.use_sh, self.cmd))
+        if self.timeout:
+            self._deadline = time.time() + self.timeout
+        try:
+            if not self.use_sh and hasattr(os, 'posix_spawnp'):
+                self.proc = SpawnedProcess(self.cmd)
+            else:
+                kwds = {}
+                if os.name != 'nt':
+                    if sys.version_info >= (3, 2):
+                        kwds['start_new_session'] = True
+                    else:  # pragma: no cover
+                        kwds['preexec_fn'] = os.setsid
+                self.proc = Popen(self.cmd, stdin=PIPE, stdout=PIPE,
+                                  stderr=PIPE, shell=self.use_sh, **kwds)
+                self.proc.stdin.close()
+        except OSError as err:
+            # like the shell does for a command that cannot be run
+            self._feed('stderr', ('%s\n' % err).encode())
+            self._finish(127)
+            return
+        if hasattr(select, 'poll'):
+            reactor.add(self)
+        else:  # pragma: no cover
+            thread = Thread(target=self._communicate)
+            thread.setDaemon(True)
+            thread.start()
+
+    def join(self, timeout=None):
+        self._finished.wait(timeout)
+
+    def _communicate(self):
+        out, err = self.proc.communicate()
+        self._feed('stdout', out)
+        self._feed('stderr', err)
+        self._finish()
+
+    def _feed(self, stream, data):
+        if not data:
+            return
+        if stream == 'stdout':
+            self.stdout.append(data)
+            if self.log.isEnabledFor(DEBUG):
+                self.log.debug(data.decode('utf-8', 'replace').rstrip())
+        else:
+            self.stderr.append(data)
+            lines = (self._errline + data).split(b'\n')
+            self._errline = lines.pop()[-self.output_size:]
+            for line in lines:
+                self._log_error(line)
+
+    def _log_error(self, line):
+        line = line.decode('utf-8', 'replace').rstrip()
+        if line:
+            self.log.warning(line)
+
+    def _finish(self, retcode=None):
+        if self.proc is not None:
+            for stream in ('stdout', 'stderr'):
+                getattr(self.proc, stream).close()
+            retcode = self.proc.returncode
+        if self._pidfd is not None:
+            os.close(self._pidfd)
+        if self._errline:
+            self._log_error(self._errline)
+            self._errline = b''
+        if self.timed_out:
+            self._feed('stderr', ('*** timed out after %s seconds\n' %
+                                  self.timeout).encode())
+        self.retcode = retcode
         self.done = True
+        self._finished.set()
 
 
 nontext_re = re.compile(r'[^\n\t\x20-\x7e]')
 
 
-def extract_loglines(filename, n=500):
-    def extract(filename):
-        lines = collections.deque(maxlen=n)
+def read_tail(filename, n, blocksize=65536, end=None, with_start=False):
+    """Return the last *n* lines of a file as bytes.
+
+    The file is read backwards from the end in blocks of *blocksize* bytes,
+    until enough lines have been found.  *filename* can also be a file
+    object opened in binary mode; then *end* can be given to read the lines
+    before that offset instead of the end of the file.
+
+    If *with_start* is true, return a tuple of the lines and the offset at
+    which they start; it is nonzero if there is more data before them.
+    """
+    if n <= 0 and not with_start:
+        return b''
+    if not hasattr(filename, 'read'):
         with open(filename, 'rb') as fp:
-            for line in fp:
-                line = line.translate(None, b'\r').decode('utf-8', 'replace')
-                lines.append(nontext_re.sub('', line))
-        return ''.join(lines)
+            return read_tail(fp, n, blocksize, with_start=with_start)
+    fp = filename
+    if end is None:
+        fp.seek(0, os.SEEK_END)
+        end = fp.tell()
+    if n <= 0:
+        return b'', end
+    pos = end
+    data = b''
+    # we need n newlines before the (possibly unterminated) last line
+    while pos > 0 and data.count(b'\n', 0, len(data) - 1) < n:
+        size = min(blocksize, pos)
+        pos -= size
+        fp.seek(pos)
+        data = fp.read(size) + data
+    lines = data.split(b'\n')
+    last = lines.pop()
+    lines = [line + b'\n' for line in lines]
+    if last:
+        lines.append(last)
+    if pos > 0:
+        # the first line is (possibly) incomplete
+        del lines[0]
+    data = b''.join(lines[-n:])
+    return (data, end - len(data)) if with_start else data
+
+
+def decode_loglines(data):
+    """Decode log file contents, removing non-text characters."""
+    data = data.translate(None, b'\r').decode('utf-8', 'replace')
+    return nontext_re.sub('', data)
+
+
+def extract_loglines(filename, n=500):
+    """Return a dictionary with the last *n* lines of the given log file.
+
+    Rotated log files are not included; see `marche.logs` for those.
+    """
     if not path.exists(filename):
         return {}
     filename = path.realpath(filename)
-    result = {filename: extract(filename)}
-    # also add rotated logs
-    i = 1
-    while path.exists(filename + '.%d' % i):
-        result[filename + '.%d' % i] = extract(filename + '.%d' % i)
-        i += 1
-    return result
+    return {filename: decode_loglines(read_tail(filename, n))}
+
+
+def tail_truncated(filename, n=500):
+    """Return true if the log file has more than the last *n* lines, i.e.
+    the contents returned by `extract_loglines` are incomplete.
+    """
+    return read_tail(filename, n, with_start=True)[1] > 0
 
 
 def normalize_addr(addr, defport):
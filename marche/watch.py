@@ -0,0 +1,251 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Event sources for process exits and file changes.
+
+A single daemon-wide :class:`Watcher` thread waits for processes to exit,
+using a pidfd (Linux 5.3+ and Python 3.9+), and for files to change, using
+inotify.  Where these facilities are not available, nothing is watched and
+callers have to fall back to polling.
+"""
+
+import os
+import errno
+import select
+import struct
+import threading
+from os import path
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_rm_watch = _libc.inotify_rm_watch
+except Exception:  # pragma: no cover
+    _libc = None
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Directories are watched for everything that can change one of their files.
+DIR_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE
+
+_event_header = struct.Struct('iIII')
+
+
+class WatchHandle(object):
+    """Identifies a single watch, to remove it again."""
+
+    def __init__(self, callback, fd=None, wd=None, name=None):
+        self.callback = callback
+        self.fd = fd
+        self.wd = wd
+        self.name = name
+
+
+class Watcher(object):
+    """The daemon-wide watcher of processes and files.
+
+    Callbacks are called from the watcher thread and should return quickly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._poller = None
+        self._wakeup = None
+        self._inotify = None
+        self._pidfds = {}  # fd -> handle
+        self._dirs = {}    # directory -> wd
+        self._wds = {}     # wd -> set of handles
+
+    @property
+    def can_watch_pids(self):
+        return hasattr(os, 'pidfd_open') and hasattr(select, 'poll')
+
+    @property
+    def can_watch_files(self):
+        return _libc is not None and hasattr(select, 'poll')
+
+    def _ensure_thread(self):
+        # Must be called with the lock held.
+        if self._thread is not None:
+            return
+        self._poller = select.poll()
+        self._wakeup = os.pipe()
+        self._poller.register(self._wakeup[0], select.POLLIN)
+        self._thread = threading.Thread(target=self._entry, name='watcher')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _wake(self):
+        # Makes the thread pick up newly registered fds.
+        os.write(self._wakeup[1], b'x')
+
+    def watch_pid(self, pid, callback):
+        """Call *callback* once the process with *pid* has exited.
+
+        Returns a handle for `unwatch`, or None if the process cannot be
+        watched (or does not exist anymore).
+        """
+        if not self.can_watch_pids:
+            return None
+        try:
+            fd = os.pidfd_open(pid)  # pylint: disable=no-member
+        except OSError:
+            return None
+        handle = WatchHandle(callback, fd=fd)
+        with self._lock:
+            self._ensure_thread()
+            self._pidfds[fd] = handle
+            self._poller.register(fd, select.POLLIN)
+            self._wake()
+        return handle
+
+    def watch_file(self, filename, callback):
+        """Call *callback* whenever the file *filename* is created, written,
+        renamed or deleted.
+
+        Returns a handle for `unwatch`, or None if the file cannot be watched.
+        """
+        if not self.can_watch_files:
+            return None
+        dirname, name = path.split(path.abspath(filename))
+        with self._lock:
+            self._ensure_thread()
+            if self._inotify is None:
+                fd = _inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+                if fd < 0:
+                    return None
+                self._inotify = fd
+                self._poller.register(fd, select.POLLIN)
+                self._wake()
+            wd = self._dirs.get(dirname)
+            if wd is None:
+                wd = _inotify_add_watch(self._inotify,
+                                        dirname.encode('utf-8'), DIR_MASK)
+                if wd < 0:
+                    return None
+                self._dirs[dirname] = wd
+            handle = WatchHandle(callback, wd=wd, name=name.encode('utf-8'))
+            self._wds.setdefault(wd, set()).add(handle)
+        return handle
+
+    def unwatch(self, handle):
+        """Remove the watch identified by *handle*."""
+        with self._lock:
+            if handle.fd is not None:
+                # the fd number may already belong to another watch, if this
+                # one has fired and its fd has been closed and reused
+                if self._pidfds.get(handle.fd) is handle:
+                    del self._pidfds[handle.fd]
+                    self._poller.unregister(handle.fd)
+                    os.close(handle.fd)
+            elif handle.wd is not None:
+                handles = self._wds.get(handle.wd, set())
+                handles.discard(handle)
+                if not handles and handle.wd in self._wds:
+                    del self._wds[handle.wd]
+                    for dirname, wd in list(self._dirs.items()):
+                        if wd == handle.wd:
+                            del self._dirs[dirname]
+                    _inotify_rm_watch(self._inotify, handle.wd)
+
+    def _entry(self):
+        while True:
+            try:
+                ready = self._poller.poll()
+            except (IOError, OSError) as err:  # pragma: no cover
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            callbacks = []
+            with self._lock:
+                for fd, _ in ready:
+                    if fd == self._wakeup[0]:
+                        os.read(fd, 4096)
+                    elif fd == self._inotify:
+                        callbacks.extend(self._read_inotify())
+                    elif fd in self._pidfds:
+                        handle = self._pidfds.pop(fd)
+                        self._poller.unregister(fd)
+                        os.close(fd)
+                        callbacks.append(handle.callback)
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:  # pragma: no cover
+                    # callbacks are internal and must handle their errors
+                    pass
+
+    def _read_inotify(self):
+        # Must be called with the lock held.
+        try:
+            data = os.read(self._inotify, 65536)
+        except (IOError, OSError) as err:  # pragma: no cover
+            if err.errno == errno.EAGAIN:
+                return []
+            raise
+        callbacks = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events got lost: notify everyone
+                for handles in self._wds.values():
+                    callbacks.extend(h.callback for h in handles)
+                continue
+            if mask & IN_IGNORED:
+                # directory went away
+                self._wds.pop(wd, None)
+                for dirname, dwd in list(self._dirs.items()):
+                    if dwd == wd:
+                        del self._dirs[dirname]
+                continue
+            for handle in self._wds.get(wd, ()):
+                if handle.name == name:
+                    callbacks.append(handle.callback)
+        # notify each callback only once per batch of events
+        unique = []
+        for callback in callbacks:
+            if callback not in unique:
+                unique.append(callback)
+        return unique
+
+
+#: The watcher instance used by all jobs.
+watcher = Watcher()
@@ -0,0 +1,98 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the protocol message codecs."""
+
+import json
+
+from pytest import raises
+
+from marche.jobs import RUNNING
+from marche.codec import CODECS, JSON, negotiate, write_uint
+from marche.protocol import Command, Event, AuthenticateCommand, \
+    ScanNetworkCommand, SearchLogsCommand, SendConfFileCommand, AuthEvent, \
+    ServiceListEvent, StatusEvent, LogfileEvent, ErrorEvent
+
+binary = CODECS['binary']
+
+MESSAGES = [
+    (Command, AuthenticateCommand('user', 'passwd')),
+    (Command, AuthenticateCommand('user', 'passwd', ['binary', 'json'])),
+    (Command, ScanNetworkCommand()),
+    (Command, SearchLogsCommand('svc', 'inst', 'regex', 1.5, None)),
+    (Command, SendConfFileCommand('svc', '', 'file', u'\xe4\n' * 1000)),
+    (Event, AuthEvent(True)),
+    (Event, AuthEvent(False, 'binary')),
+    (Event, ServiceListEvent({'svc': {
+        'jobtype': 'init', 'permissions': [10, 20],
+        'instances': {'': {'desc': 'desc', 'state': RUNNING,
+                           'ext_status': None}}}})),
+    (Event, StatusEvent('svc', 'inst', RUNNING, u'caf\xe9')),
+    (Event, ErrorEvent('svc', 'inst', -2 ** 40, 'error')),
+    (Event, LogfileEvent('svc', 'inst', {'file': 'line\n' * 1000},
+                         {'file': '12:3456'})),
+]
+
+
+def test_roundtrip():
+    for codec in (JSON, binary):
+        for base, msg in MESSAGES:
+            assert codec.decode(codec.encode(msg), base) == msg
+        msg = StatusEvent('svc', 'inst', RUNNING, '')
+        msg.seq = 12345
+        assert codec.decode(codec.encode(msg), Event).seq == 12345
+
+
+def test_binary():
+    # raw strings, no escaping
+    msg = LogfileEvent('svc', '', {'f': u'\xe4"\n' * 1000})
+    assert len(binary.encode(msg)) < 4100
+    # bytes values
+    msg = LogfileEvent('svc', '', {'f': b'\x00\xff'})
+    assert binary.decode(binary.encode(msg), Event) == msg
+    with raises(TypeError):
+        binary.encode(LogfileEvent('svc', '', object()))
+
+    # bulk replies embed their nested fields as JSON
+    msg = MESSAGES[7][1]
+    assert isinstance(msg, ServiceListEvent)
+    assert json.dumps(msg.services).encode() in binary.encode(msg)
+
+    # unknown message types are ignored
+    data = bytearray()
+    write_uint(data, 1000)
+    write_uint(data, 0)
+    assert binary.decode(bytes(data), Event) is None
+    # fields added by newer versions are ignored
+    data = bytearray(binary.encode(StatusEvent('svc', '', RUNNING, '')))
+    data[2] += 1
+    data.append(0)
+    assert binary.decode(bytes(data), Event) == \
+        StatusEvent('svc', '', RUNNING, '')
+
+
+def test_negotiate():
+    assert negotiate(['foo', 'binary', 'json']) is binary
+    assert negotiate(['foo']) is JSON
+    assert negotiate(None) is JSON
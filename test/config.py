@@ -38,6 +38,7 @@ def test_defaults():
     assert config.piddir == '/var/run'
     assert config.logdir == '/var/log'
     assert config.unauth_level == DISPLAY
+    assert config.pollworkers == 0
 
 
 def test_config():
@@ -48,6 +49,7 @@ def test_config():
     assert config.piddir == '/tmp/pid'
     assert config.logdir == '/tmp/log'
     assert config.unauth_level == ADMIN
+    assert config.pollworkers == 12
 
     assert config.job_config == {'myjob': {'type': 'init'}}
     assert config.auth_config == {'simple': {'user': 'simple',
@@ -31,12 +31,13 @@ import logging
 from mock import patch
 from pytest import fixture, raises
 
-from marche.jobs import Fault, Busy
+from marche.jobs import Fault, Busy, Unauthorized
 from marche.jobs.base import DEAD, RUNNING
 from marche.config import Config
 from marche.handler import JobHandler
 from marche.protocol import ServiceListEvent, ControlOutputEvent, \
-    ConffileEvent, LogfileEvent, StatusEvent, ErrorEvent
+    ConffileEvent, LogfileEvent, LogCatalogueEvent, StatusEvent, ErrorEvent, \
+    AllStatusEvent, EventsEvent
 from marche.permission import ClientInfo, DISPLAY, CONTROL, ADMIN
 
 from test.utils import LogHandler, MockIface, MockJob, wait
@@ -84,6 +85,37 @@ def test_event(handler):
     assert handler.test_events[-1] == ev
 
 
+def test_event_journal(handler):
+    client = ClientInfo(CONTROL)
+    start = handler.request_events_since(client, 0).last
+    for state in (RUNNING, DEAD):
+        handler.emit_event(StatusEvent('svc2', 'inst1', state, ''))
+    # not journaled
+    handler.emit_event(LogfileEvent('svc2', 'inst1', {}))
+    assert handler.test_events[-1].seq == start + 3
+
+    ev = handler.request_events_since(client, start)
+    assert isinstance(ev, EventsEvent)
+    assert not ev.resync
+    assert ev.uid == handler.uid
+    assert ev.last == start + 3
+    assert [(e['seq'], e['state']) for e in ev.events] == \
+        [(start + 1, RUNNING), (start + 2, DEAD)]
+    assert handler.request_events_since(client, start + 2).events == []
+    # events are filtered for the client
+    assert handler.request_events_since(ClientInfo(DISPLAY), start).events \
+        == []
+    # sequence number from a previous run
+    assert handler.request_events_since(client, start + 10).resync
+
+    # the journal is limited
+    handler.journal_size = 2
+    for _ in range(3):
+        handler.emit_event(StatusEvent('svc2', 'inst1', RUNNING, ''))
+    assert handler.request_events_since(client, start + 3).resync
+    assert len(handler.request_events_since(client, start + 4).events) == 2
+
+
 def test_joblist(handler):
     assert list(handler.jobs) == ['mytest']
     job = handler.jobs['mytest']
@@ -130,6 +162,24 @@ def test_service_list(handler):
     assert ev.services == {}
 
 
+def test_all_status(handler):
+    # services are not queried, only taken from the poller cache
+    ev = handler.request_all_status(ClientInfo(CONTROL))
+    assert isinstance(ev, AllStatusEvent)
+    assert ev.services == {}
+    job = handler.jobs['mytest']
+    for key in job.get_services():
+        job.poller._probe(key)
+    ev = handler.request_all_status(ClientInfo(CONTROL))
+    assert ev.services == {
+        'svc1': {'': (DEAD, 'ext:')},
+        'svc2': {'inst1': (RUNNING, 'ext:inst1')},
+        'svc3': {'': (RUNNING, 'ext:'), 'inst2': (RUNNING, 'ext:inst2')},
+    }
+    ev = handler.request_all_status(ClientInfo(DISPLAY))
+    assert ev.services == {}
+
+
 def test_requests(handler):
     client = ClientInfo(CONTROL)
 
@@ -151,6 +201,43 @@ def test_requests(handler):
     assert isinstance(ev, LogfileEvent)
     assert ev.files == {'log:inst1': 'svc2'}
 
+    ev = handler.request_logs_since(client, 'svc2', 'inst1', {})
+    assert isinstance(ev, LogfileEvent)
+    assert ev.files == {'log:inst1': 'svc2'}
+    assert ev.cursors == {}
+
+    ev = handler.follow_logfiles(client, 'svc2', 'inst1')
+    assert isinstance(ev, LogfileEvent)
+    assert ev.files == {'log:inst1': 'svc2'}
+    handler.follow_logfiles(client, 'svc2', 'inst1')
+    assert handler._followers[('svc2', 'inst1')][1] == {client: 2}
+    # other clients cannot release the subscriptions
+    other = ClientInfo(CONTROL)
+    handler.unfollow_logfiles(other, 'svc2', 'inst1')
+    assert handler._followers[('svc2', 'inst1')][1] == {client: 2}
+    assert raises(Unauthorized, handler.unfollow_logfiles,
+                  ClientInfo(DISPLAY), 'svc2', 'inst1')
+    handler.unfollow_logfiles(client, 'svc2', 'inst1')
+    handler.unfollow_logfiles(client, 'svc2', 'inst1')
+    handler.unfollow_logfiles(client, 'svc2', 'inst1')
+    assert not handler._followers
+
+    ev = handler.search_logfiles(client, 'svc2', 'inst1', 'x')
+    assert isinstance(ev, LogfileEvent)
+    assert ev.files == {}
+
+    ev = handler.request_log_range(client, 'svc2', 'inst1', 0, 1)
+    assert isinstance(ev, LogfileEvent)
+    assert ev.files == {}
+
+    ev = handler.request_log_catalogue(client, 'svc2', 'inst1')
+    assert isinstance(ev, LogCatalogueEvent)
+    assert [entry['name'] for entry in ev.files] == ['log:inst1']
+
+    ev = handler.request_logfile(client, 'svc2', 'inst1', 'log:inst1')
+    assert isinstance(ev, LogfileEvent)
+    assert ev.files == {'log:inst1': 'svc2'}
+
     client = ClientInfo(ADMIN)
     ev = handler.request_conffiles(client, 'svc2', 'inst1')
     assert isinstance(ev, ConffileEvent)
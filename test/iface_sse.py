@@ -0,0 +1,194 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the Server-Sent Events interface."""
+
+import json
+import base64
+import socket
+import logging
+
+from pytest import yield_fixture, importorskip
+
+from marche.jobs import RUNNING
+from marche.config import Config
+from marche.protocol import StatusEvent, ServiceListEvent, LogfileEvent
+
+from test.utils import MockJobHandler, MockAuthHandler, LogHandler
+
+importorskip('asyncio')
+from marche.iface.sse import Interface  # noqa
+
+jobhandler = MockJobHandler()
+authhandler = MockAuthHandler()
+logger = logging.getLogger('testsse')
+logger.addHandler(LogHandler())
+
+
+@yield_fixture(scope='module')
+def sse_iface():
+    """Create a Marche SSE interface."""
+    config = Config()
+    config.iface_config['sse'] = {'host': '127.0.0.1', 'port': '0',
+                                  'keepalive': '0.1'}
+    iface = Interface(config, jobhandler, authhandler, logger)
+    iface.run()
+    yield iface
+    iface.shutdown()
+
+
+def request(iface, method='GET', path='/events', creds=b'test:test',
+            last_id=None):
+    port = iface.server.sockets[0].getsockname()[1]
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.settimeout(5)
+    headers = 'Host: localhost\r\n'
+    if creds:
+        headers += 'Authorization: Basic %s\r\n' % \
+            base64.b64encode(creds).decode()
+    if last_id:
+        headers += 'Last-Event-ID: %s\r\n' % last_id
+    sock.sendall(('%s %s HTTP/1.1\r\n%s\r\n' %
+                  (method, path, headers)).encode())
+    stream = sock.makefile('rb')
+    sock.close()
+    status = stream.readline().split()[1]
+    headers = {}
+    while True:
+        line = stream.readline().strip()
+        if not line:
+            break
+        key, value = line.decode().split(':', 1)
+        headers[key.lower()] = value.strip()
+    return int(status), headers, stream
+
+
+def next_event(stream, with_id=False):
+    event = {}
+    while True:
+        line = stream.readline()
+        assert line, 'connection closed'
+        line = line.decode().rstrip('\n')
+        if not line:
+            if not event:
+                continue  # after a comment
+            if with_id:
+                return event['event'], event.get('id'), \
+                    json.loads(event['data'])
+            return event['event'], json.loads(event['data'])
+        elif not line.startswith(':'):
+            key, value = line.split(': ', 1)
+            event[key] = value
+
+
+def test_errors(sse_iface):
+    assert request(sse_iface, path='/other')[0] == 404
+    status, headers, _ = request(sse_iface, method='POST')
+    assert status == 405
+    assert headers['allow'] == 'GET'
+    status, headers, _ = request(sse_iface, creds=None)
+    assert status == 401
+    assert 'www-authenticate' in headers
+    assert request(sse_iface, creds=b'test:wrong')[0] == 401
+
+
+def test_stream(sse_iface):
+    status, headers, stream = request(sse_iface)
+    try:
+        assert status == 200
+        assert headers['content-type'] == 'text/event-stream'
+        # initial snapshot
+        event, data = next_event(stream)
+        assert event == 'services'
+        assert set(data['services']['svc']['instances']) == \
+            set(['', 'inst'])
+
+        # keepalive comments are sent while idle
+        assert stream.readline() == b': keepalive\n'
+
+        sse_iface.emit_event(ServiceListEvent({'svc': {}}))
+        # not shown to clients
+        sse_iface.emit_event(LogfileEvent('svc', 'inst', {'file1': 'x\n'}))
+        sse_iface.emit_event(StatusEvent('svc', 'inst', RUNNING, ''))
+        # the service list is filtered by the job handler
+        assert next_event(stream) == ('services', {'type': 'services',
+                                                   'services': {}})
+        event, data = next_event(stream)
+        assert event == 'status'
+        assert data['state'] == RUNNING
+    finally:
+        stream.close()
+
+
+def test_replay(sse_iface):
+    # events carry the daemon's uid and sequence number
+    status, _, stream = request(sse_iface)
+    try:
+        next_event(stream)
+        event = StatusEvent('svc', 'inst', RUNNING, '')
+        event.seq = 4
+        sse_iface.emit_event(event)
+        assert next_event(stream, True)[1] == 'deadcafe:4'
+    finally:
+        stream.close()
+
+    # reconnecting with a known event ID only sends the missed events
+    status, _, stream = request(sse_iface, last_id='deadcafe:5')
+    try:
+        event, event_id, data = next_event(stream, True)
+        assert (event, event_id) == ('status', 'deadcafe:6')
+        assert data['state'] == RUNNING
+    finally:
+        stream.close()
+
+    # otherwise, the service list is sent again
+    for last_id in ('deadcafe:1', 'other:5', 'garbage'):
+        status, _, stream = request(sse_iface, last_id=last_id)
+        try:
+            event, event_id, _ = next_event(stream, True)
+            assert event == 'services'
+            assert event_id == 'deadcafe:4'
+        finally:
+            stream.close()
+
+
+def test_replay_overlap(sse_iface):
+    # an event emitted while the journal is read is sent only once
+    def request_events_since(client, since):
+        event = StatusEvent('svc', 'inst', RUNNING, '')
+        event.seq = 6
+        sse_iface.emit_event(event)
+        return MockJobHandler.request_events_since(jobhandler, client, since)
+
+    jobhandler.request_events_since = request_events_since
+    try:
+        status, _, stream = request(sse_iface, last_id='deadcafe:5')
+        assert next_event(stream, True)[1] == 'deadcafe:6'
+        event = StatusEvent('svc', 'inst', RUNNING, '')
+        event.seq = 7
+        sse_iface.emit_event(event)
+        assert next_event(stream, True)[1] == 'deadcafe:7'
+        stream.close()
+    finally:
+        del jobhandler.request_events_since
@@ -0,0 +1,238 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for the TCP interface."""
+
+import json
+import socket
+import struct
+import logging
+import threading
+
+from pytest import yield_fixture, importorskip
+
+from marche.jobs import DEAD, RUNNING
+from marche.config import Config
+from marche.protocol import PROTO_VERSION, Errors, Event, ConnectedEvent, \
+    AuthEvent, ErrorEvent, ServiceListEvent, StatusEvent, LogfileEvent, \
+    AuthenticateCommand, RequestServiceListCommand, \
+    RequestServiceStatusCommand, StopCommand, FollowLogsCommand, \
+    UnfollowLogsCommand, FoundHostEvent
+
+from marche.codec import JSON, CODECS
+
+from test.utils import MockJobHandler, MockAuthHandler, LogHandler, wait
+
+importorskip('asyncio')
+from marche.iface.tcp import Interface  # noqa
+
+jobhandler = MockJobHandler()
+authhandler = MockAuthHandler()
+logger = logging.getLogger('testtcp')
+logger.addHandler(LogHandler())
+
+
+@yield_fixture(scope='module')
+def tcp_iface():
+    """Create a Marche TCP interface."""
+    config = Config()
+    config.iface_config['tcp'] = {'host': '127.0.0.1', 'port': '0'}
+    iface = Interface(config, jobhandler, authhandler, logger)
+    iface.run()
+    yield iface
+    iface.shutdown()
+
+
+class Client(object):
+    def __init__(self, iface):
+        port = iface.server.sockets[0].getsockname()[1]
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.settimeout(5)
+        self.codec = JSON
+
+    def send(self, cmd):
+        data = self.codec.encode(cmd)
+        self.sock.sendall(struct.pack('>I', len(data)) + data)
+
+    def _read(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            assert chunk, 'connection closed'
+            data += chunk
+        return data
+
+    def recv(self):
+        length = struct.unpack('>I', self._read(4))[0]
+        return self.codec.decode(self._read(length), Event)
+
+    def close(self):
+        self.sock.close()
+
+
+@yield_fixture()
+def client(tcp_iface):
+    """Create an authenticated client."""
+    client = Client(tcp_iface)
+    assert isinstance(client.recv(), ConnectedEvent)
+    client.send(AuthenticateCommand('test', 'test',
+                                    proto_version=PROTO_VERSION))
+    assert client.recv() == AuthEvent(True)
+    yield client
+    client.close()
+
+
+def test_authentication(tcp_iface):
+    client = Client(tcp_iface)
+    try:
+        event = client.recv()
+        assert event.proto_version == PROTO_VERSION
+        client.send(RequestServiceListCommand())
+        event = client.recv()
+        assert isinstance(event, ErrorEvent)
+        assert event.code == Errors.UNAUTH
+        client.send(AuthenticateCommand('wrong', 'creds'))
+        assert client.recv() == AuthEvent(False)
+        client.send(AuthenticateCommand('guest', 'guest'))
+        assert client.recv() == AuthEvent(True)
+        client.send(RequestServiceListCommand())
+        assert isinstance(client.recv(), ServiceListEvent)
+    finally:
+        client.close()
+
+
+def test_codec_negotiation(tcp_iface):
+    client = Client(tcp_iface)
+    try:
+        client.recv()
+        client.send(AuthenticateCommand('test', 'test', ['foo', 'binary']))
+        assert client.recv() == AuthEvent(True, 'binary')
+        client.codec = CODECS['binary']
+        client.send(RequestServiceStatusCommand('svc', 'inst'))
+        assert client.recv() == StatusEvent('svc', 'inst', DEAD, 'ext_status')
+        tcp_iface.emit_event(StatusEvent('svc', 'inst', RUNNING, ''))
+        assert client.recv() == StatusEvent('svc', 'inst', RUNNING, '')
+    finally:
+        client.close()
+
+
+def test_commands(client):
+    client.send(RequestServiceStatusCommand('svc', 'inst'))
+    assert client.recv() == StatusEvent('svc', 'inst', DEAD, 'ext_status')
+    client.send(StopCommand('svc', 'inst'))
+    assert client.recv().code == Errors.BUSY
+    client.send(StopCommand('svc', ''))
+    assert client.recv().code == Errors.UNAUTH
+    # invalid frames are reported, but keep the connection open
+    data = b'{"type": "status?"}'
+    client.sock.sendall(struct.pack('>I', len(data)) + data)
+    assert client.recv().code == Errors.EXCEPTION
+    client.send(RequestServiceStatusCommand('svc', ''))
+    assert client.recv().service == 'svc'
+
+
+def test_events(tcp_iface, client):
+    tcp_iface.emit_event(StatusEvent('svc', 'inst', RUNNING, ''))
+    assert client.recv() == StatusEvent('svc', 'inst', RUNNING, '')
+    # service lists are filtered for the client
+    tcp_iface.emit_event(ServiceListEvent({'svc': {}}))
+    assert client.recv() == ServiceListEvent({})
+
+    # new log data only goes to clients following the logfiles
+    tcp_iface.emit_event(LogfileEvent('svc', 'inst', {'file1': 'x\n'}))
+    client.send(FollowLogsCommand('svc', 'inst'))
+    assert client.recv().cursors == {'file1': '1:6'}
+    assert jobhandler.test_following == [('svc', 'inst')]
+    tcp_iface.emit_event(LogfileEvent('svc', 'inst', {'file1': 'y\n'}))
+    assert client.recv().files == {'file1': 'y\n'}
+    client.send(UnfollowLogsCommand('svc', 'inst'))
+    wait(500, lambda: not jobhandler.test_following)
+
+    # followed logfiles are released on disconnect
+    client.send(FollowLogsCommand('svc', 'inst'))
+    client.recv()
+    client.close()
+    wait(500, lambda: not jobhandler.test_following)
+
+
+def test_old_clients(tcp_iface, client):
+    old = Client(tcp_iface)
+    try:
+        old.recv()
+        old.send(AuthenticateCommand('test', 'test'))
+        old.recv()
+        # fields added in version 3 are only sent to clients that know them
+        event = LogfileEvent('svc', 'inst', {'file1': 'x\n'}, {'file1': '1:2'})
+        event.seq = 42
+        client.send(FollowLogsCommand('svc', 'inst'))
+        client.recv()
+        old.send(FollowLogsCommand('svc', 'inst'))
+        old.recv()
+        tcp_iface.emit_event(event)
+        assert client.recv() == event
+        data = old._read(struct.unpack('>I', old._read(4))[0])
+        assert json.loads(data.decode()) == {
+            'type': 'logfiles', 'service': 'svc', 'instance': 'inst',
+            'files': {'file1': 'x\n'}}
+    finally:
+        old.close()
+
+
+def test_many_clients(tcp_iface):
+    nthreads = threading.active_count()
+    clients = [Client(tcp_iface) for _ in range(200)]
+    try:
+        for client in clients:
+            client.send(AuthenticateCommand('test', 'test'))
+        for client in clients:
+            assert isinstance(client.recv(), ConnectedEvent)
+            assert client.recv() == AuthEvent(True)
+        tcp_iface.emit_event(FoundHostEvent('host', PROTO_VERSION))
+        for client in clients:
+            assert client.recv() == FoundHostEvent('host', PROTO_VERSION)
+        # no thread per connection (only the worker threads)
+        assert threading.active_count() <= nthreads + 8
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_shutdown():
+    config = Config()
+    config.iface_config['tcp'] = {'host': '127.0.0.1', 'port': '0'}
+    iface = Interface(config, jobhandler, authhandler, logger)
+    iface.run()
+    client = Client(iface)
+    try:
+        assert isinstance(client.recv(), ConnectedEvent)
+        client.send(AuthenticateCommand('test', 'test'))
+        assert client.recv() == AuthEvent(True)
+        client.send(FollowLogsCommand('svc', 'inst'))
+        client.recv()
+        # open connections run their cleanup on shutdown
+        iface.shutdown()
+        assert not jobhandler.test_following
+        assert iface._loop.is_closed()
+    finally:
+        client.close()
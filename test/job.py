@@ -24,14 +24,21 @@
 
 """Basic test for jobs and polling."""
 
+import sys
+import time
 import logging
+import threading
+import subprocess
 
 from mock import patch
-from pytest import raises
+from pytest import raises, mark
 
-from marche.jobs import Fault, Busy, DEAD, RUNNING, STARTING, STOPPING
+from marche.jobs import Fault, Busy, DEAD, RUNNING, WARNING, STARTING, \
+    STOPPING
 from marche.jobs.base import Job as BaseJob
+from marche.polling import Scheduler
 from marche.protocol import StatusEvent
+from marche.watch import watcher
 from marche.permission import ClientInfo, ADMIN, CONTROL, DISPLAY
 
 from test.utils import wait, LogHandler, MockAsyncProcess
@@ -50,6 +57,9 @@ def test_job_base():
     testhandler.assert_error(EmptyJob, 'test', 'test',
                              {'pollinterval': 'nada'}, logger,
                              lambda event: None)
+    testhandler.assert_error(EmptyJob, 'test', 'test',
+                             {'pollconcurrency': 'nada'}, logger,
+                             lambda event: None)
     testhandler.assert_error(EmptyJob, 'test', 'test',
                              {'permissions': 'nada'}, logger,
                              lambda event: None)
@@ -69,6 +79,8 @@ def test_job_base():
     # Check default implementations
     assert job.service_output('foo', 'bar') == []
     assert job.service_logs('foo', 'bar') == {}
+    assert job.service_log_catalogue('foo', 'bar') == []
+    assert raises(Fault, job.service_logfile, 'foo', 'bar', '/etc/passwd')
     assert job.receive_config('foo', 'bar') == {}
     assert job.service_description('foo', 'bar') == ''
     assert raises(Fault, job.send_config, 'foo', 'bar', '', '')
@@ -87,6 +99,9 @@ def test_job_base():
 def test_job_helpers():
     job = EmptyJob('test', 'test', {'pollinterval': '0'},
                    logger, lambda event: None)
+    assert job._argv('cmd "with arg"', 'action', '') == \
+        ['cmd', 'with arg', 'action']
+
     out = []
     with patch('marche.jobs.base.AsyncProcess', MockAsyncProcess):
 
@@ -94,9 +109,11 @@ def test_job_helpers():
         proc = job._async_call(0, 'cmd', output=out)
         proc.join()
         assert out == ['$ cmd\n', 'output\n', 'error\n']
+        proc = job._async_call(0, ['cmd', 'arg'])
+        assert not proc.use_sh
 
         proc = job._sync_call(0, 'cmd')
-        assert proc.stdout == ['output\n']
+        assert list(proc.stdout) == ['output\n']
 
         # Simulate starting the process.
         job._async_start('sub', 'cmd')
@@ -105,6 +122,8 @@ def test_job_helpers():
 
         assert job._async_status('sub', 'cmd') == RUNNING
         assert job._async_status('sub', 'fail') == DEAD
+        assert job._async_status_ext('sub', 'hang') == \
+            (WARNING, 'status check timed out')
 
         # Simulate the start process being still busy.
         job._processes['sub'].done = False
@@ -172,4 +191,216 @@ def test_job_poller():
     job.poll_now()
     assert raises(RuntimeError, job.polled_service_status, 'svc', 'inst')
 
+    # a failing probe removes the cached status
+    job.test_raise = False
+    job.poller._probe(('svc', 'inst'))
+    assert job.poller.cached('svc', 'inst') == (RUNNING, 'ext')
+    job.test_raise = True
+    job.poller._probe(('svc', 'inst'))
+    assert job.poller.cached('svc', 'inst') is None
+
+    job.shutdown()
+
+
+def test_poll_scheduler():
+    events = []
+
+    private = Scheduler(4)
+    jobs = [Job('test', 'test%d' % i, {'pollinterval': '0.01'}, logger,
+                events.append) for i in range(20)]
+    for job in jobs:
+        job.poller.scheduler = private
+        job.init()
+
+    # All jobs are polled, but by a bounded number of threads.
+    wait(100, lambda: len(events) >= len(jobs))
+    assert len(private._workers) <= 4
+
+    for job in jobs:
+        job.shutdown()
+    assert all(not job.poller._tokens for job in jobs)
+
+    # No polls happen anymore after shutdown.
+    del events[:]
+    jobs[0].test_state = RUNNING
+    jobs[0].poll_now()
+    time.sleep(0.05)
+    assert not events
+
+
+class SlowJob(BaseJob):
+    def get_services(self):
+        return [('svc', 'inst%d' % i) for i in range(8)]
+
+    def service_status(self, service, instance):
+        time.sleep(0.1)
+        return RUNNING, ''
+
+
+def test_poll_concurrency():
+    events = []
+
+    job = SlowJob('test', 'test', {'pollinterval': '100',
+                                   'pollconcurrency': '8'},
+                  logger, events.append)
+    assert job.poller.concurrency == 8
+    started = time.time()
+    job.init()
+
+    # All probes run in parallel, so the sweep takes about as long as one.
+    wait(100, lambda: len(events) == 8)
+    assert time.time() - started < 0.5
+    assert set(ev.instance for ev in events) == \
+        set('inst%d' % i for i in range(8))
+
+    job.shutdown()
+
+
+def test_poll_worker_limit():
+    private = Scheduler()
+    jobs = [Job('test', 'test%d' % i, {'pollinterval': '100'}, logger,
+                lambda event: None) for i in range(6)]
+    # without a configured limit, there is a worker per job, but at least
+    # min_workers
+    assert private.worker_limit(jobs[0].poller) == private.min_workers
+    for job in jobs:
+        private.register(job.poller)
+        private.register(job.poller)
+    assert private.worker_limit(jobs[0].poller) == 6
+    private.unregister(jobs[0].poller)
+    assert private.worker_limit(jobs[0].poller) == 5
+    private.max_workers = 2
+    assert private.worker_limit(jobs[0].poller) == 2
+
+
+class BlockingJob(Job):
+    test_block = None
+
+    def service_status(self, service, instance):
+        if self.test_block:
+            self.test_block.wait()
+        return Job.service_status(self, service, instance)
+
+
+def test_lockfree_cache_read():
+    events = []
+
+    job = BlockingJob('test', 'test', {'pollinterval': '0.01'}, logger,
+                      events.append)
+    job.init()
+    wait(100, lambda: events)
+    job.poller.interval = 100.0  # keep cached results valid
+
+    # Let the next probe hang while holding the service lock.
+    job.test_block = threading.Event()
+    job.poll_now()
+    wait(100, lambda: job.service_lock('svc', 'inst').locked())
+
+    # Cached reads must not wait for the probe.
+    started = time.time()
+    assert job.polled_service_status('svc', 'inst') == (DEAD, 'ext')
+    assert time.time() - started < 0.1
+    # Other services are not locked.
+    assert not job.service_lock('svc', 'other').locked()
+
+    job.test_block.set()
+    job.shutdown()
+
+
+def test_adaptive_polling():
+    events = []
+
+    job = Job('test', 'test', {'pollinterval': '0.01',
+                               'pollinterval_min': '0.005',
+                               'pollinterval_max': '0.08'},
+              logger, events.append)
+    key = ('svc', 'inst')
+    job.init()
+    wait(100, lambda: events)
+    assert job.poller.current_interval(key) == 0.005
+
+    # Stable services back off to the maximum interval.
+    wait(100, lambda: job.poller.current_interval(key) == 0.08)
+
+    # A state change switches back to fast polling.
+    job.test_state = RUNNING
+    wait(100, lambda: events[-1].state == RUNNING)
+    assert job.poller.current_interval(key) < 0.08
+
+    # So does a control action.
+    wait(100, lambda: job.poller.current_interval(key) == 0.08)
+    job.invalidate('svc', 'inst')
+    assert job.poller.current_interval(key) == 0.005
+
+    job.shutdown()
+
+    # Without min/max configured, the interval is fixed.
+    job = Job('test', 'test', {'pollinterval': '0.01'}, logger, events.append)
+    job.init()
+    job.invalidate('svc', 'inst')
+    assert job.poller.current_interval(key) == 0.01
+    job.shutdown()
+
+
+class PidJob(Job):
+    test_proc = None
+    test_pidfile = None
+
+    def service_status(self, service, instance):
+        if self.test_proc and self.test_proc.poll() is None:
+            return RUNNING, ''
+        return DEAD, ''
+
+    def service_pidfile(self, service, instance):
+        return self.test_pidfile
+
+    def service_pid(self, service, instance):
+        if self.test_proc and self.test_proc.poll() is None:
+            return self.test_proc.pid
+        return None
+
+
+@mark.skipif(not watcher.can_watch_pids, reason='pidfd not supported')
+def test_watched_exit():
+    events = []
+
+    job = PidJob('test', 'test', {'pollinterval': '1'}, logger,
+                 events.append)
+    job.test_proc = subprocess.Popen([sys.executable, '-S', '-c',
+                                      'import time; time.sleep(100)'])
+    job.init()
+    wait(100, lambda: events)
+    assert events[-1].state == RUNNING
+    key = ('svc', 'inst')
+    wait(100, lambda: key in job.poller._pidwatches)
+    assert job.poller.current_interval(key) >= job.poller.watched_interval
+
+    # The exit is noticed immediately, not only after pollinterval.
+    job.test_proc.kill()
+    wait(100, lambda: events[-1].state == DEAD)
+    assert key not in job.poller._pidwatches
+
+    job.shutdown()
+
+
+@mark.skipif(not watcher.can_watch_files, reason='inotify not supported')
+def test_watched_pidfile(tmpdir):
+    events = []
+
+    job = PidJob('test', 'test', {'pollinterval': '100'}, logger,
+                 events.append)
+    job.test_pidfile = str(tmpdir.join('pidfile'))
+    job.init()
+    wait(100, lambda: events)
+    assert events[-1].state == DEAD
+
+    # Writing the pidfile triggers a poll.
+    job.test_proc = subprocess.Popen([sys.executable, '-S', '-c',
+                                      'import time; time.sleep(100)'])
+    tmpdir.join('pidfile').write(str(job.test_proc.pid))
+    wait(100, lambda: events[-1].state == RUNNING)
+    assert job.service_pid('svc', 'inst') == job.test_proc.pid
+
     job.shutdown()
+    job.test_proc.kill()
+    job.test_proc.wait()
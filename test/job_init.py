@@ -27,7 +27,7 @@
 import sys
 import logging
 
-from marche.jobs import RUNNING
+from marche.jobs import RUNNING, DEAD
 from marche.jobs.init import Job
 
 from test.utils import job_call_check
@@ -65,3 +65,13 @@ def test_job(tmpdir):
     assert job.service_description('foo', '') == 'descr'
     assert job.service_status('foo', '') == (RUNNING, '')
     job_call_check(job, 'foo', '', 'action', ['foo', 'action'])
+
+
+def test_missing_script(tmpdir):
+    job = Job('init', 'name', {'script': 'foo'}, logger, lambda event: None)
+    job.script = str(tmpdir.join('nonexisting'))
+    assert job.service_status('foo', '') == (DEAD, '')
+    job.start_service('foo', '')
+    job._processes['foo'].join(1)
+    assert job.service_status('foo', '') == (DEAD, '')
+    assert 'nonexisting' in ''.join(job.service_output('foo', ''))
@@ -82,7 +82,12 @@ def test_job(tmpdir):
     assert job.get_services() == [('nicos', ''), ('nicos', 'cache')]
     assert job.service_status('nicos', 'cache') == (RUNNING, '')
 
-    job_call_check(job, 'nicos', '', 'action ', ['action'])
+    # actions on all services exclude actions on single services
+    with job.service_lock('nicos', ''):
+        assert job.service_lock('nicos', 'cache').locked()
+    assert not job.service_lock('nicos', 'cache').locked()
+
+    job_call_check(job, 'nicos', '', 'action', ['action'])
     job_call_check(job, 'nicos', 'cache', 'action cache', ['cache', 'action'])
 
     assert job.service_logs('nicos', '') == {}
@@ -0,0 +1,441 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# Marche - A server control daemon
+# Copyright (c) 2015-2016 by the authors, see LICENSE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# Module authors:
+#   Georg Brandl <g.brandl@fz-juelich.de>
+#
+# *****************************************************************************
+
+"""Test for log file access."""
+
+import os
+import re
+import gzip
+import time
+import logging
+
+from pytest import mark, raises
+
+from marche import logs
+from marche.jobs import Fault
+
+from test.utils import wait
+
+LINES = b''.join(('line %d\r\n' % i).encode() for i in range(1000))
+
+
+def test_list_logfiles(tmpdir):
+    logfile = tmpdir.join('svc.log')
+    assert logs.list_logfiles(str(logfile)) == []
+
+    logfile.write_binary(b'current\n')
+    tmpdir.join('svc.log.1').write_binary(b'first\n')
+    with gzip.open(str(tmpdir.join('svc.log.2.gz')), 'wb') as fp:
+        fp.write(LINES)
+    tmpdir.join('svc.log.10').write_binary(b'')
+    tmpdir.join('svc.log.old').write_binary(b'')
+    tmpdir.join('other.log.1').write_binary(b'')
+
+    files = logs.list_logfiles(str(logfile))
+    assert [(f['name'], f['rotation']) for f in files] == [
+        (str(logfile), 0),
+        (str(tmpdir.join('svc.log.1')), 1),
+        (str(tmpdir.join('svc.log.2.gz')), 2),
+        (str(tmpdir.join('svc.log.10')), 3),
+    ]
+    assert files[0]['size'] == 8
+    assert files[0]['mtime'] == os.stat(str(logfile)).st_mtime
+
+
+def test_list_logfiles_dated(tmpdir):
+    tmpdir.join('daemon-2016-01-01.log').write_binary(b'old\n')
+    tmpdir.join('daemon-2016-01-02.log').write_binary(b'new\n')
+    tmpdir.join('daemon-2016-01-03.log').write_binary(b'newest\n')
+    tmpdir.join('other.txt').write_binary(b'')
+    os.utime(str(tmpdir.join('daemon-2016-01-01.log')), (1000, 1000))
+    os.utime(str(tmpdir.join('daemon-2016-01-02.log')), (2000, 2000))
+    current = tmpdir.join('current')
+    current.mksymlinkto(tmpdir.join('daemon-2016-01-03.log'))
+
+    files = logs.list_logfiles(str(current), dated=True)
+    assert [f['name'] for f in files] == [
+        str(tmpdir.join('daemon-2016-01-03.log')),
+        str(tmpdir.join('daemon-2016-01-02.log')),
+        str(tmpdir.join('daemon-2016-01-01.log')),
+    ]
+
+
+def test_read_logfile(tmpdir):
+    plain = tmpdir.join('log')
+    plain.write_binary(LINES)
+    assert logs.read_logfile(str(plain), 2) == 'line 998\nline 999\n'
+
+    gzipped = str(tmpdir.join('log.1.gz'))
+    with gzip.open(gzipped, 'wb') as fp:
+        fp.write(LINES + b'unterminated')
+    assert logs.read_logfile(gzipped, 2) == 'line 999\nunterminated'
+    with logs.open_logfile(gzipped) as fp:
+        assert fp.read() == LINES + b'unterminated'
+
+
+@mark.skipif(logs.lzma is None, reason='lzma not available')
+def test_read_logfile_xz(tmpdir):
+    xzipped = str(tmpdir.join('log.1.xz'))
+    with logs.lzma.open(xzipped, 'wb') as fp:
+        fp.write(LINES * 100)
+    assert logs.read_logfile(xzipped, 1) == 'line 999\n'
+
+
+def test_read_since(tmpdir):
+    logfile = tmpdir.join('log')
+    logfile.write_binary(LINES)
+    data, cursor = logs.read_since(str(logfile), None, 2)
+    assert data == 'line 998\nline 999\n'
+    inode, offset = logs.parse_cursor(cursor)
+    assert inode == os.stat(str(logfile)).st_ino
+    assert offset == len(LINES)
+
+    # nothing new
+    assert logs.read_since(str(logfile), cursor) == ('', cursor)
+
+    # incomplete lines are left for the next call
+    with open(str(logfile), 'ab') as fp:
+        fp.write(b'new 1\nnew')
+    data, cursor = logs.read_since(str(logfile), cursor)
+    assert data == 'new 1\n'
+    with open(str(logfile), 'ab') as fp:
+        fp.write(b' 2\n')
+    data, cursor = logs.read_since(str(logfile), cursor)
+    assert data == 'new 2\n'
+
+    # rotation: the rest of the old file is read first
+    with open(str(logfile), 'ab') as fp:
+        fp.write(b'last\n')
+    logfile.rename(tmpdir.join('log.1'))
+    logfile.write_binary(b'first\n')
+    data, cursor = logs.read_since(str(logfile), cursor)
+    assert data == 'last\nfirst\n'
+    assert logs.parse_cursor(cursor) == (os.stat(str(logfile)).st_ino, 6)
+
+    # truncation
+    logfile.write_binary(b'x\n')
+    data, cursor = logs.read_since(str(logfile), cursor)
+    assert data == 'x\n'
+
+    # invalid cursors start again with the tail
+    assert logs.parse_cursor('garbage') == (None, None)
+    assert logs.read_since(str(logfile), 'garbage')[0] == 'x\n'
+
+
+def test_read_since_dated(tmpdir):
+    # logs that switch a symlink to a new file every day
+    old = tmpdir.join('daemon-2016-01-30.log')
+    old.write_binary(b'old 1\n')
+    current = tmpdir.join('current')
+    current.mksymlinkto(old.basename)
+    data, cursor = logs.read_since(str(current), None, dated=True)
+    assert data == 'old 1\n'
+
+    with open(str(old), 'ab') as fp:
+        fp.write(b'old 2\n')
+    new = tmpdir.join('daemon-2016-01-31.log')
+    new.write_binary(b'new 1\n')
+    current.remove()
+    current.mksymlinkto(new.basename)
+    data, cursor = logs.read_since(str(current), cursor, dated=True)
+    assert data == 'old 2\nnew 1\n'
+    assert logs.parse_cursor(cursor) == (os.stat(str(new)).st_ino, 6)
+
+
+def test_job_logs_since(tmpdir):
+    from marche.jobs.base import Job, LogfileMixin
+
+    class LogJob(LogfileMixin, Job):
+        def configure(self, config):
+            self.configure_logfile_mixin(config)
+
+    tmpdir.join('log.real').write_binary(b'a\nb\n')
+    logfile = tmpdir.join('log')
+    logfile.mksymlinkto('log.real')
+    job = LogJob('test', 'test', {'logfile': str(logfile), 'pollinterval': 0},
+                 logging.getLogger('testlogs'), lambda event: None)
+    files, cursors = job.service_logs_since('test', '', {})
+    # files are keyed by their configured name
+    name = str(logfile)
+    assert files == {name: 'a\nb\n'}
+    with open(str(logfile), 'ab') as fp:
+        fp.write(b'c\n')
+    files, cursors = job.service_logs_since('test', '', cursors)
+    assert files == {name: 'c\n'}
+
+
+@mark.parametrize('polling', [False, True])
+def test_follower(tmpdir, polling):
+    logfile = tmpdir.join('log')
+    logfile.write_binary(b'old\n')
+    _, cursor = logs.read_since(str(logfile))
+    name = str(logfile.realpath())
+
+    received = []
+    follower = logs.LogFollower([str(logfile)],
+                                lambda *args: received.append(args),
+                                {name: cursor})
+    follower.delay = 0.05
+    follower.poll_interval = 0.05
+    if polling:
+        follower._polling = True
+    follower.start()
+    try:
+        # a burst of writes is reported at once
+        with open(str(logfile), 'ab') as fp:
+            for i in range(10):
+                fp.write(('new %d\n' % i).encode())
+                fp.flush()
+        wait(300, lambda: received)
+        assert received[0][0] == {
+            name: ''.join('new %d\n' % i for i in range(10))}
+        assert received[0][1][name] == logs.make_cursor(
+            os.stat(name).st_ino, len(b'old\n') + 60)
+        # a new subscriber gets the lines up to the follower's cursors
+        with open(str(logfile), 'ab') as fp:
+            fp.write(b'unflushed\n')
+        files, cursors = follower.snapshot()
+        offset = logs.parse_cursor(cursors[name])[1]
+        assert offset >= len(b'old\n') + 60
+        with open(name) as fp:
+            assert files[name] == fp.read()[:offset]
+        # rotation
+        logfile.rename(tmpdir.join('log.1'))
+        logfile.write_binary(b'rotated\n')
+        wait(300, lambda: ''.join(r[0][name] for r in received)
+             .endswith('rotated\n'))
+    finally:
+        follower.stop()
+    assert not follower._handles
+
+
+T0 = time.mktime((2016, 1, 31, 12, 0, 0, 0, 0, -1))
+
+
+def timestamped(start, n):
+    """Return n log lines, 10 seconds apart, with a continuation line every
+    10 lines."""
+    lines = []
+    for i in range(start, start + n):
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(T0 + 10 * i))
+        lines.append(('%s,500 : INFO : message %d\n' % (stamp, i)).encode())
+        if i % 10 == 0:
+            lines.append(b'    continued\n')
+    return b''.join(lines)
+
+
+def test_iso_timestamp():
+    assert logs.iso_timestamp(b'2016-01-31 12:00:10,250 : x', '') == \
+        T0 + 10.25
+    assert logs.iso_timestamp(b'2016-01-31T12:00:00 x', '') == T0
+    assert logs.iso_timestamp(b'   continued', '') is None
+
+
+def test_log_index(tmpdir):
+    logfile = tmpdir.join('log')
+    logfile.write_binary(timestamped(0, 2500))
+    name = str(logfile)
+    with open(name, 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        mm = logs.mmap.mmap(fp.fileno(), st.st_size,
+                            access=logs.mmap.ACCESS_READ)
+    index = logs.LogIndex(name, logs.iso_timestamp)
+    index.update(mm, st)
+    assert len(index.offsets) == 3
+    assert index.first == T0 + 0.5
+    assert index.last == T0 + 24990.5
+    assert abs(index.timestamps[1] - (T0 + 9090.5)) < 20
+    assert index.start_offset(T0) == 0
+    assert index.start_offset(T0 + 10000) == index.offsets[1]
+    mm.close()
+
+    # growing files are only indexed incrementally
+    with open(name, 'ab') as fp:
+        fp.write(timestamped(2500, 1000))
+    with open(name, 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        mm = logs.mmap.mmap(fp.fileno(), st.st_size,
+                            access=logs.mmap.ACCESS_READ)
+    offsets = index.offsets[:]
+    index.update(mm, st)
+    assert index.offsets[:3] == offsets
+    assert len(index.offsets) == 4
+    assert index.last == T0 + 34990.5
+    mm.close()
+
+
+def test_search_logfiles(tmpdir):
+    tmpdir.join('log').write_binary(timestamped(2000, 1000))
+    tmpdir.join('log.1').write_binary(timestamped(1000, 1000))
+    with gzip.open(str(tmpdir.join('log.2.gz')), 'wb') as fp:
+        fp.write(timestamped(0, 1000))
+    os.utime(str(tmpdir.join('log.1')), (T0 + 20000, T0 + 20000))
+    os.utime(str(tmpdir.join('log.2.gz')), (T0 + 10000, T0 + 10000))
+    names = [str(tmpdir.join(n)) for n in ('log.2.gz', 'log.1', 'log')]
+
+    regex = re.compile(br'message \d*7\b')
+    found = list(logs.search_logfiles(names, regex))
+    assert len(found) == 300
+    assert found[0] == (names[0], timestamped(7, 1))
+    assert found[-1] == (names[2], timestamped(2997, 1))
+
+    found = list(logs.search_logfiles(names, regex, limit=150))
+    assert len(found) == 150
+    assert found[-1][0] == names[1]
+
+    found = list(logs.search_logfiles(names, regex, since=T0 + 15000))
+    assert found[0] == (names[1], timestamped(1507, 1))
+    assert len(found) == 150
+
+    found = list(logs.search_logfiles(names, re.compile(b'continued')))
+    assert len(found) == 300
+    assert found[0] == (names[0], b'    continued\n')
+
+    # anchors match at line boundaries
+    found = list(logs.search_logfiles(names, re.compile(b'^ +cont', re.M)))
+    assert len(found) == 300
+    found = list(logs.search_logfiles(names, re.compile(br'2$', re.M)))
+    assert len(found) == 300
+    assert found[1] == (names[0], timestamped(12, 1))
+
+    # matches spanning lines are not reported
+    regex = re.compile(br'message 1\n\d+', re.M)
+    assert list(logs.search_logfiles(names, regex)) == []
+    regex = re.compile(br'message \d+\s+cont', re.M)
+    assert list(logs.search_logfiles(names, regex)) == []
+    regex = re.compile(br'(message 3\n.*)?message 3\b', re.M)
+    assert list(logs.search_logfiles(names[2:], regex)) == []
+    assert list(logs.search_logfiles(names[:1], regex)) == [
+        (names[0], timestamped(3, 1))]
+
+
+def test_job_search_logs(tmpdir):
+    from marche.jobs.base import Job, LogfileMixin
+
+    class LogJob(LogfileMixin, Job):
+        def configure(self, config):
+            self.configure_logfile_mixin(config)
+
+    logfile = tmpdir.join('log')
+    logfile.write_binary(timestamped(0, 100) + b'\xff unterminated')
+    job = LogJob('test', 'test', {'logfile': str(logfile), 'pollinterval': 0},
+                 logging.getLogger('testlogs'), lambda event: None)
+    name = str(logfile.realpath())
+    assert job.service_search_logs('test', '', 'message 4[23]') == {
+        name: timestamped(42, 2).decode()}
+    assert job.service_search_logs('test', '', 'unterm') == {
+        name: ' unterminated'}
+    assert job.service_search_logs('test', '', '^ *cont') == {
+        name: '    continued\n' * 10}
+    assert job.service_search_logs('test', '', 'message 4[23]$') == {
+        name: timestamped(42, 2).decode()}
+    assert job.service_search_logs('test', '', 'message 9\n') == {}
+    assert job.service_search_logs('test', '', 'nothing') == {}
+    assert raises(Fault, job.service_search_logs, 'test', '', '(')
+
+
+def test_daily_timestamp(tmpdir):
+    assert logs.daily_timestamp(b'12:00:10,250 : INFO : x',
+                                'daemon-2016-01-31.log') == T0 + 10.25
+    assert logs.daily_timestamp(b'Traceback', 'daemon-2016-01-31.log') is None
+    logfile = tmpdir.join('undated.log')
+    logfile.write('')
+    os.utime(str(logfile), (T0, T0))
+    assert logs.daily_timestamp(b'12:00:00 x', str(logfile)) == T0
+
+
+def test_find_time(tmpdir):
+    logfile = tmpdir.join('log')
+    logfile.write_binary(timestamped(0, 5000))
+    mm, _ = logs._map(str(logfile))
+    parse = logs.iso_timestamp
+    name = str(logfile)
+    lines = timestamped(0, 5000)
+    assert logs.find_time(mm, T0 - 100, parse, name) == 0
+    assert logs.find_time(mm, T0 + 100000, parse, name) == len(lines)
+    offset = lines.index(timestamped(1234, 1))
+    assert logs.find_time(mm, T0 + 12340, parse, name) == offset
+    assert logs.find_time(mm, T0 + 12340.5, parse, name) == offset
+    assert logs.find_time(mm, T0 + 12340.5, parse, name, after=True) == \
+        lines.index(timestamped(1235, 1))
+    # continuation lines belong to the preceding line
+    assert logs.find_time(mm, T0 + 12400.5, parse, name, after=True) == \
+        lines.index(timestamped(1241, 1))
+    mm.close()
+
+
+def test_read_logrange(tmpdir):
+    tmpdir.join('log').write_binary(timestamped(2000, 1000))
+    tmpdir.join('log.1').write_binary(timestamped(1000, 1000))
+    with gzip.open(str(tmpdir.join('log.2.gz')), 'wb') as fp:
+        fp.write(timestamped(0, 1000))
+    names = [str(tmpdir.join(n)) for n in ('log.2.gz', 'log.1', 'log')]
+
+    assert logs.read_logrange(names[1], T0 + 12000, T0 + 12100.5) == \
+        timestamped(1200, 11)
+    assert logs.read_logrange(names[1], T0 + 100, T0 + 200) is None
+    assert logs.read_logrange(names[2], T0 + 100, T0 + 200) is None
+    assert logs.read_logrange(names[0], T0 + 95, T0 + 200.5) == \
+        timestamped(10, 11)
+    assert logs.read_logrange(names[0], T0 - 10, T0 - 5) is None
+    # range queries bisect without building an index...
+    assert names[1] not in logs._indexes
+    # ...but use one if it already exists
+    mm, st = logs._map(names[1])
+    index = logs.get_index(names[1], mm, st, logs.iso_timestamp)
+    mm.close()
+    assert logs.known_offset(names[1], st, logs.iso_timestamp,
+                             T0 + 19950) == index.offsets[1] > 0
+    assert logs.read_logrange(names[1], T0 + 19950, T0 + 19970.5) == \
+        timestamped(1995, 3)
+
+    old_limit = logs.RANGE_LIMIT
+    logs.RANGE_LIMIT = 1000
+    try:
+        data = logs.read_logrange(names[1], T0, T0 + 100000)
+        assert len(data) <= 1000
+        assert timestamped(1000, 30).startswith(data)
+        assert data.endswith(b'\n')
+    finally:
+        logs.RANGE_LIMIT = old_limit
+
+
+def test_job_log_range(tmpdir):
+    from marche.jobs.nicos import Job
+
+    logdir = tmpdir.join('log', 'cache').ensure(dir=True)
+    lines = b''.join(('%s,000 : INFO : line %d\n' % (
+        time.strftime('%H:%M:%S', time.localtime(T0 + i)), i)).encode()
+        for i in range(3600))
+    logdir.join('cache-2016-01-31.log').write_binary(lines)
+    logdir.join('current').mksymlinkto('cache-2016-01-31.log')
+
+    job = Job('nicos', 'nicos', {'root': str(tmpdir), 'pollinterval': '0'},
+              logging.getLogger('testlogs'), lambda event: None)
+    job._logpath = str(tmpdir.join('log'))
+    result = job.service_log_range('nicos', 'cache', T0 + 600, T0 + 602)
+    assert list(result.values()) == [
+        '12:10:00,000 : INFO : line 600\n12:10:01,000 : INFO : line 601\n'
+        '12:10:02,000 : INFO : line 602\n']
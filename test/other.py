@@ -30,12 +30,15 @@ import json
 import time
 import socket
 import logging
+import subprocess
+import threading
 
-from pytest import raises
+from pytest import raises, mark
 from marche.six import StringIO
 
 from marche.protocol import Events, Event, AuthEvent
 from marche import utils, colors, loggers
+from marche.watch import Watcher
 
 from test.utils import LogHandler
 
@@ -78,19 +81,34 @@ def test_utils(tmpdir):
 
     assert utils.extract_loglines(str(tmpdir.join('nope'))) == {}
     tmpdir.join('logfile').write(''.join('a%d\n' % i for i in range(10)))
+    # rotated logs: not included
     tmpdir.join('logfile.1').write(''.join('b%d\n' % i for i in range(10)))
-    # broken chain of numbers: not included
-    tmpdir.join('logfile.3').write(''.join('c%d\n' % i for i in range(10)))
     logs = utils.extract_loglines(str(tmpdir.join('logfile')), 2)
-    assert len(logs) == 2
+    assert len(logs) == 1
     for key, value in logs.items():
         if key.endswith('logfile'):
             assert value == 'a8\na9\n'
-        elif key.endswith('logfile.1'):
-            assert value == 'b8\nb9\n'
         else:
             assert False, 'unexpected key'
 
+    tmpfile.write_binary(b'x' * 100 + b'\n' + b'y\r\n' * 50 + b'\x01z')
+    for blocksize in (1, 7, 100, 1000):
+        assert utils.read_tail(str(tmpfile), 0, blocksize) == b''
+        assert utils.read_tail(str(tmpfile), 1, blocksize) == b'\x01z'
+        assert utils.read_tail(str(tmpfile), 3, blocksize) == \
+            b'y\r\ny\r\n\x01z'
+        assert utils.read_tail(str(tmpfile), 52, blocksize) == \
+            b'x' * 100 + b'\n' + b'y\r\n' * 50 + b'\x01z'
+        assert utils.read_tail(str(tmpfile), 60, blocksize) == \
+            b'x' * 100 + b'\n' + b'y\r\n' * 50 + b'\x01z'
+    assert utils.extract_loglines(str(tmpfile), 2) == \
+        {os.path.realpath(str(tmpfile)): 'y\nz'}
+    assert utils.read_tail(str(tmpfile), 3, with_start=True) == \
+        (b'y\r\ny\r\n\x01z', 245)
+    assert utils.read_tail(str(tmpfile), 60, 7, with_start=True)[1] == 0
+    assert utils.tail_truncated(str(tmpfile), 51)
+    assert not utils.tail_truncated(str(tmpfile), 52)
+
     fqdn = socket.getfqdn('localhost')
     assert utils.normalize_addr('localhost', 147) == (fqdn, '147')
     assert utils.normalize_addr('localhost:32', 147) == (fqdn, '32')
@@ -122,11 +140,153 @@ def test_async_process(tmpdir):
                               sh=False)
     proc.start()
     proc.join()
-    assert proc.stderr == ['stderr\n']
-    assert proc.stdout == ['stdout\n']
+    assert list(proc.stderr) == ['stderr\n']
+    assert list(proc.stdout) == ['stdout\n']
     assert proc.retcode == 3
     assert proc.done
 
+    # A process writing lots to both pipes does not block on either of them.
+    code = '''if True:
+    import sys
+    sys.stderr.write("e" * 1000000 + "\\n")
+    sys.stdout.write("o" * 1000000 + "\\n")
+    '''
+    out = utils.OutputBuffer(1000)
+    proc = utils.AsyncProcess(0, logger, [sys.executable, '-S', '-c', code],
+                              sh=False, stdout=out, stderr=out)
+    proc.start()
+    proc.join(10)
+    assert proc.retcode == 0
+    assert len(out) <= 2000
+    assert proc.done
+
+    # Output is kept up to a limit by default, and stderr is logged per line.
+    code = '''if True:
+    import sys, time
+    sys.stderr.write("first ")
+    sys.stderr.flush()
+    time.sleep(0.1)
+    sys.stderr.write("line\\nsecond line\\nno newline")
+    '''
+    nwarnings = len(testhandler.warnings)
+    proc = utils.AsyncProcess(0, logger, [sys.executable, '-S', '-c', code],
+                              sh=False)
+    assert proc.stdout.size == proc.stderr.size == proc.output_size
+    proc.start()
+    proc.join(10)
+    assert [r.getMessage() for r in testhandler.warnings[nwarnings:]] == [
+        'first line', 'second line', 'no newline']
+
+
+@mark.skipif(os.name == 'nt', reason='POSIX only')
+def test_async_process_reactor():
+    # Many processes are handled without a thread per process.
+    procs = [utils.AsyncProcess(0, logger, [sys.executable, '-S', '-c',
+                                            'print(%d)' % i], sh=False)
+             for i in range(20)]
+    nthreads = threading.active_count()
+    for proc in procs:
+        proc.start()
+    assert threading.active_count() <= nthreads + 1
+    for i, proc in enumerate(procs):
+        proc.join()
+        assert proc.retcode == 0
+        assert list(proc.stdout) == ['%d\n' % i]
+
+    # A process that leaves a child holding its output pipe is finished
+    # once it exits itself.
+    started = time.time()
+    proc = utils.AsyncProcess(0, logger, 'sleep 5 & echo out')
+    proc.start()
+    proc.join()
+    assert list(proc.stdout) == ['out\n']
+    assert time.time() - started < 2
+
+
+@mark.skipif(not hasattr(os, 'posix_spawnp'), reason='needs posix_spawn')
+def test_async_process_spawn():
+    # Argument lists are passed on without a shell interpreting them.
+    proc = utils.AsyncProcess(0, logger, [
+        sys.executable, '-S', '-c', 'import sys; print(sys.argv[1])',
+        '$HOME; exit 1'], sh=False)
+    proc.start()
+    proc.join()
+    assert isinstance(proc.proc, utils.SpawnedProcess)
+    assert list(proc.stdout) == ['$HOME; exit 1\n']
+    assert proc.retcode == 0
+
+    # A command that cannot be run fails like it would in the shell.
+    proc = utils.AsyncProcess(0, logger, ['nonexisting_binary'], sh=False)
+    proc.start()
+    proc.join(1)
+    assert proc.done
+    assert proc.retcode == 127
+    assert proc.proc is None
+    assert 'nonexisting_binary' in proc.stderr.getvalue().decode()
+
+
+def test_output_buffer():
+    buf = utils.OutputBuffer(10)
+    buf.append(b'abc\r\n')
+    buf.append('d\xe4\n')
+    assert list(buf) == ['abc\n', 'd\xe4\n']
+    assert len(buf) == 9
+    # old data is discarded, together with the partial first line
+    buf.append(b'0123456789\n')
+    buf.append(b'x\ny\n')
+    assert buf.lines() == ['x\n', 'y\n']
+    assert buf.getvalue() == b'x\ny\n'
+
+    buf = utils.OutputBuffer()
+    buf.append(b'a' * 100000)
+    assert buf.getvalue() == b'a' * 100000
+
+
+@mark.skipif(os.name == 'nt', reason='needs process groups')
+def test_async_process_timeout():
+    # The whole process group is killed, including the shell's children.
+    proc = utils.AsyncProcess(0, logger, 'sleep 10; sleep 10', timeout=0.2)
+    started = time.time()
+    proc.start()
+    proc.join(5)
+    assert proc.done
+    assert proc.timed_out
+    assert proc.retcode < 0
+    assert time.time() - started < 3
+    assert proc.stderr.lines()[-1] == '*** timed out after 0.2 seconds\n'
+
+    proc = utils.AsyncProcess(0, logger, ['sleep', '0'], sh=False, timeout=5)
+    proc.start()
+    proc.join()
+    assert not proc.timed_out
+    assert proc.retcode == 0
+
+
+@mark.skipif(not Watcher().can_watch_pids, reason='pidfd not supported')
+def test_unwatch_reused_fd():
+    watcher = Watcher()
+    procs = [subprocess.Popen([sys.executable, '-S', '-c',
+                               'import time; time.sleep(100)'])
+             for _ in range(2)]
+    try:
+        first = watcher.watch_pid(procs[0].pid, lambda: None)
+        # simulate the watcher thread firing and closing the first watch...
+        with watcher._lock:
+            del watcher._pidfds[first.fd]
+            watcher._poller.unregister(first.fd)
+            os.close(first.fd)
+        # ...and its fd number being reused for another watch
+        second = watcher.watch_pid(procs[1].pid, lambda: None)
+        assert second.fd == first.fd
+        watcher.unwatch(first)
+        assert watcher._pidfds[second.fd] is second
+        watcher.unwatch(second)
+        assert not watcher._pidfds
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
 
 def test_colors():
     blue = colors.colorcode('blue')
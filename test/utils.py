@@ -30,7 +30,8 @@ import logging
 from marche.jobs import Fault, Busy, Unauthorized, DEAD, RUNNING
 from marche.jobs.base import Job as BaseJob
 from marche.protocol import ServiceListEvent, StatusEvent, LogfileEvent, \
-    ConffileEvent, ControlOutputEvent, FoundHostEvent
+    ConffileEvent, ControlOutputEvent, FoundHostEvent, LogCatalogueEvent, \
+    AllStatusEvent, EventsEvent
 from marche.auth import AuthFailed
 from marche.permission import ClientInfo, DISPLAY, ADMIN, NONE
 
@@ -84,21 +85,27 @@ class LogHandler(logging.Handler):
 
 
 class MockAsyncProcess(object):
-    def __init__(self, status, log, cmd, sh, stdout=None, stderr=None):
+    def __init__(self, status, log, cmd, sh, stdout=None, stderr=None,
+                 timeout=None):
         self.status = status
         self.log = log
         self.cmd = cmd
         self.use_sh = sh
+        self.timeout = timeout
         self.stdout = stdout if stdout is not None else []
         self.stderr = stderr if stderr is not None else []
         self.done = False
         self.retcode = None
+        self.timed_out = False
 
     def start(self):
         time.sleep(0.01)
         self.stdout.append('output\n')
         self.stderr.append('error\n')
         self.retcode = 1 if self.cmd == 'fail' else 0
+        if self.cmd == 'hang':
+            self.retcode = -15
+            self.timed_out = True
         self.done = True
 
     def join(self):
@@ -110,6 +117,7 @@ class MockJobHandler(object):
     test_interface = None
     test_reloaded = False
     test_svc_list_error = False
+    test_following = []
     unauth_level = NONE
     uid = 'deadcafe'
 
@@ -143,6 +151,19 @@ class MockJobHandler(object):
     def get_service_description(self, client, service, instance):
         return 'desc'
 
+    def request_events_since(self, client, since):
+        if since != 5:
+            return EventsEvent(events=[], last=6, resync=True, uid=self.uid)
+        event = StatusEvent(service='svc', instance='inst', state=RUNNING,
+                            ext_status=None)
+        event.seq = 6
+        return EventsEvent(events=[event.to_dict()], last=6, resync=False,
+                           uid=self.uid)
+
+    def request_all_status(self, client):
+        return AllStatusEvent(services={'svc': {'': (DEAD, ''),
+                                                'inst': (RUNNING, 'ext')}})
+
     def request_service_status(self, client, service, instance):
         return StatusEvent(service=service, instance=instance,
                            state=DEAD, ext_status='ext_status')
@@ -156,6 +177,40 @@ class MockJobHandler(object):
                             files={'file1': 'line1\nline2\n',
                                    'file2': 'line3\nline4\n'})
 
+    def request_logs_since(self, client, service, instance, cursors):
+        return LogfileEvent(service=service, instance=instance,
+                            files={'file1': 'line3\n'},
+                            cursors={'file1': '1:%d' % (
+                                int(cursors.get('file1', '1:0')[2:]) + 6)})
+
+    def search_logfiles(self, client, service, instance, regex, since=None,
+                        limit=None):
+        return LogfileEvent(service=service, instance=instance,
+                            files={'file1': '%s %s %s\n' % (regex, since,
+                                                            limit)})
+
+    def request_log_range(self, client, service, instance, t_start, t_end):
+        return LogfileEvent(service=service, instance=instance,
+                            files={'file1': '%s-%s\n' % (t_start, t_end)})
+
+    def follow_logfiles(self, client, service, instance):
+        self.test_following.append((service, instance))
+        return LogfileEvent(service=service, instance=instance,
+                            files={'file1': 'line1\n'},
+                            cursors={'file1': '1:6'})
+
+    def unfollow_logfiles(self, client, service, instance):
+        self.test_following.remove((service, instance))
+
+    def request_log_catalogue(self, client, service, instance):
+        return LogCatalogueEvent(service=service, instance=instance,
+                                 files=[{'name': 'file1', 'rotation': 0,
+                                         'size': 2**40, 'mtime': 0.0}])
+
+    def request_logfile(self, client, service, instance, filename):
+        return LogfileEvent(service=service, instance=instance,
+                            files={filename: 'line1\nline2\n'})
+
     def request_conffiles(self, client, service, instance):
         return ConffileEvent(service=service, instance=instance,
                              files={'file1': 'line1\nline2\n',
@@ -236,6 +291,13 @@ class MockJob(BaseJob):
     def service_logs(self, service, instance):
         return {'log:' + instance: service}
 
+    def service_log_catalogue(self, service, instance):
+        return [{'name': 'log:' + instance, 'rotation': 0,
+                 'size': 0, 'mtime': 0.0}]
+
+    def service_logfile(self, service, instance, filename, n=500):
+        return {filename: service}
+
     def start_service(self, service, instance):
         if service == 'svc1':
             raise Busy